@@ -1,144 +1,4193 @@
 # Import relevant packages
 import os
-import shutil
-from typing import Dict
-from fastapi import FastAPI, HTTPException, Request, Query, Body
-from fastapi.responses import JSONResponse
+import sys
+import json
+import time
+import stat
+import math
+import heapq
+import bisect
+import base64
+import hashlib
+import hmac
+import re
+import mimetypes
+from array import array
+import struct
+import zlib
+import fcntl
+import uuid
+import tempfile
+import importlib
+import importlib.util
+import asyncio
+import threading
+import contextvars
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from contextlib import contextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from itertools import islice, accumulate
+from operator import attrgetter
+from typing import Dict, List
+from dataclasses import dataclass, fields
+from fastapi import FastAPI, HTTPException, Request, Query, Body, Header
+from fastapi.responses import JSONResponse, StreamingResponse, Response, PlainTextResponse
+from starlette.datastructures import Headers, MutableHeaders
 from pydantic import BaseModel # Pydantic helps to parse json request bodies
 
 # TODO: ADD A PUT METHOD 
 # TODO: ADD PERMISSION AND OWNER CONTROLS FOR FILE CREATION
 # TODO: CREATE A HELM CHART
 
+# FAST_STARTUP turns off the docs and the OpenAPI schema (unless DOCS_ENABLED is true). 
+# It does not measurably shorten the startup itself, which is almost all importing FastAPI and registering the routes (see benchmarks/bench_startup.py)
+fast_startup = os.environ.get("FAST_STARTUP", "false").lower() == "true"
+docs_enabled = os.environ.get("DOCS_ENABLED", "false" if fast_startup else "true").lower() == "true"
+
 # Instantiate the FastAPI 
 app = FastAPI(name = 'Local File Directory Browsing Service', 
             description = "An app that can browse a local file system given a root directory upon launching and can add or empty/delete files or folders",
-            version = "0.1.0")
+            version = "0.1.0", 
+            docs_url = '/docs' if docs_enabled else None, 
+            redoc_url = '/redoc' if docs_enabled else None, 
+            openapi_url = '/openapi.json' if docs_enabled else None)
 
 # Get the environment variable from the .sh script
 root_path = os.environ.get("ROOT_DIR", os.getcwd())
 
-def does_exist(path: str):
-    """Checks whether a file path exists on the local file system and raises an error if not. This can be used for both files and folders. 
+# A single stat, so that a wrong ROOT_DIR stops the app from starting instead of failing every request
+if not os.path.isdir(root_path):
+    raise RuntimeError("ROOT_DIR {} is not a folder".format(root_path))
+
+# The page size used for a folder listing when a cursor is sent without a limit
+default_page_limit = 1000
+
+# The JSON encoder of the GET responses: auto (the fastest one installed), orjson, msgspec or json (the standard library)
+json_backend = os.environ.get("JSON_BACKEND", "auto")
+
+
+def load_json_encoder(backend: str):
+    """Picks the JSON encoder used by FastJSONResponse. orjson and msgspec are optional packages that encode several times faster than the standard library
 
     Args:
-        path (str): A string path to a folder or file
+        backend (str): auto, orjson, msgspec or json
 
     Raises:
-        HTTPException: File or folder not found, check input
+        ImportError: If orjson or msgspec was asked for but is not installed
+
+    Returns:
+        tuple: The name of the encoder and a function that encodes a value (including dataclasses) to compact JSON bytes
     """    
 
-    if not os.path.exists(path):
-        raise HTTPException(status_code=404, detail="File or folder not found")
+    if backend in ('auto', 'orjson'):
+        try:
+            import orjson
+            return 'orjson', orjson.dumps
+        except ImportError:
+            if backend == 'orjson':
+                raise
 
+    if backend in ('auto', 'msgspec'):
+        try:
+            import msgspec
+            return 'msgspec', msgspec.json.encode
+        except ImportError:
+            if backend == 'msgspec':
+                raise
 
-def get_file_metadata(file_path: str):
-    """Gets the file metadata so that if a GET request is sent to retrieve a file, the metadata is presented
+    def dumps(content):
+        return json.dumps(content, ensure_ascii = False, separators = (',', ':'), default = vars).encode('utf-8')
 
-    Args:
-        file_path (str): An appropriate file path that has been checked with the does_exist function above
+    return 'json', dumps
+
+
+json_backend_name, json_dumps = load_json_encoder(json_backend)
+
+
+class FastJSONResponse(JSONResponse):
+    """A JSONResponse that encodes with the encoder picked by load_json_encoder, which also encodes the FolderEntry and FileMetadata dataclasses directly"""    
+
+    def render(self, content) -> bytes:
+        with serialize_seconds.time(trace = 'serialize'):
+            return json_dumps(content)
+
+# Limits of the in memory cache of stats, folder listings and small text files. Setting CACHE_MAX_ENTRIES to 0 turns the cache off
+cache_max_entries = int(os.environ.get("CACHE_MAX_ENTRIES", 4096))
+cache_max_bytes = int(os.environ.get("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+cache_ttl = float(os.environ.get("CACHE_TTL", 60))
+cache_max_file_bytes = int(os.environ.get("CACHE_MAX_FILE_BYTES", 256 * 1024))
+
+# How changes made outside of the app are picked up: auto (inotify when available, otherwise poll), inotify, poll or off
+cache_watcher = os.environ.get("CACHE_WATCHER", "auto")
+cache_poll_interval = float(os.environ.get("CACHE_POLL_INTERVAL", 2))
+
+# Blocking file system calls run on dedicated executors, so that slow mutations (such as emptying a large folder) never take the workers of cheap reads
+io_read_workers = int(os.environ.get("IO_READ_WORKERS", 32))
+io_write_workers = int(os.environ.get("IO_WRITE_WORKERS", 4))
+io_read_timeout = float(os.environ.get("IO_READ_TIMEOUT", 30))
+io_write_timeout = float(os.environ.get("IO_WRITE_TIMEOUT", 300))
+
+io_executors = {'read': ThreadPoolExecutor(io_read_workers, thread_name_prefix = 'io-read'), 
+                'write': ThreadPoolExecutor(io_write_workers, thread_name_prefix = 'io-write')}
+io_timeouts = {'read': io_read_timeout, 'write': io_write_timeout}
+
+# The most operations in a single /batch request and how many of them run at the same time when it is not ordered
+batch_max_operations = int(os.environ.get("BATCH_MAX_OPERATIONS", 10000))
+batch_concurrency = int(os.environ.get("BATCH_CONCURRENCY", 64))
+# A read operation of a batch returns at most BATCH_READ_MAX_BYTES of a file and BATCH_READ_MAX_ENTRIES entries of a folder, larger ones are read with GET
+batch_read_max_bytes = int(os.environ.get("BATCH_READ_MAX_BYTES", 1024 * 1024))
+batch_read_max_entries = int(os.environ.get("BATCH_READ_MAX_ENTRIES", 10000))
+
+# Folders are emptied and deleted by JOB_WORKERS threads in parallel, and the progress of the last JOB_HISTORY background jobs is kept
+job_workers = int(os.environ.get("JOB_WORKERS", 8))
+job_history = int(os.environ.get("JOB_HISTORY", 1000))
+job_executor = ThreadPoolExecutor(job_workers, thread_name_prefix = 'job')
+
+# Folders are emptied and deleted with DELETE_WORKERS threads of their own, so deletions never take the threads of /du, /tree and index builds. 
+# Up to DELETE_JOBS background jobs run at a time and the others wait in the queue
+delete_workers = int(os.environ.get("DELETE_WORKERS", job_workers))
+delete_jobs_max = int(os.environ.get("DELETE_JOBS", 2))
+delete_executor = ThreadPoolExecutor(delete_workers, thread_name_prefix = 'delete')
+delete_job_executor = ThreadPoolExecutor(delete_jobs_max, thread_name_prefix = 'delete-job')
+
+# The path index is an SQLite database outside of the root directory, which is built by the first search (or in the background at startup if INDEX_ON_STARTUP is true). 
+# Up to INDEX_MAX_WATCHES of its folders are watched with inotify by 1 worker at a time, and when some are not watched the index is rebuilt every INDEX_RESCAN_INTERVAL seconds
+index_db_path = os.environ.get("INDEX_PATH", os.path.join(tempfile.gettempdir(), 'filesystem_restapi-{}.sqlite3'.format(hashlib.md5(os.path.abspath(root_path).encode()).hexdigest()[:12])))
+index_on_startup = os.environ.get("INDEX_ON_STARTUP", "false").lower() == "true"
+index_max_watches = int(os.environ.get("INDEX_MAX_WATCHES", 8192))
+index_rescan_interval = float(os.environ.get("INDEX_RESCAN_INTERVAL", 300))
+
+# The summaries of up to DU_CACHE_MAX_FOLDERS folders are kept for /du, and /tree stops after TREE_MAX_ENTRIES entries. 
+# The summary of a folder that is not watched with inotify is only used for DU_CACHE_TTL seconds, since a file growing in it does not change the folder
+du_cache_max_folders = int(os.environ.get("DU_CACHE_MAX_FOLDERS", 100000))
+du_cache_ttl = float(os.environ.get("DU_CACHE_TTL", 30))
+tree_max_entries = int(os.environ.get("TREE_MAX_ENTRIES", 100000))
+
+# The largest file that can be uploaded with /uploadfile, 1GB by default
+upload_max_bytes = int(os.environ.get("UPLOAD_MAX_BYTES", 1024 * 1024 * 1024))
+
+# The line index of a text file keeps the byte offset of every LINE_INDEX_STRIDE-th line, for up to LINE_INDEX_MAX_FILES files
+line_index_stride = int(os.environ.get("LINE_INDEX_STRIDE", 128))
+line_index_max_files = int(os.environ.get("LINE_INDEX_MAX_FILES", 64))
+
+# A followed file (?follow=true) is checked for new lines every FOLLOW_POLL_INTERVAL seconds without inotify, and a heartbeat is sent after FOLLOW_HEARTBEAT idle seconds
+follow_poll_interval = float(os.environ.get("FOLLOW_POLL_INTERVAL", 1))
+follow_heartbeat = float(os.environ.get("FOLLOW_HEARTBEAT", 15))
+follow_max_clients = int(os.environ.get("FOLLOW_MAX_CLIENTS", 10000))
+# The last lines sent first are searched for in at most the last FOLLOW_TAIL_MAX_BYTES of the file (1000 chunks of 64KB)
+follow_tail_max_bytes = int(os.environ.get("FOLLOW_TAIL_MAX_BYTES", 1000 * 65536))
+
+# GET responses of at least COMPRESSION_MIN_BYTES are compressed with the first of COMPRESSION_ENCODINGS that the client accepts and that is installed (an empty list turns it off)
+compression_min_bytes = int(os.environ.get("COMPRESSION_MIN_BYTES", 1024))
+compression_preference = [encoding.strip() for encoding in os.environ.get("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(',') if encoding.strip()]
+compression_levels = {'gzip': int(os.environ.get("GZIP_LEVEL", 6)), 
+                'br': int(os.environ.get("BROTLI_LEVEL", 4)), 
+                'zstd': int(os.environ.get("ZSTD_LEVEL", 3))}
+
+# GET /debug/profile is only enabled when DEBUG_PROFILE_TOKEN is set, and samples the stacks of every thread every DEBUG_PROFILE_INTERVAL seconds
+debug_profile_token = os.environ.get("DEBUG_PROFILE_TOKEN")
+debug_profile_interval = float(os.environ.get("DEBUG_PROFILE_INTERVAL", 0.005))
+debug_profile_max_seconds = float(os.environ.get("DEBUG_PROFILE_MAX_SECONDS", 60))
+
+# Each client (its IP address, or the value of RATE_LIMIT_CLIENT_HEADER) can send up to RATE_LIMIT_READ GET, RATE_LIMIT_WRITE POST and RATE_LIMIT_DESTRUCTIVE DELETE requests a second, 
+# and read (RATE_LIMIT_READ_BYTES) and upload (RATE_LIMIT_UPLOAD_BYTES) that many bytes a second, with bursts of RATE_LIMIT_BURST seconds. A limit of 0 turns it off, and the limits are per worker
+rate_limits = {'read': float(os.environ.get("RATE_LIMIT_READ", 0)), 
+            'write': float(os.environ.get("RATE_LIMIT_WRITE", 0)), 
+            'destructive': float(os.environ.get("RATE_LIMIT_DESTRUCTIVE", 0)), 
+            'read_bytes': float(os.environ.get("RATE_LIMIT_READ_BYTES", 0)), 
+            'upload_bytes': float(os.environ.get("RATE_LIMIT_UPLOAD_BYTES", 0))}
+rate_limit_burst = float(os.environ.get("RATE_LIMIT_BURST", 2))
+rate_limit_client_header = os.environ.get("RATE_LIMIT_CLIENT_HEADER")
+# How many proxies in front of the app append to RATE_LIMIT_CLIENT_HEADER. The client is that many entries from the right, since the entries to its left are sent by the client and can be forged
+rate_limit_trusted_hops = max(1, int(os.environ.get("RATE_LIMIT_TRUSTED_HOPS", 1)))
+rate_limit_max_clients = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", 100000))
+
+# The workers of a multi process server (see gunicorn_conf.py) share their changes, index builds, line indexes and background jobs through files in STATE_DIR. 
+# Every worker reads the changes of the others before each request and every STATE_POLL_INTERVAL seconds. Without STATE_DIR each process keeps its own state
+state_dir = os.environ.get("STATE_DIR")
+state_poll_interval = float(os.environ.get("STATE_POLL_INTERVAL", 0.1))
+state_log_max_bytes = int(os.environ.get("STATE_LOG_MAX_BYTES", 16 * 1024 * 1024))
+
+def read_umask():
+    """Gets the umask of the process from /proc/self/status, since changing it to read it (os.umask) races with any thread that creates a file meanwhile
 
     Returns:
-        dict: A dictionary that contains name, owner, size and permissions (in octal representation)
+        int: The umask
     """    
 
-    # Get the file stats which is returned as an os.stats object
-    file_stats = os.stat(file_path) 
-    
-    # Get the relevant attributes (ones that start with st_) from file_stats
-    file_stats_dict = {k: getattr(file_stats, k) for k in dir(file_stats) if k.startswith('st_')}
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
 
-    name = os.path.basename(file_path).split('.')[0]
-    owner = file_stats_dict['st_uid']
-    size = os.path.getsize(file_path)
-    permissions = oct(file_stats_dict['st_mode'])[-3:]
+    # Without /proc (or on Linux before 4.7) it is read by setting it, which is still safe this early, before the app starts any thread
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
 
-    # Return as a dictionary that can be merged with file contents as a JSON response
-    file_metadata = {'name' : name, 
-                'owner' : owner, 
-                'size' : size, 
-                'permissions' : permissions}
-    
-    return file_metadata
 
+# Uploaded files are written to private temporary files first, which get the same permissions as files created with open() once they are complete. 
+# They are next to the file being uploaded (so they can be renamed into place) but are left out of listings, the tree and the path index. 
+# Their names have a random part of 32 hex digits and only names of exactly that form are left out, so a file of a user is never hidden
+process_umask = read_umask()
+upload_temp_prefix = '.upload-'
+upload_temp_suffix = '.part'
+upload_temp_name = re.compile(re.escape(upload_temp_prefix) + '[0-9a-f]{32}' + re.escape(upload_temp_suffix))
 
-def get_file_content(file_path: str):
-    """Get the contents of a text file
+
+def is_upload_temp(name: str):
+    """Checks whether a file name is that of an upload in progress
 
     Args:
-        file_path (str): An appropriate file path that has been checked with the does_exist function above
+        name (str): The name of a file, without its folder
+
+    Returns:
+        bool: Whether the file is a temporary file of open_upload
+    """    
+
+    return upload_temp_name.fullmatch(name) is not None
+
+
+async def run_io(kind: str, func, *args):
+    """Runs a blocking file system function on the read or write executor without blocking the event loop
+
+    The number of workers of each executor limits how many reads and mutations run at the same time. A request that waits longer than the timeout 
+    of its kind (including the time queued behind other requests) gets a 504, and if it had not started yet it never will. A read that already started 
+    keeps running on its thread after the 504, but a write that already started is waited for, since a 504 must mean that nothing was changed.
+
+    Args:
+        kind (str): Either 'read' or 'write'
+        func (callable): The blocking function to run
+        *args: The arguments of the function
 
     Raises:
-        HTTPException: If not a .txt file, raise a BadRequest Error
+        HTTPException: If the function does not finish within the timeout, raise a Gateway Timeout error
 
     Returns:
-        dict: This single valued dictionary returns the contents of the file
+        object: The return value of the function
     """    
 
-    # Run a quick test to make sure the file path is a text file
-    if not file_path.endswith('.txt'):
-        raise HTTPException(status_code=422, detail="Only a file with extension .txt can be opened")
+    loop = asyncio.get_running_loop()
+    traced = request_timings.get() is not None
+    submitted = time.perf_counter()
+    # Whether the call started, or was given up on before it did, which are decided under the lock so exactly 1 of them happens
+    state = {'started': False, 'abandoned': False}
+    lock = threading.Lock()
 
-    # Open the file while taking care to decode as utf-8
-    with open(file_path, 'r', errors = 'ignore') as f:
-        contents = f.read().splitlines()
+    def call():
+        with lock:
+            if state['abandoned']:
+                return None
+            state['started'] = True
+        # A traced request also records how long the call waited for a free thread
+        if traced:
+            record_timing('queue', time.perf_counter() - submitted)
+        return func(*args)
 
-    return {'file_contents': contents}
+    # Run the call in a copy of the context, so the timings of a traced request are also recorded on the executor threads
+    future = loop.run_in_executor(io_executors[kind], contextvars.copy_context().run, call)
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), io_timeouts[kind])
+    except asyncio.TimeoutError:
+        pass
 
+    with lock:
+        state['abandoned'] = not state['started']
+    if kind == 'write' and not state['abandoned']:
+        return await future
 
-def request_output(path: str):
-    """An internal function that is called by the 2 get requests below depending on whether it is a file or folder
+    future.cancel()
+    raise HTTPException(status_code=504, detail="The file system did not respond in time")
+
+
+async def iterate_io(iterator):
+    """Pulls each item of a blocking iterator (such as the lines of a file) on the read executor, for use with a StreamingResponse
 
     Args:
-        path (str): A file or folder path
+        iterator (iterator): A blocking iterator
+
+    Yields:
+        object: Each item of the iterator
+    """    
+
+    done = object()
+    # A generator cannot be closed while it is running, so close waits for a next that is still running after a timeout or a disconnect
+    lock = threading.Lock()
+    pending = False
+
+    def pull():
+        with lock:
+            return next(iterator, done)
+
+    def close():
+        with lock:
+            iterator.close()
+
+    try:
+        while True:
+            pending = True
+            item = await run_io('read', pull)
+            pending = False
+            if item is done:
+                break
+            yield item
+    finally:
+        if hasattr(iterator, 'close'):
+            if pending:
+                io_executors['read'].submit(close)
+            else:
+                close()
+
+
+class Metric:
+    """A Prometheus counter, gauge or histogram with a fixed set of labels, which is rendered in the text exposition format by GET /metrics
+
+    Updates only take a lock and a dictionary lookup (and a bisect for histograms), so the metrics can be left on in production.
+    """    
+
+    def __init__(self, name: str, kind: str, description: str, labels: tuple = (), buckets: tuple = None):
+        self.name = name
+        self.kind = kind
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        """Adds to a counter or gauge
+
+        Args:
+            labels (tuple, optional): The values of the labels, in the order of the label names. Defaults to ().
+            amount (float, optional): The amount to add, which can be negative for a gauge. Defaults to 1.
+        """    
+
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, labels: tuple, value: float):
+        """Sets the value of a gauge, or of a counter that is kept somewhere else such as the cache counters
+
+        Args:
+            labels (tuple): The values of the labels, in the order of the label names
+            value (float): The new value
+        """    
+
+        with self.lock:
+            self.values[labels] = value
+
+    def observe(self, labels: tuple, value: float):
+        """Adds a value, such as a duration in seconds, to a histogram
+
+        Args:
+            labels (tuple): The values of the labels, in the order of the label names
+            value (float): The observed value
+        """    
+
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # 1 count per bucket, then the +Inf bucket and the sum of all values
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, *labels, trace: str = None):
+        """Times a block of code into a histogram, used as `with metric.time('label'):`
+
+        Args:
+            *labels: The values of the labels, in the order of the label names
+            trace (str, optional): The name of the time in the Server-Timing header of a traced request. Defaults to None.
+
+        Returns:
+            MetricTimer: A context manager that observes the time spent inside of it
+        """    
+
+        return MetricTimer(self, labels, trace)
+
+    def render(self):
+        """Renders the metric in the Prometheus text exposition format
+
+        Returns:
+            list: The lines of the metric
+        """    
+
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} {}'.format(self.name, self.kind)]
+        with self.lock:
+            values = sorted((labels, list(value) if self.kind == 'histogram' else value) for labels, value in self.values.items())
+
+        for labels, value in values:
+            if self.kind != 'histogram':
+                lines.append('{}{} {}'.format(self.name, format_labels(self.labels, labels), value))
+                continue
+
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), value[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{}_bucket{} {}'.format(self.name, format_labels(self.labels + ('le',), labels + (le,)), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(self.labels, labels), value[-1]))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(self.labels, labels), cumulative))
+
+        return lines
+
+
+class MetricTimer:
+    """Observes the time spent inside a with block into a histogram, and into the Server-Timing header if the request is traced"""    
+
+    __slots__ = ('metric', 'labels', 'trace', 'start')
+
+    def __init__(self, metric: Metric, labels: tuple, trace: str = None):
+        self.metric = metric
+        self.labels = labels
+        self.trace = trace
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.metric.observe(self.labels, elapsed)
+        if self.trace is not None:
+            record_timing(self.trace, elapsed)
+
+
+# The times of a request sent with the X-Server-Timing header, as {name: [seconds, calls]}, or None if the request is not traced
+request_timings = contextvars.ContextVar('request_timings', default = None)
+
+
+def record_timing(name: str, seconds: float):
+    """Adds a time to the Server-Timing breakdown of the current request, if it is traced
+
+    Args:
+        name (str): The name of the step, such as stat, read or serialize
+        seconds (float): The time spent
+    """    
+
+    timings = request_timings.get()
+    if timings is not None:
+        total = timings.setdefault(name, [0.0, 0])
+        total[0] += seconds
+        total[1] += 1
+
+
+def format_labels(names: tuple, values: tuple):
+    """Formats the labels of a metric sample, such as {endpoint="sub_folder",status="200"}
+
+    Args:
+        names (tuple): The label names
+        values (tuple): The label values
 
     Returns:
-        fastapi.responses.JSONResponse: A JSON Response dictionary containing the keys:
-        
-        If folder:
-        - is_folder: True
-        - folder_contents: A list of folders and files in the folder sent into the get request
+        str: The escaped labels, or an empty string if there are none
+    """    
 
-        If file:
-        - is_file: True
-        - file_contents: A dictionary that contains all the metadata and file contents (that is assumed to fit comfortably within a JSON blob)
+    if not names:
+        return ''
+
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join('{}="{}"'.format(name, value) for name, value in zip(names, escaped)) + '}'
+
+
+metrics_registry = []
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+fs_latency_buckets = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+http_requests = Metric('fsapi_http_requests_total', 'counter', 'HTTP requests by endpoint, method and status code', ('endpoint', 'method', 'status'))
+http_request_seconds = Metric('fsapi_http_request_duration_seconds', 'histogram', 'Time to handle an HTTP request, including sending the body', ('endpoint',), latency_buckets)
+http_requests_in_flight = Metric('fsapi_http_requests_in_flight', 'gauge', 'HTTP requests that are being handled')
+http_response_bytes = Metric('fsapi_http_response_bytes_total', 'counter', 'Bytes of response bodies by endpoint', ('endpoint',))
+fs_operation_seconds = Metric('fsapi_fs_operation_duration_seconds', 'histogram', 'Time spent in file system calls by operation', ('operation',), fs_latency_buckets)
+fs_bytes_read = Metric('fsapi_fs_read_bytes_total', 'counter', 'Bytes read from files')
+fs_bytes_written = Metric('fsapi_fs_written_bytes_total', 'counter', 'Bytes written to files')
+serialize_seconds = Metric('fsapi_serialize_duration_seconds', 'histogram', 'Time spent encoding JSON responses', (), fs_latency_buckets)
+cache_counters = Metric('fsapi_cache', 'gauge', 'Counters and size of the caches shared by the GET requests', ('cache', 'counter'))
+rate_limited_requests = Metric('fsapi_rate_limited_requests_total', 'counter', 'Requests rejected with 429 by the limit that was exceeded', ('limit',))
+rate_limit_delay_seconds = Metric('fsapi_rate_limit_delay_seconds_total', 'counter', 'Time that reads and uploads were slowed down to stay within the byte limits', ('limit',))
+rate_limit_clients = Metric('fsapi_rate_limit_clients', 'gauge', 'Clients whose requests and bytes are being limited')
+
+
+class FsOpTimer(MetricTimer):
+    """Times a file system call on the thread that makes it. A call made inside of another timed call (such as the open of a read) only counts 
+    as itself, so no time is counted twice. It must never be held across an await, since the thread is then shared with other requests
+    """    
+
+    __slots__ = ('outer', 'nested')
+    current = threading.local()
+
+    def __enter__(self):
+        self.nested = 0.0
+        self.outer = getattr(self.current, 'timer', None)
+        self.current.timer = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.current.timer = self.outer
+        if self.outer is not None:
+            self.outer.nested += elapsed
+        self.metric.observe(self.labels, elapsed - self.nested)
+        record_timing(self.trace, elapsed - self.nested)
+
+
+def fs_op(operation: str):
+    """Times a file system call, used as `with fs_op('stat'):` on the thread that makes the call
+
+    Args:
+        operation (str): The operation, such as stat, scandir, open, read, write, unlink, rmdir or mkdir
+
+    Returns:
+        FsOpTimer: A context manager that observes the time spent inside of it
+    """    
+
+    return FsOpTimer(fs_operation_seconds, (operation,), operation)
+
+
+def fs_call(operation: str, func, *args):
+    """Makes a timed file system call, which is how a call handed to an executor is timed: `await run_io('read', fs_call, 'open', os.open, path, flags)`. 
+    Only the call itself is timed, not the time it waited for a thread
+
+    Args:
+        operation (str): The operation, such as open or read
+        func (function): The file system call
+        *args: The arguments of the call
+
+    Returns:
+        object: What the call returned
+    """    
+
+    with fs_op(operation):
+        return func(*args)
+
+
+class PathCache:
+    """A thread safe LRU cache with entry, byte and time limits. Every key is a tuple whose 2nd item is the path it was read from, 
+    so that everything cached about a path (and below it) can be invalidated at once when it changes.
+    """    
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple):
+        """Get a value from the cache, which also marks it as the most recently used
+
+        Args:
+            key (tuple): A key whose 2nd item is a normalized path
+
+        Returns:
+            object: The cached value or None if it is not cached or has expired
+        """    
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[3] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, value, nbytes: int, signature: tuple, unchanged = None):
+        """Add a value to the cache and evict the least recently used values until it is within its limits
+
+        Args:
+            key (tuple): A key whose 2nd item is a normalized path
+            value (object): The value to cache, which must not be changed after it is cached
+            nbytes (int): The approximate size of the value in bytes
+            signature (tuple): The (mtime_ns, size, inode) of the path when the value was read, used to poll for changes
+            unchanged (function, optional): Called under the lock, so no invalidation can run in between, and the value is only added if it returns True. Defaults to None.
+        """    
+
+        if nbytes > self.max_bytes or self.max_entries <= 0:
+            return
+
+        with self.lock:
+            if unchanged is not None and not unchanged():
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, nbytes, signature, time.monotonic() + self.ttl)
+            self.total_bytes += nbytes
+
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, path: str):
+        """Remove everything cached for a path, anything below it and its parent folder (whose listing and stats change with it)
+
+        Args:
+            path (str): A normalized file or folder path
+        """    
+
+        parent = os.path.dirname(path)
+        prefix = os.path.join(path, '')
+
+        with self.lock:
+            stale = [key for key in self.entries if key[1] == path or key[1] == parent or key[1].startswith(prefix)]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+
+    def discard(self, key: tuple):
+        """Remove a single value from the cache if it is there
+
+        Args:
+            key (tuple): A key whose 2nd item is a normalized path
+        """    
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        """Remove every value in the cache"""    
+
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def signatures(self):
+        """Get the paths in the cache and the signatures they were cached with, which is used to poll for changes
+
+        Returns:
+            dict: A dictionary of {path: signature}
+        """    
+
+        with self.lock:
+            return {key[1]: entry[2] for key, entry in self.entries.items()}
+
+    def stats(self):
+        """Get the hit, miss, eviction and invalidation counters and the current size of the cache
+
+        Returns:
+            dict: A dictionary of the cache counters
+        """    
+
+        with self.lock:
+            return {'hits': self.hits, 
+                    'misses': self.misses, 
+                    'evictions': self.evictions, 
+                    'invalidations': self.invalidations, 
+                    'entries': len(self.entries), 
+                    'bytes': self.total_bytes}
+
+    def _remove(self, key: tuple):
+        value, nbytes, signature, expires = self.entries.pop(key)
+        self.total_bytes -= nbytes
+
+
+class InotifyWatcher(threading.Thread):
+    """Watches the folders of cached paths with Linux inotify (through ctypes, so no extra packages are needed) and invalidates them as soon as they change"""    
+
+    # inotify event masks from <sys/inotify.h>
+    IN_MODIFY, IN_ATTRIB, IN_MOVED_FROM, IN_MOVED_TO = 0x2, 0x4, 0x40, 0x80
+    IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF = 0x100, 0x200, 0x400, 0x800
+    IN_Q_OVERFLOW, IN_IGNORED, IN_ONLYDIR = 0x4000, 0x8000, 0x1000000
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, on_change, max_watches: int):
+        super().__init__(name = 'inotify-watcher', daemon = True)
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self.on_change = on_change
+        self.max_watches = max(max_watches, 1)
+        self.folders = OrderedDict()
+        self.pinned = {}
+        self.descriptors = {}
+        self.lock = threading.Lock()
+
+    def watch(self, folder_path: str, pinned: bool = False, evict: bool = True):
+        """Start watching a folder for changes to itself or its direct contents. The oldest watch is dropped (and its folder invalidated) beyond max_watches
+
+        Args:
+            folder_path (str): A normalized folder path
+            pinned (bool, optional): Keep watching the folder even beyond max_watches, which is used for the folders of the path index. Defaults to False.
+            evict (bool, optional): Drop the oldest watch to make room. If False the folder is only watched when there is room. Defaults to True.
+
+        Returns:
+            bool: Whether the folder is watched
+        """    
+
+        with self.lock:
+            if folder_path in self.pinned:
+                return True
+            if folder_path in self.folders and not pinned:
+                self.folders.move_to_end(folder_path)
+                return True
+            if not (pinned or evict) and len(self.folders) >= self.max_watches:
+                return False
+
+            wd = self.folders.pop(folder_path, None)
+            if wd is None:
+                wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder_path), self.WATCH_MASK)
+                if wd < 0:
+                    return False
+            self.descriptors[wd] = folder_path
+            if pinned:
+                self.pinned[folder_path] = wd
+                return True
+            self.folders[folder_path] = wd
+
+            dropped = []
+            while len(self.folders) > self.max_watches:
+                old_path, old_wd = self.folders.popitem(last = False)
+                self.descriptors.pop(old_wd, None)
+                self.libc.inotify_rm_watch(self.fd, old_wd)
+                dropped.append(old_path)
+
+        # Anything cached in a folder that is no longer watched could go stale
+        for old_path in dropped:
+            self.on_change(old_path)
+
+        return True
+
+    def run(self):
+        while True:
+            data = os.read(self.fd, 65536)
+            position = 0
+            while position < len(data):
+                wd, mask, cookie, name_length = self.EVENT_HEADER.unpack_from(data, position)
+                position += self.EVENT_HEADER.size
+                name = os.fsdecode(data[position:position + name_length].rstrip(b'\0'))
+                position += name_length
+
+                # If events were dropped by the kernel, nothing in the cache can be trusted
+                if mask & self.IN_Q_OVERFLOW:
+                    self.on_change(None)
+                    continue
+
+                with self.lock:
+                    folder_path = self.descriptors.get(wd)
+                    if mask & self.IN_IGNORED and folder_path is not None:
+                        del self.descriptors[wd]
+                        if self.folders.get(folder_path) == wd:
+                            del self.folders[folder_path]
+                        if self.pinned.get(folder_path) == wd:
+                            del self.pinned[folder_path]
+
+                if folder_path is not None:
+                    self.on_change(os.path.join(folder_path, name) if name else folder_path)
+
+
+class PollingWatcher(threading.Thread):
+    """Polls the stats of every cached path and invalidates the ones that changed. This is used when inotify is not available"""    
+
+    def __init__(self, on_change, cache: PathCache, interval: float):
+        super().__init__(name = 'polling-watcher', daemon = True)
+        self.on_change = on_change
+        self.cache = cache
+        self.interval = interval
+
+    def watch(self, folder_path: str, pinned: bool = False, evict: bool = True):
+        # Every cached path is polled, so there is nothing to register, but changes inside a folder are only seen when they change its own stats
+        return False
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            for path, signature in self.cache.signatures().items():
+                try:
+                    if path_signature(os.stat(path)) != signature:
+                        self.on_change(path)
+                except OSError:
+                    self.on_change(path)
+
+
+# The cache shared by all GET requests and the watcher that keeps it up to date, which is started when something is first cached
+path_cache = PathCache(cache_max_entries, cache_max_bytes, cache_ttl)
+path_watcher = None
+path_watcher_lock = threading.Lock()
+
+
+def path_signature(path_stats: os.stat_result):
+    """Gets the parts of a stat result that change whenever a file or folder is modified or replaced
+
+    Args:
+        path_stats (os.stat_result): The stats of a file or folder
+
+    Returns:
+        tuple: The (mtime_ns, size, inode) of the path
+    """    
+
+    return (path_stats.st_mtime_ns, path_stats.st_size, path_stats.st_ino)
+
+
+def invalidate_cache(path: str):
+    """Drops everything cached for a path that changed. A path of None drops everything
+
+    Args:
+        path (str): A normalized file or folder path or None
+    """    
+
+    if path is None:
+        path_cache.clear()
+    else:
+        path_cache.invalidate(path)
+
+
+# Everything that has to know when a path is changed by the app or outside of it, each is called with the normalized path (or None if anything could have changed)
+path_change_listeners = [invalidate_cache]
+
+
+# The listeners whose state is kept in files shared by every worker (such as the path index), which are not told again about the changes made by other workers
+shared_change_listeners = []
+
+
+def apply_path_change(path: str, replayed: bool = False):
+    """Tells every listener in path_change_listeners of this process that a path changed. The watchers call this for changes made outside of the app
+
+    Args:
+        path (str): A file or folder path or None if anything could have changed
+        replayed (bool, optional): The change was made by another worker and read from the shared change log. Defaults to False.
+    """    
+
+    if path is not None:
+        path = os.path.normpath(path)
+
+    for listener in path_change_listeners:
+        if not (replayed and listener in shared_change_listeners):
+            listener(path)
+
+
+def invalidate_path(path: str):
+    """Tells every listener that a path was changed by the app, in this process and (with STATE_DIR) in every other worker. A path of None means anything could have changed
+
+    Args:
+        path (str): A file or folder path or None
+    """    
+
+    if path is not None:
+        path = os.path.normpath(path)
+
+    apply_path_change(path)
+    if shared_changes is not None:
+        shared_changes.publish(path)
+
+
+class SharedChangeLog(threading.Thread):
+    """An append only file in STATE_DIR through which the workers of a server tell each other about the paths they changed, so that no worker keeps serving what it cached before. 
+
+    Each change is 1 line with the id of the worker and the path as JSON, written with a single O_APPEND write so the lines of different workers never interleave. 
+    Every worker reads the lines added since it last looked before each request (a single stat when nothing changed) and every poll interval on its own thread. 
+    Once the log is larger than max_bytes it is replaced by a new one, under an exclusive lock that no worker is writing while it holds. The new log starts with 
+    the inode of the one it replaced, so a worker that fell behind by more than 1 log knows it missed changes and drops everything instead.
+    """    
+
+    def __init__(self, log_path: str, on_change, worker_id: str, interval: float, max_bytes: int):
+        super().__init__(name = 'shared-changes', daemon = True)
+        self.log_path = log_path
+        self.on_change = on_change
+        self.worker_id = worker_id
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.lock_fd = os.open(log_path + '.lock', os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+
+        # The changes made before this worker started do not matter, since nothing was cached yet
+        self.write_fd = self.read_fd = None
+        self.reopen()
+        self.position = os.fstat(self.read_fd).st_size
+        self.pending = b''
+        self.replaced = None
+
+    def reopen(self):
+        for fd in (self.write_fd, self.read_fd):
+            if fd is not None:
+                os.close(fd)
+        self.write_fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        self.read_fd = os.open(self.log_path, os.O_RDONLY | os.O_CLOEXEC)
+        self.inode = os.fstat(self.read_fd).st_ino
+
+    def publish(self, path: str):
+        """Tells the other workers that a path changed
+
+        Args:
+            path (str): A normalized file or folder path, or None if anything could have changed
+        """    
+
+        line = '{} {}\n'.format(self.worker_id, json.dumps(path)).encode()
+        with self.lock:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_SH)
+            try:
+                # Read what the others wrote first, which also moves to the new log if it was replaced
+                self.read_changes()
+                os.write(self.write_fd, line)
+                size = os.fstat(self.write_fd).st_size
+            finally:
+                fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+            if size > self.max_bytes:
+                self.rotate()
+
+    def rotate(self):
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another worker is writing or replacing the log, and the next write will try again
+            return
+        try:
+            log_stats = os.stat(self.log_path)
+            if log_stats.st_size > self.max_bytes:
+                os.replace(self.log_path, self.log_path + '.1')
+                fd = os.open(self.log_path, os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC, 0o644)
+                try:
+                    os.write(fd, '- {}\n'.format(log_stats.st_ino).encode())
+                finally:
+                    os.close(fd)
+        finally:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def changed(self):
+        """Checks with a single stat, without taking the lock, whether the other workers may have changed something since the last time
+
+        Returns:
+            bool: Whether sync has changes to apply
+        """    
+
+        try:
+            log_stats = os.stat(self.log_path)
+        except OSError:
+            # The log is being replaced right now, and the poller gets the rest
+            return False
+
+        return log_stats.st_ino != self.inode or log_stats.st_size != self.position
+
+    def sync(self):
+        """Applies the changes that the other workers made since the last time, which is done before every request that finds changed to be True"""    
+
+        with self.lock:
+            self.read_changes()
+
+    def read_changes(self):
+        try:
+            log_stats = os.stat(self.log_path)
+        except FileNotFoundError:
+            # The log is being replaced right now, and the next read gets the rest
+            return
+        if log_stats.st_ino == self.inode and log_stats.st_size == self.position:
+            return
+
+        self.read_new_lines()
+        # The log was replaced, and nothing is written to the old one after that, so the rest of it has now been read
+        if log_stats.st_ino != self.inode:
+            self.replaced = self.inode
+            self.reopen()
+            self.position = 0
+            self.read_new_lines()
+
+    def read_new_lines(self):
+        while True:
+            data = os.pread(self.read_fd, 1024 * 1024, self.position)
+            if not data:
+                break
+            self.position += len(data)
+            *lines, self.pending = (self.pending + data).split(b'\n')
+            for line in lines:
+                worker_id, _, path = line.decode().partition(' ')
+                if worker_id == '-':
+                    if int(path) != self.replaced:
+                        self.on_change(None, replayed = True)
+                elif worker_id != self.worker_id:
+                    self.on_change(json.loads(path), replayed = True)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sync()
+            except OSError:
+                pass
+
+
+def replace_file(path: str, data: bytes):
+    """Writes a file in STATE_DIR in one step, so the other workers never read it half written. The temporary file has a unique name, since several workers and threads can write the same file at once
+
+    Args:
+        path (str): The path of the file
+        data (bytes): The new contents of the file
+    """    
+
+    fd, temp_path = tempfile.mkstemp(dir = os.path.dirname(path), prefix = '.' + os.path.basename(path) + '.', suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def read_state_started(state_folder: str):
+    """Gets when the server whose workers share a state folder was started. Every worker holds a shared lock on started.lock for as long as it runs, 
+    so a worker that can lock it exclusively is the first of a new server (also without gunicorn_conf.py, such as with uvicorn --workers). 
+    That worker records the start time and removes the jobs left by the previous run
+
+    Args:
+        state_folder (str): The STATE_DIR folder
+
+    Returns:
+        tuple: The start time as a unix timestamp and the descriptor of the lock, which has to stay open while the worker runs
+    """    
+
+    started_path = os.path.join(state_folder, 'started')
+    lock_fd = os.open(started_path + '.lock', os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        first = True
+    except BlockingIOError:
+        first = False
+
+    if first:
+        jobs_folder = os.path.join(state_folder, 'jobs')
+        for name in os.listdir(jobs_folder):
+            try:
+                os.unlink(os.path.join(jobs_folder, name))
+            except FileNotFoundError:
+                pass
+        replace_file(started_path, str(time.time()).encode())
+
+    # A worker that starts while the first one holds the exclusive lock waits here until the start time is recorded
+    fcntl.flock(lock_fd, fcntl.LOCK_SH)
+    with open(started_path) as started:
+        return float(started.read()), lock_fd
+
+
+# Without STATE_DIR every process works on its own
+shared_changes = None
+state_started = state_lock_fd = None
+if state_dir is not None:
+    os.makedirs(os.path.join(state_dir, 'jobs'), exist_ok = True)
+    os.makedirs(os.path.join(state_dir, 'lines'), exist_ok = True)
+    state_started, state_lock_fd = read_state_started(state_dir)
+    shared_changes = SharedChangeLog(os.path.join(state_dir, 'changes.log'), apply_path_change, str(os.getpid()), state_poll_interval, state_log_max_bytes)
+
+
+@app.on_event('startup')
+def start_shared_changes():
+    """Starts reading the changes of the other workers in the background, which wakes the followers of a file changed by another worker"""    
+
+    if shared_changes is not None and not shared_changes.is_alive():
+        shared_changes.start()
+
+
+def start_path_watcher():
+    """Starts the watcher configured with CACHE_WATCHER, using inotify when it is available and polling otherwise
+
+    Returns:
+        InotifyWatcher or PollingWatcher: The running watcher, or None if watching is turned off
+    """    
+
+    global path_watcher
+
+    with path_watcher_lock:
+        if path_watcher is None and cache_watcher != 'off':
+            if cache_watcher in ('auto', 'inotify') and sys.platform.startswith('linux'):
+                try:
+                    path_watcher = InotifyWatcher(apply_path_change, cache_max_entries)
+                except OSError:
+                    if cache_watcher == 'inotify':
+                        raise
+            if path_watcher is None:
+                path_watcher = PollingWatcher(apply_path_change, path_cache, cache_poll_interval)
+            path_watcher.start()
+
+    return path_watcher
+
+
+def cache_put(key: tuple, value, nbytes: int, path_stats: os.stat_result):
+    """Adds a value read from a path to the cache and makes sure that changes to the path will be noticed
+
+    Args:
+        key (tuple): A key whose 2nd item is a normalized path
+        value (object): The value to cache
+        nbytes (int): The approximate size of the value in bytes
+        path_stats (os.stat_result): The stats of the path when the value was read
+    """    
+
+    watcher = start_path_watcher()
+    if watcher is not None:
+        # Changes to a path are reported to the watch on its folder, and a folder also needs its own watch for its contents
+        watcher.watch(os.path.dirname(key[1]))
+        if stat.S_ISDIR(path_stats.st_mode):
+            watcher.watch(key[1])
+
+    # The path could have changed after it was read but before it was watched, or its invalidation could run before the value is added. 
+    # Checking that it is still the same under the lock of the cache, after it is watched, leaves no gap in which a change goes unnoticed
+    signature = path_signature(path_stats)
+
+    def unchanged():
+        try:
+            return path_signature(os.stat(key[1])) == signature
+        except OSError:
+            return False
+
+    path_cache.put(key, value, nbytes, signature, unchanged)
+
+
+def get_path_stats(path: str):
+    """Gets the (cached) stats of a file or folder, which replaces separate exists, isdir and isfile checks with a single stat
+
+    Args:
+        path (str): A string path to a folder or file
+
+    Raises:
+        HTTPException: File or folder not found, check input
+
+    Returns:
+        os.stat_result: The stats of the path
+    """    
+
+    path = os.path.normpath(path)
+    path_stats = path_cache.get(('stat', path))
+    if path_stats is None:
+        try:
+            with fs_op('stat'):
+                path_stats = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise HTTPException(status_code=404, detail="File or folder not found")
+        cache_put(('stat', path), path_stats, 256, path_stats)
+
+    return path_stats
+
+
+def relative_path(full_path: str):
+    """Gets the path of a file or folder relative to the root directory, as it is returned in responses, however the request spelled it
+
+    Args:
+        full_path (str): A full path below the root directory
+
+    Returns:
+        str: The normalized path relative to the root directory
+    """    
+
+    return os.path.relpath(full_path, root_path)
+
+
+def does_exist(path: str):
+    """Checks whether a file path exists on the local file system and raises an error if not. This can be used for both files and folders. 
+
+    Args:
+        path (str): A string path to a folder or file
+
+    Raises:
+        HTTPException: File or folder not found, check input
+    """    
+
+    with fs_op('exists'):
+        exists = os.path.exists(path)
+    if not exists:
+        raise HTTPException(status_code=404, detail="File or folder not found")
+
+
+@dataclass
+class FileMetadata:
+    """The metadata returned with the contents of a file"""    
+
+    name: str
+    owner: int
+    size: int
+    permissions: str
+
+
+@dataclass
+class FolderEntry:
+    """The details of a single entry of a folder listing"""    
+
+    name: str
+    type: str
+    size: int
+    owner: int
+    permissions: str
+    mtime: float
+
+
+def get_file_metadata(file_path: str):
+    """Gets the file metadata so that if a GET request is sent to retrieve a file, the metadata is presented
+
+    Args:
+        file_path (str): An appropriate file path that has been checked with the does_exist function above
+
+    Returns:
+        FileMetadata: The name, owner, size and permissions (in octal representation) of the file
+    """    
+
+    # Get the file stats which is returned as an os.stats object. This is the only system call needed for the metadata and is shared through the cache
+    file_stats = get_path_stats(file_path) 
+
+    name = os.path.basename(file_path).split('.')[0]
+
+    # Return as a FileMetadata whose fields can be merged with file contents as a JSON response
+    file_metadata = FileMetadata(name = name, 
+                owner = file_stats.st_uid, 
+                size = file_stats.st_size, 
+                permissions = oct(file_stats.st_mode)[-3:])
+    
+    return file_metadata
+
+
+def check_text_file(file_path: str):
+    """Makes sure that a file can be opened by the API, which currently only reads text files
+
+    Args:
+        file_path (str): An appropriate file path that has been checked with the does_exist function above
+
+    Raises:
+        HTTPException: If not a .txt file, raise a BadRequest Error
+    """    
+
+    if not file_path.endswith('.txt'):
+        raise HTTPException(status_code=422, detail="Only a file with extension .txt can be opened")
+
+
+def parse_range(range_header: str, size: int):
+    """Parses a single HTTP byte range (e.g. bytes=0-499, bytes=500- or bytes=-500) against the size of a file
+
+    Args:
+        range_header (str): The raw value of the Range request header
+        size (int): The size of the file in bytes
+
+    Raises:
+        HTTPException: If the range cannot be satisfied, raise a 416 error with the size of the file
+
+    Returns:
+        tuple: The (start, end) byte positions, both inclusive, or None if the header is not a byte range that can be honored
+    """    
+
+    # Only a single byte range is supported, anything else is ignored and the full file is sent as allowed by the HTTP spec
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+
+    start, _, end = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if start:
+            start, end = int(start), int(end) if end else size - 1
+        else:
+            # A suffix range asks for the last n bytes of the file
+            start, end = max(size - int(end), 0), size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable", headers={'Content-Range': 'bytes */{}'.format(size)})
+
+    return start, min(end, size - 1)
+
+
+def iter_file_lines(file_path: str, offset: int = 0, limit: int = None, byte_range: tuple = None):
+    """Lazily reads the lines of a text file so that only 1 line is held in memory at a time, no matter how big the file is
+
+    Args:
+        file_path (str): An appropriate file path that has been checked with the does_exist function above
+        offset (int, optional): The number of lines to skip before returning lines. Defaults to 0.
+        limit (int, optional): The maximum number of lines to return. Defaults to None, which returns every line.
+        byte_range (tuple, optional): The inclusive (start, end) byte positions to read, as returned by parse_range. Defaults to None.
+
+    Yields:
+        str: Each line of the file, decoded as utf-8 without the line ending
+    """    
+
+    start, end = byte_range if byte_range else (0, None)
+
+    # Open in binary mode so that the position in the file can be tracked for byte ranges
+    with fs_op('open'):
+        f = open(file_path, 'rb')
+    with f:
+        f.seek(start)
+        position = start
+
+        def raw_lines():
+            nonlocal position
+            for raw in f:
+                # Cut the last line short if it runs past the end of the requested range
+                if end is not None and position + len(raw) > end + 1:
+                    raw = raw[:end + 1 - position]
+                position += len(raw)
+                yield raw
+                if end is not None and position > end:
+                    return
+
+        try:
+            for raw in islice(raw_lines(), offset, None if limit is None else offset + limit):
+                if raw.endswith(b'\n'):
+                    raw = raw[:-1]
+                if raw.endswith(b'\r'):
+                    raw = raw[:-1]
+                yield raw.decode('utf-8', errors = 'ignore')
+        finally:
+            fs_bytes_read.inc(amount = position - start)
+
+
+def pread_exact(fd: int, size: int, position: int):
+    """Reads exactly size bytes of an open file at a position
+
+    Args:
+        fd (int): The open file
+        size (int): The number of bytes to read
+        position (int): Where to start reading
+
+    Raises:
+        EOFError: If the file ends before that, because it was truncated after it was stat'ed
+
+    Returns:
+        bytes: The bytes read
+    """    
+
+    data = os.pread(fd, size, position)
+    if len(data) < size:
+        raise EOFError('The file was truncated while it was read')
+
+    return data
+
+
+class LineIndex:
+    """The byte offsets of the lines of a text file, found by scanning the file once with os.pread, so any window of lines can be read out of the file directly
+
+    Only the offset of every stride-th line is kept (8 bytes per stride lines), and a line in between is found by skipping at most stride - 1 newlines. 
+    When the file only grows, like a log, the index is extended from where it stopped instead of scanning the whole file again.
+    The file is read with os.pread rather than mapped into memory, so a file truncated while it is read (such as a log rotated with copytruncate) only gives a short read, 
+    which raises EOFError, instead of a SIGBUS that kills the worker.
+    """    
+
+    # The file is scanned in chunks of this many bytes, each split into lines in 1 call
+    chunk_size = 8 * 1024 * 1024
+    # The lines between 2 indexed offsets are skipped in reads of this many bytes
+    locate_size = 64 * 1024
+
+    def __init__(self, stride: int):
+        self.stride = stride
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # offsets[k] is where line k * stride starts
+        self.offsets = array('Q', [0])
+        # The number of complete lines (that end with a newline) and the byte after the last one
+        self.lines = 0
+        self.indexed_size = 0
+        self.size = 0
+        self.mtime_ns = None
+        # The bytes before indexed_size, which have to be unchanged for the index to be extended
+        self.check = b''
+
+    def update(self, fd: int, file_stats: os.stat_result):
+        """Brings the index up to date with the file, scanning only what was appended if the file only grew
+
+        Args:
+            fd (int): The open file
+            file_stats (os.stat_result): The stats of the file from the same open file
+
+        Raises:
+            EOFError: If the file was truncated since file_stats, which leaves the index to be reset
+
+        Returns:
+            int: The number of bytes that were scanned
+        """    
+
+        if file_stats.st_size == self.size and file_stats.st_mtime_ns == self.mtime_ns:
+            return 0
+
+        # Anything other than appending (truncating or rewriting the file) needs a full scan
+        grown = file_stats.st_size >= self.size and pread_exact(fd, len(self.check), self.indexed_size - len(self.check)) == self.check
+        if not grown:
+            self.reset()
+
+        size = file_stats.st_size
+        position, lines = self.indexed_size, self.lines
+        scanned_from = position
+        while position < size:
+            data = pread_exact(fd, min(self.chunk_size, size - position), position)
+            end = data.rfind(b'\n')
+            # A line longer than a chunk continues until its newline
+            while end < 0 and position + len(data) < size:
+                more = pread_exact(fd, min(self.chunk_size, size - position - len(data)), position + len(data))
+                if b'\n' in more:
+                    end = len(data) + more.index(b'\n')
+                data += more
+            # What is left is a last line without a newline, which is not indexed until it is complete
+            if end < 0:
+                break
+
+            parts = data[:end + 1].split(b'\n')
+            count = len(parts) - 1
+            # The start of line lines + i + 1 is position + the lengths of parts 0 to i + i + 1, and only every stride-th line is kept
+            first = (-(lines + 1)) % self.stride
+            for step, total in enumerate(islice(accumulate(map(len, parts)), first, count, self.stride)):
+                self.offsets.append(position + total + first + step * self.stride + 1)
+
+            lines += count
+            position += end + 1
+
+        self.check = pread_exact(fd, min(64, position), position - min(64, position))
+        self.lines, self.indexed_size = lines, position
+        self.size, self.mtime_ns = size, file_stats.st_mtime_ns
+        return position - scanned_from
+
+    # The stride, lines, indexed_size, size, mtime_ns and the length of check, which are followed by check and the offsets
+    header = struct.Struct('<QQQQqQ')
+
+    def save(self, index_path: str):
+        """Writes the index to a file, so the other workers that share STATE_DIR do not have to scan the file again
+
+        Args:
+            index_path (str): The path of the index file
+        """    
+
+        replace_file(index_path, self.header.pack(self.stride, self.lines, self.indexed_size, self.size, self.mtime_ns, len(self.check)) + self.check + self.offsets.tobytes())
+
+    def load(self, index_path: str):
+        """Reads an index written by save, which is kept only if it has the same stride. It is checked against the file by the next update like any other index. 
+        A missing, truncated or corrupt index file is only a cache miss
+
+        Args:
+            index_path (str): The path of the index file
+
+        Returns:
+            bool: Whether the index was loaded
+        """    
+
+        try:
+            with open(index_path, 'rb') as file:
+                data = file.read()
+            stride, lines, indexed_size, size, mtime_ns, check_size = self.header.unpack_from(data)
+            offsets = array('Q', data[self.header.size + check_size:])
+        except (OSError, struct.error, ValueError):
+            return False
+
+        if stride != self.stride or len(offsets) != lines // stride + 1 or len(data) < self.header.size + check_size or indexed_size > size:
+            return False
+
+        self.offsets, self.lines, self.indexed_size, self.size, self.mtime_ns = offsets, lines, indexed_size, size, mtime_ns
+        self.check = data[self.header.size:self.header.size + check_size]
+        return True
+
+    def total_lines(self):
+        """The number of lines in the file, including a last line without a newline"""    
+
+        return self.lines + (1 if self.size > self.indexed_size else 0)
+
+    def locate(self, fd: int, line: int):
+        """Finds where a line starts
+
+        Args:
+            fd (int): The open file
+            line (int): The line number, starting at 0
+
+        Raises:
+            EOFError: If the file was truncated since the index was updated
+
+        Returns:
+            int: The byte offset of the line, or the size of the file if there is no such line
+        """    
+
+        if line > self.lines:
+            return self.size
+
+        position = self.offsets[line // self.stride]
+        skip = line % self.stride
+        # The newline of every line before self.lines is before indexed_size
+        while skip:
+            data = pread_exact(fd, min(self.locate_size, self.indexed_size - position), position)
+            found = -1
+            while skip:
+                found = data.find(b'\n', found + 1)
+                if found < 0:
+                    break
+                skip -= 1
+            position += len(data) if found < 0 else found + 1
+
+        return position
+
+
+line_indexes = OrderedDict()
+line_indexes_lock = threading.Lock()
+
+# How many times a window of lines is read again when the file was truncated while it was read, before it is read line by line instead
+line_index_attempts = 3
+
+# With STATE_DIR a line index is shared with the other workers once building or extending it scanned at least this many bytes
+line_index_share_bytes = 1024 * 1024
+
+
+def read_line_window(file_path: str, line_start: int, line_count: int):
+    """Reads a window of lines of a text file through its line index, without reading the lines before it
+
+    Args:
+        file_path (str): An appropriate file path that has been checked with the does_exist function above
+        line_start (int): The first line to return, starting at 0
+        line_count (int): The maximum number of lines to return
+
+    Returns:
+        tuple: The lines, decoded like iter_file_lines does, and the total number of lines in the file
+    """    
+
+    # A file truncated while it is read (such as a log rotated with copytruncate) is stat'ed and indexed again
+    for _ in range(line_index_attempts):
+        with fs_op('open'):
+            fd = os.open(file_path, os.O_RDONLY)
+        try:
+            file_stats = os.fstat(fd)
+            if file_stats.st_size == 0:
+                return [], 0
+
+            # The index belongs to the file itself rather than its path, so it follows the file when it is renamed (such as a rotated log)
+            key = (file_stats.st_dev, file_stats.st_ino)
+            shared_path = os.path.join(state_dir, 'lines', '{}-{}'.format(*key)) if state_dir is not None else None
+            with line_indexes_lock:
+                index = line_indexes.get(key)
+                created = index is None
+                if created:
+                    index = line_indexes[key] = LineIndex(line_index_stride)
+                    while len(line_indexes) > line_index_max_files:
+                        line_indexes.popitem(last = False)
+                line_indexes.move_to_end(key)
+
+            with index.lock:
+                try:
+                    with fs_op('line_index'):
+                        if created and shared_path is not None:
+                            index.load(shared_path)
+                        if index.update(fd, file_stats) >= line_index_share_bytes and shared_path is not None:
+                            index.save(shared_path)
+                    with fs_op('read'):
+                        start = index.locate(fd, line_start)
+                        end = index.locate(fd, line_start + line_count)
+                        window = pread_exact(fd, end - start, start)
+                except EOFError:
+                    index.reset()
+                    continue
+                total_lines = index.total_lines()
+        finally:
+            os.close(fd)
+
+        fs_bytes_read.inc(amount = len(window))
+        return decode_lines(window), total_lines
+
+    # The file keeps being truncated, so it is read line by line instead, which does not depend on its size
+    lines = list(iter_file_lines(file_path))
+    return lines[line_start:line_start + line_count], len(lines)
+
+
+def decode_lines(data: bytes):
+    """Splits bytes of a text file into lines, decoded like iter_file_lines does
+
+    Args:
+        data (bytes): Whole lines of a file
+
+    Returns:
+        list: The lines, decoded as utf-8 without the line endings
+    """    
+
+    lines = data.split(b'\n') if data else []
+    if data.endswith(b'\n'):
+        lines.pop()
+
+    return [line[:-1].decode('utf-8', errors = 'ignore') if line.endswith(b'\r') else line.decode('utf-8', errors = 'ignore') for line in lines]
+
+
+def get_file_lines(file_path: str, line_start: int, line_count: int = None):
+    """Get a page of lines of a text file by line number, served from the line index of the file
+
+    Args:
+        file_path (str): An appropriate file path that has been checked with the does_exist function above
+        line_start (int): The first line to return, starting at 0
+        line_count (int, optional): The maximum number of lines to return. Defaults to None, which returns up to the default page size.
+
+    Raises:
+        HTTPException: If not a .txt file, raise a BadRequest Error
+
+    Returns:
+        dict: The lines of the page and the total number of lines in the file
+    """    
+
+    check_text_file(file_path)
+    lines, total_lines = read_line_window(file_path, line_start, line_count or default_page_limit)
+
+    return {'file_contents': lines, 'line_start': line_start, 'total_lines': total_lines}
+
+
+def get_file_content(file_path: str, offset: int = 0, limit: int = None):
+    """Get the contents of a text file
+
+    Args:
+        file_path (str): An appropriate file path that has been checked with the does_exist function above
+        offset (int, optional): The number of lines to skip from the start of the file. Defaults to 0.
+        limit (int, optional): The maximum number of lines to return. Defaults to None, which returns every line.
+
+    Raises:
+        HTTPException: If not a .txt file, raise a BadRequest Error
+
+    Returns:
+        dict: This single valued dictionary returns the contents of the file
+    """    
+
+    # Run a quick test to make sure the file path is a text file
+    check_text_file(file_path)
+
+    # Small files are cached as a whole and sliced, larger files only keep the requested window of lines rather than splitting the whole file
+    file_stats = get_path_stats(file_path)
+    if file_stats.st_size <= cache_max_file_bytes:
+        key = ('content', os.path.normpath(file_path))
+        lines = path_cache.get(key)
+        if lines is None:
+            with fs_op('read'):
+                lines = list(iter_file_lines(file_path))
+            cache_put(key, lines, file_stats.st_size + 64 * len(lines), file_stats)
+        contents = lines[offset:None if limit is None else offset + limit]
+    elif offset and limit is not None:
+        # A window further into a large file is sliced out through its line index instead of reading every line before it
+        contents = read_line_window(file_path, offset, limit)[0]
+    else:
+        with fs_op('read'):
+            contents = list(iter_file_lines(file_path, offset, limit))
+
+    return {'file_contents': contents}
+
+
+def stream_file_content(file_path: str, offset: int = 0, limit: int = None, range_header: str = None, headers: dict = None):
+    """Stream the contents of a text file as newline delimited JSON (one JSON string per line) so that memory per request stays flat
+
+    Args:
+        file_path (str): An appropriate file path that has been checked with the does_exist function above
+        offset (int, optional): The number of lines to skip before streaming. Defaults to 0.
+        limit (int, optional): The maximum number of lines to stream. Defaults to None, which streams every line.
+        range_header (str, optional): The HTTP Range header, which limits the lines to the ones within the requested bytes of the file. Defaults to None.
+        headers (dict, optional): Extra headers of the response, such as the ETag. Defaults to None.
+
+    Raises:
+        HTTPException: If not a .txt file, raise a BadRequest Error
+
+    Returns:
+        fastapi.responses.StreamingResponse: A chunked response with 1 JSON encoded line of the file per line
+    """    
+
+    check_text_file(file_path)
+
+    size = os.path.getsize(file_path)
+    byte_range = parse_range(range_header, size)
+
+    def ndjson_chunks():
+        # Group lines into chunks of roughly 64KB so that each line is not sent separately
+        chunk, chunk_size = [], 0
+        for line in iter_file_lines(file_path, offset, limit, byte_range):
+            encoded = json.dumps(line) + '\n'
+            chunk.append(encoded)
+            chunk_size += len(encoded)
+            if chunk_size >= 65536:
+                yield ''.join(chunk)
+                chunk, chunk_size = [], 0
+        if chunk:
+            yield ''.join(chunk)
+
+    # The body is the lines encoded again, not the requested bytes of the file, so it is a 200 whose X-File-Range tells which bytes of the file the lines came from, 
+    # rather than a 206 that range aware clients and caches would splice into the file
+    headers = {**(headers or {}), 'Vary': 'Range'}
+    if byte_range:
+        headers['X-File-Range'] = 'bytes {}-{}/{}'.format(byte_range[0], byte_range[1], size)
+
+    return StreamingResponse(iterate_io(ndjson_chunks()), media_type = 'application/x-ndjson', headers = headers)
+
+
+class RawFileResponse(Response):
+    """Sends the bytes of any file as they are, with a correct Content-Length and support for a single HTTP Range
+
+    If the server supports the ASGI zero copy extension, the file is handed over in 1 message so that it can be sent with os.sendfile. 
+    Otherwise it is read in large chunks with os.pread on the read executor, without any decoding or copying into Python objects beyond each chunk.
+    """    
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, file_path: str, file_stats: os.stat_result, range_header: str = None, headers: dict = None, media_type: str = None):
+        self.file_path = file_path
+        self.background = None
+        self.media_type = media_type or mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+
+        size = file_stats.st_size
+        byte_range = parse_range(range_header, size) if size else None
+        self.start, self.end = byte_range if byte_range else (0, size - 1)
+        self.status_code = 206 if byte_range else 200
+
+        headers = {**(headers or {}), 
+                'Accept-Ranges': 'bytes', 
+                'Content-Length': str(self.end - self.start + 1), 
+                'Content-Type': self.media_type}
+        if byte_range:
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(self.start, self.end, size)
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        fd = await run_io('read', fs_call, 'open', os.open, self.file_path, os.O_RDONLY)
+        try:
+            await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+
+            if 'http.response.zerocopy' in scope.get('extensions', {}):
+                with os.fdopen(fd, 'rb', closefd = False) as file:
+                    await send({'type': 'http.response.zerocopy', 'file': file, 'offset': self.start, 'count': self.end - self.start + 1, 'more_body': False})
+                return
+
+            position = self.start
+            while position <= self.end:
+                chunk = await run_io('read', fs_call, 'read', os.pread, fd, min(self.chunk_size, self.end - position + 1), position)
+                fs_bytes_read.inc(amount = len(chunk))
+                # The Content-Length can no longer be met if the file was truncated while it was being sent. Raising makes the server 
+                # abort the connection, so the client sees an incomplete response instead of a short body that looks complete
+                if not chunk:
+                    raise RuntimeError("{} was truncated while it was being sent".format(self.file_path))
+                position += len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            os.close(fd)
+
+
+# The library of each encoding. gzip is part of the standard library, brotli and zstandard are optional packages
+compression_module_names = {'gzip': 'zlib', 'br': 'brotli', 'zstd': 'zstandard'}
+
+
+def find_compression_encodings():
+    """Finds the encodings whose compression library is installed, without importing the libraries until a response is first compressed with them
+
+    Returns:
+        list: The encodings that can be used
+    """    
+
+    return [encoding for encoding, module_name in compression_module_names.items() if importlib.util.find_spec(module_name) is not None]
+
+
+available_encodings = find_compression_encodings()
+compression_encodings = [encoding for encoding in compression_preference if encoding in available_encodings]
+
+# The file extension of a precompressed copy of a file for each encoding, such as foo.txt.gz
+sidecar_extensions = {'zstd': '.zst', 'br': '.br', 'gzip': '.gz'}
+
+# Media types other than text/* that are worth compressing
+compressible_media_types = {'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml', 
+                'application/yaml', 'application/x-yaml', 'application/toml', 'application/x-sh', 'application/csv', 'image/svg+xml'}
+
+
+class StreamCompressor:
+    """Compresses a response body 1 chunk at a time with gzip, brotli or zstandard, so a streamed response can be compressed as it is sent"""    
+
+    def __init__(self, encoding: str, level: int):
+        module = importlib.import_module(compression_module_names[encoding])
+
+        if encoding == 'gzip':
+            # A wbits of 31 writes the gzip header and trailer around the deflate stream
+            compressor = module.compressobj(level, zlib.DEFLATED, 31)
+            self.compress = compressor.compress
+            self.flush = partial(compressor.flush, zlib.Z_SYNC_FLUSH)
+            self.finish = compressor.flush
+        elif encoding == 'br':
+            compressor = module.Compressor(quality = level)
+            self.compress, self.flush, self.finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = module.ZstdCompressor(level = level).compressobj()
+            self.compress = compressor.compress
+            self.flush = partial(compressor.flush, module.COMPRESSOBJ_FLUSH_BLOCK)
+            self.finish = compressor.flush
+
+    def chunk(self, data: bytes, last: bool):
+        """Compresses a chunk of the body
+
+        Args:
+            data (bytes): The next chunk of the body
+            last (bool): Whether this is the last chunk, which ends the compressed stream
+
+        Returns:
+            bytes: The compressed bytes, which are flushed so the client can decode everything sent so far
+        """    
+
+        return self.compress(data) + (self.finish() if last else self.flush())
+
+
+def negotiate_encoding(accept_encoding: str, encodings: list):
+    """Picks the content coding of a response from the Accept-Encoding request header
+
+    Args:
+        accept_encoding (str): The Accept-Encoding request header, such as "gzip, br;q=0.8"
+        encodings (list): The encodings that can be sent, in order of preference when the client weights them the same
+
+    Returns:
+        str: The encoding with the highest weight, or None if the response should not be compressed
+    """    
+
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for part in accept_encoding.split(','):
+        coding, _, parameters = part.partition(';')
+        parameters = parameters.strip()
+        try:
+            weights[coding.strip().lower()] = float(parameters[2:]) if parameters.startswith('q=') else 1.0
+        except ValueError:
+            weights[coding.strip().lower()] = 0.0
+
+    best_encoding, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best_encoding, best_weight = encoding, weight
+
+    return best_encoding
+
+
+def is_compressible(content_type: str):
+    """Checks whether a media type is text that is worth compressing, as opposed to images, archives and other binary files
+
+    Args:
+        content_type (str): The Content-Type header of a response
+
+    Returns:
+        bool: True if the body should be compressed
+    """    
+
+    media_type = content_type.split(';')[0].strip().lower()
+    # An event stream is mostly idle, and a compressor per follower would use far more memory than the follower itself
+    if media_type == 'text/event-stream':
+        return False
+
+    return media_type.startswith('text/') or media_type in compressible_media_types or media_type.endswith(('+json', '+xml'))
+
+
+def find_sidecar(file_path: str, file_stats: os.stat_result, accept_encoding: str):
+    """Finds a precompressed copy of a file (such as foo.txt.gz next to foo.txt) that the client accepts, so it can be sent without compressing it again
+
+    Args:
+        file_path (str): The path of the requested file
+        file_stats (os.stat_result): The stats of the requested file
+        accept_encoding (str): The Accept-Encoding request header
+
+    Returns:
+        tuple: The path and encoding of the sidecar, or None if there is no usable sidecar
+    """    
+
+    sidecars = {}
+    for encoding, extension in sidecar_extensions.items():
+        try:
+            sidecar_stats = os.stat(file_path + extension)
+        except OSError:
+            continue
+
+        # A sidecar older than the file itself is out of date
+        if stat.S_ISREG(sidecar_stats.st_mode) and sidecar_stats.st_mtime_ns >= file_stats.st_mtime_ns:
+            sidecars[encoding] = file_path + extension
+
+    encoding = negotiate_encoding(accept_encoding, [encoding for encoding in sidecar_extensions if encoding in sidecars])
+    return (sidecars[encoding], encoding) if encoding else None
+
+
+class SharedStateMiddleware:
+    """Applies the changes made by the other workers before each request, so a worker never answers from what it cached before another worker changed it. 
+    Only a single stat runs on the event loop, and the changes (if there are any) are read on the read executor
+    """    
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and shared_changes.changed():
+            # A log that cannot be read right now is left to the poller, which reads it within STATE_POLL_INTERVAL
+            try:
+                await run_io('read', shared_changes.sync)
+            except OSError:
+                pass
+
+        await self.app(scope, receive, send)
+
+
+if shared_changes is not None:
+    app.add_middleware(SharedStateMiddleware)
+
+
+class CompressionMiddleware:
+    """Compresses GET responses with the encoding negotiated from the Accept-Encoding header
+
+    JSON responses are compressed in 1 piece once they reach COMPRESSION_MIN_BYTES, and streamed responses (NDJSON and raw files) are compressed chunk by chunk as they are sent. 
+    Responses that already have a Content-Encoding (precompressed sidecars), partial responses and binary media types are sent as they are.
+    """    
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            return await self.app(scope, receive, send)
+
+        encoding = negotiate_encoding(Headers(scope = scope).get('accept-encoding'), compression_encodings)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        compressor = None
+
+        async def send_body(body: bytes, last: bool):
+            # Compressing a large body takes long enough that it is moved off of the event loop
+            if len(body) >= 64 * 1024:
+                compressed = await run_io('read', compressor.chunk, body, last)
+            else:
+                compressed = compressor.chunk(body, last)
+            await send({'type': 'http.response.body', 'body': compressed, 'more_body': not last})
+
+        async def send_compressed(message):
+            nonlocal compressor
+
+            if message['type'] == 'http.response.start':
+                headers = MutableHeaders(raw = message['headers'])
+                if message['status'] != 200 or 'content-encoding' in headers or not is_compressible(headers.get('content-type', '')):
+                    return await send(message)
+
+                headers.add_vary_header('Accept-Encoding')
+                if int(headers.get('content-length', compression_min_bytes)) < compression_min_bytes:
+                    return await send(message)
+
+                compressor = StreamCompressor(encoding, compression_levels[encoding])
+                del headers['content-length']
+                headers['content-encoding'] = encoding
+                # The compressed body is a different representation of the same content, so the ETag becomes weak
+                if 'etag' in headers and not headers['etag'].startswith('W/'):
+                    headers['etag'] = 'W/' + headers['etag']
+                return await send(message)
+
+            if compressor is None:
+                return await send(message)
+
+            if message['type'] == 'http.response.body':
+                return await send_body(message.get('body', b''), not message.get('more_body', False))
+
+            # A file handed over for sendfile has to be read and compressed here instead
+            if message['type'] == 'http.response.zerocopy':
+                fd = message['file'].fileno()
+                position = message.get('offset') or 0
+                remaining = message.get('count')
+                while remaining is None or remaining > 0:
+                    size = RawFileResponse.chunk_size if remaining is None else min(RawFileResponse.chunk_size, remaining)
+                    chunk = await run_io('read', os.pread, fd, size, position)
+                    if not chunk:
+                        break
+                    position += len(chunk)
+                    remaining = None if remaining is None else remaining - len(chunk)
+                    await send_body(chunk, False)
+                return await send_body(b'', not message.get('more_body', False))
+
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+
+app.add_middleware(CompressionMiddleware)
+
+
+class TokenBucket:
+    """Allows rate units (requests or bytes) a second on average, and bursts of up to burst units. Bytes can be taken on credit, which later requests then wait for"""    
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait(self, amount: float):
+        """The seconds until the bucket has amount units, 0 if it already has them"""    
+
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """Keeps a token bucket for every limit of every client, and forgets the clients that were idle the longest once there are more than max_clients"""    
+
+    def __init__(self, limits: dict, burst_seconds: float, max_clients: int):
+        self.limits = {name: rate for name, rate in limits.items() if rate > 0}
+        self.burst_seconds = burst_seconds
+        self.max_clients = max_clients
+        self.clients = OrderedDict()
+        self.lock = threading.Lock()
+
+    def buckets(self, client: str):
+        buckets = self.clients.get(client)
+        if buckets is None:
+            buckets = self.clients[client] = {name: TokenBucket(rate, max(1.0, rate * self.burst_seconds)) for name, rate in self.limits.items()}
+            while len(self.clients) > self.max_clients:
+                self.clients.popitem(last = False)
+        self.clients.move_to_end(client)
+
+        return buckets
+
+    def acquire(self, client: str, costs: dict):
+        """Takes requests from the buckets of a client, either from all of them or (if any is short) from none of them. 
+        A byte limit with a cost of 0 is checked for credit that has not been paid back yet
+
+        Args:
+            client (str): The client
+            costs (dict): The number of requests to take by limit, such as {'read': 1, 'read_bytes': 0}. Limits that are turned off are skipped
+
+        Returns:
+            tuple: The limit that was exceeded and the seconds until the request can be retried, or (None, 0) if the request can go ahead
+        """    
+
+        now = time.monotonic()
+        with self.lock:
+            buckets = self.buckets(client)
+            costs = {name: cost for name, cost in costs.items() if name in buckets}
+            for name, cost in costs.items():
+                buckets[name].refill(now)
+                # A cost larger than the burst (such as a large batch) goes ahead once the bucket is full, and the client then waits for the rest
+                wait = buckets[name].wait(min(cost, buckets[name].burst))
+                if wait > 0:
+                    return name, wait
+            for name, cost in costs.items():
+                buckets[name].tokens -= cost
+
+        return None, 0
+
+    def charge(self, client: str, name: str, amount: int):
+        """Takes bytes that were read or uploaded from a bucket of a client, going into credit if the bucket is short
+
+        Args:
+            client (str): The client
+            name (str): Either read_bytes or upload_bytes
+            amount (int): The number of bytes
+
+        Returns:
+            float: The seconds to wait before the next bytes, until the credit is paid back
+        """    
+
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets(client)[name]
+            bucket.refill(now)
+            bucket.tokens -= amount
+            return bucket.wait(0)
+
+    def stats(self):
+        with self.lock:
+            return len(self.clients)
+
+
+rate_limiter = RateLimiter(rate_limits, rate_limit_burst, rate_limit_max_clients)
+
+
+def rate_limit_client(scope: dict):
+    """Gets the client that a request is limited as, which is its IP address unless RATE_LIMIT_CLIENT_HEADER is set (such as X-Forwarded-For behind a proxy). 
+    Then it is the entry that the first of the RATE_LIMIT_TRUSTED_HOPS proxies added, counted from the right
+
+    Args:
+        scope (dict): The ASGI scope of the request
+
+    Returns:
+        str: The client
+    """    
+
+    if rate_limit_client_header:
+        value = Headers(scope = scope).get(rate_limit_client_header)
+        if value:
+            entries = [entry.strip() for entry in value.split(',') if entry.strip()]
+            if entries:
+                return entries[-min(rate_limit_trusted_hops, len(entries))]
+
+    client = scope.get('client')
+    return client[0] if client else 'unknown'
+
+
+def too_many_requests(name: str, wait: float):
+    """Counts a request that was over a limit and builds its 429 error
+
+    Args:
+        name (str): The limit that was exceeded
+        wait (float): The seconds until the request can be retried
+
+    Returns:
+        HTTPException: The error, with the seconds to wait in its Retry-After header
+    """    
+
+    rate_limited_requests.inc((name,))
+    return HTTPException(status_code=429, detail="Too many requests, retry after the Retry-After header", headers = {'Retry-After': str(math.ceil(wait))})
+
+
+class RateLimitMiddleware:
+    """Limits the requests of every client by their kind: GET requests are reads, POST requests are writes and DELETE requests (and index rebuilds) are destructive. 
+    A request over its limit gets a 429 error with a Retry-After header before it does any work. Response and upload bodies are slowed down to their byte limits, 
+    and once a client has read or uploaded more than its burst it gets 429 errors until it is back within its limit.
+    """    
+
+    # Scrapes of the metrics are never limited, and a batch charges each of its operations itself instead of the request
+    exempt_paths = {'/metrics'}
+    self_charged_paths = {'/batch'}
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not rate_limiter.limits or scope['path'] in self.exempt_paths:
+            return await self.app(scope, receive, send)
+
+        client = rate_limit_client(scope)
+        method = scope['method']
+        kind = 'read' if method in ('GET', 'HEAD') else 'destructive' if method == 'DELETE' or scope['path'] == '/index/rebuild' else 'write'
+        costs = {'read_bytes' if kind == 'read' else 'upload_bytes': 0}
+        if scope['path'] not in self.self_charged_paths:
+            costs[kind] = 1
+        name, wait = rate_limiter.acquire(client, costs)
+        if name is not None:
+            exception = too_many_requests(name, wait)
+            response = JSONResponse({'detail': exception.detail}, status_code = exception.status_code, headers = exception.headers)
+            return await response(scope, receive, send)
+
+        async def receive_limited():
+            message = await receive()
+            if message['type'] == 'http.request' and 'upload_bytes' in rate_limiter.limits:
+                await self.delay('upload_bytes', rate_limiter.charge(client, 'upload_bytes', len(message.get('body', b''))))
+            return message
+
+        async def send_limited(message):
+            if message['type'] == 'http.response.body':
+                await self.delay('read_bytes', rate_limiter.charge(client, 'read_bytes', len(message.get('body', b''))))
+            await send(message)
+
+        if kind != 'read' or 'read_bytes' not in rate_limiter.limits:
+            return await self.app(scope, receive_limited, send)
+
+        # Files are sent in chunks instead of with sendfile, so that they can be slowed down
+        scope['extensions'] = {name: value for name, value in scope.get('extensions', {}).items() if name != 'http.response.zerocopy'}
+        await self.app(scope, receive_limited, send_limited)
+
+    async def delay(self, name: str, seconds: float):
+        if seconds > 0:
+            rate_limit_delay_seconds.inc((name,), seconds)
+            await asyncio.sleep(seconds)
+
+
+# Added after the compression, so the bytes that are limited are the bytes that are sent
+app.add_middleware(RateLimitMiddleware)
+
+
+class MetricsMiddleware:
+    """Counts every request and times it until its body has been sent, labeled by the name of the endpoint function that handled it"""    
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+        response_bytes = 0
+
+        async def send_counted(message):
+            nonlocal status_code, response_bytes
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            elif message['type'] == 'http.response.body':
+                response_bytes += len(message.get('body', b''))
+            elif message['type'] == 'http.response.zerocopy':
+                response_bytes += message.get('count') or 0
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_counted)
+        finally:
+            http_requests_in_flight.inc(amount = -1)
+            # The router adds the endpoint to the scope, a request that matched no route has none
+            endpoint = scope.get('endpoint')
+            endpoint = endpoint.__name__ if endpoint is not None else 'unmatched'
+            http_request_seconds.observe((endpoint,), time.perf_counter() - start)
+            http_requests.inc((endpoint, scope['method'], str(status_code)))
+            http_response_bytes.inc((endpoint,), response_bytes)
+
+
+app.add_middleware(MetricsMiddleware)
+
+
+class ServerTimingMiddleware:
+    """Traces a request sent with an X-Server-Timing header and returns the time spent in each step (stat, read, serialize and so on) in the Server-Timing response header"""    
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or 'x-server-timing' not in Headers(scope = scope):
+            return await self.app(scope, receive, send)
+
+        timings = {}
+        start = time.perf_counter()
+
+        async def send_timed(message):
+            if message['type'] == 'http.response.start':
+                # A streamed response only includes the steps until its first chunk
+                steps = ['{};dur={:.3f};desc="{} calls"'.format(name, seconds * 1000, calls) for name, (seconds, calls) in timings.items()]
+                steps.append('total;dur={:.3f}'.format((time.perf_counter() - start) * 1000))
+                MutableHeaders(raw = message['headers']).append('Server-Timing', ', '.join(steps))
+            await send(message)
+
+        token = request_timings.set(timings)
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            request_timings.reset(token)
+
+
+# Added last so that they are the outermost middleware and also time the compression
+app.add_middleware(ServerTimingMiddleware)
+
+
+def encode_cursor(name: str):
+    """Encodes the last entry name of a page as an opaque cursor that is safe to send in a URL
+
+    Args:
+        name (str): The name of the last entry in a page of a folder listing
+
+    Returns:
+        str: A url safe base64 string
+    """    
+
+    return base64.urlsafe_b64encode(os.fsencode(name)).decode('ascii')
+
+
+def decode_cursor(cursor: str):
+    """Decodes a cursor created by encode_cursor back into the name of an entry
+
+    Args:
+        cursor (str): A cursor returned by a previous page of a folder listing
+
+    Raises:
+        HTTPException: If the cursor was not created by this API, raise a BadRequest Error
+
+    Returns:
+        str: The name of the last entry of the previous page
+    """    
+
+    try:
+        name = os.fsdecode(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        name = None
+
+    # The base64 decoder skips unknown characters, so make sure the cursor round trips exactly
+    if name is None or encode_cursor(name) != cursor:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+    return name
+
+
+def get_entry_details(entry: os.DirEntry):
+    """Gets the details of a single entry of a folder listing from the stat data cached on the os.DirEntry, so no extra os.stat is needed
+
+    Args:
+        entry (os.DirEntry): An entry returned by os.scandir
+
+    Returns:
+        FolderEntry: The name, type (folder, file or other), size, owner, permissions (in octal representation) and last modified time of the entry
+    """    
+
+    # The type comes from the directory listing itself, only a broken symlink needs the stat of the link instead of its target
+    try:
+        entry_stats = entry.stat()
+    except OSError:
+        entry_stats = entry.stat(follow_symlinks = False)
+
+    if entry.is_dir():
+        entry_type = 'folder'
+    elif entry.is_file():
+        entry_type = 'file'
+    else:
+        entry_type = 'other'
+
+    return FolderEntry(name = entry.name, 
+            type = entry_type, 
+            size = entry_stats.st_size, 
+            owner = entry_stats.st_uid, 
+            permissions = oct(entry_stats.st_mode)[-3:], 
+            mtime = entry_stats.st_mtime)
+
+
+def to_columns(folder_contents: list, details: bool):
+    """Turns a folder listing into parallel arrays, 1 per field, which is smaller and faster to encode than 1 object per entry
+
+    Args:
+        folder_contents (list): The names or FolderEntry details of the entries of a folder
+        details (bool): Whether the listing has the details of each entry
+
+    Returns:
+        dict: A dictionary of {field: [value of each entry]}
+    """    
+
+    if not details:
+        return {'name': folder_contents}
+
+    return {field.name: [getattr(entry, field.name) for entry in folder_contents] for field in fields(FolderEntry)}
+
+
+def get_folder_content(folder_path: str, limit: int = None, cursor: str = None, details: bool = False):
+    """Get the names (or details) of the files and folders inside a folder, optionally one page at a time
+
+    Pages are ordered by name and each cursor is the last name of the previous page, so a cursor stays valid even when entries are added or removed between requests.
+    Entries are read lazily with os.scandir and only the entries of the current page are held in memory. Each page is cached until the folder changes.
+
+    Args:
+        folder_path (str): An appropriate folder path that has been checked with the does_exist function above
+        limit (int, optional): The maximum number of entries in a page. Defaults to None, which returns every entry.
+        cursor (str, optional): The next_cursor returned by the previous page. Defaults to None, which starts at the first page.
+        details (bool, optional): Return the details of every entry from get_entry_details instead of only its name. Defaults to False.
+
+    Returns:
+        dict: A dictionary that contains the folder contents and, if paginated, the cursor for the next page (None on the last page)
+    """    
+
+    key = ('listing', os.path.normpath(folder_path), limit, cursor, details)
+    folder_contents = path_cache.get(key)
+    if folder_contents is None:
+        # The stats are taken before the scan, so an entry added or removed during the scan leaves the listing uncached instead of cached under the new stats
+        folder_stats = get_path_stats(folder_path)
+        folder_contents = scan_folder_content(folder_path, limit, cursor, details)
+        nbytes = (256 if details else 64) * len(folder_contents['folder_contents'])
+        cache_put(key, folder_contents, nbytes, folder_stats)
+
+    return folder_contents
+
+
+def scan_folder_content(folder_path: str, limit: int = None, cursor: str = None, details: bool = False):
+    """Reads a folder from disk for get_folder_content, which caches the result
+
+    Args:
+        folder_path (str): An appropriate folder path that has been checked with the does_exist function above
+        limit (int, optional): The maximum number of entries in a page. Defaults to None, which returns every entry.
+        cursor (str, optional): The next_cursor returned by the previous page. Defaults to None, which starts at the first page.
+        details (bool, optional): Return the details of every entry from get_entry_details instead of only its name. Defaults to False.
+
+    Returns:
+        dict: A dictionary that contains the folder contents and, if paginated, the cursor for the next page (None on the last page)
+    """    
+
+    describe = get_entry_details if details else attrgetter('name')
+
+    if limit is None and cursor is None:
+        with fs_op('scandir'), os.scandir(folder_path) as entries:
+            return {'folder_contents': [describe(entry) for entry in entries if not is_upload_temp(entry.name)]}
+
+    limit = limit or default_page_limit
+    after = decode_cursor(cursor) if cursor else None
+
+    with fs_op('scandir'), os.scandir(folder_path) as entries:
+        entries = (entry for entry in entries if not is_upload_temp(entry.name))
+        if after is not None:
+            entries = (entry for entry in entries if entry.name > after)
+
+        # Take 1 extra entry to know whether there is a next page
+        page = heapq.nsmallest(limit + 1, entries, key = attrgetter('name'))
+
+    next_cursor = encode_cursor(page[limit - 1].name) if len(page) > limit else None
+
+    return {'folder_contents': [describe(entry) for entry in page[:limit]], 'next_cursor': next_cursor}
+
+
+def get_validators(path_stats: os.stat_result, variant: tuple):
+    """Builds the ETag and Last-Modified headers of a file or folder from its stats, so a client can send a conditional GET
+
+    Args:
+        path_stats (os.stat_result): The stats of the file or folder
+        variant (tuple): The request options that change the response body, which are part of the strong ETag
+
+    Returns:
+        dict: The ETag and Last-Modified headers
+    """    
+
+    variant_hash = hashlib.md5(repr(variant).encode()).hexdigest()[:8]
+    etag = '"{:x}-{:x}-{:x}-{}"'.format(path_stats.st_ino, path_stats.st_mtime_ns, path_stats.st_size, variant_hash)
+
+    return {'ETag': etag, 'Last-Modified': formatdate(path_stats.st_mtime, usegmt = True)}
+
+
+def is_not_modified(validators: dict, if_none_match: str = None, if_modified_since: str = None):
+    """Checks the conditional GET headers of a request against the validators of a file or folder
+
+    Args:
+        validators (dict): The ETag and Last-Modified headers returned by get_validators
+        if_none_match (str, optional): The If-None-Match request header. Defaults to None.
+        if_modified_since (str, optional): The If-Modified-Since request header, which is ignored when If-None-Match is sent. Defaults to None.
+
+    Returns:
+        bool: True if the client already has the current version, so a 304 can be returned
+    """    
+
+    # ETags are compared weakly, so a W/ ETag of a compressed response also matches
+    if if_none_match is not None:
+        etags = [etag.strip()[2:] if etag.strip().startswith('W/') else etag.strip() for etag in if_none_match.split(',')]
+        etag = validators['ETag'][2:] if validators['ETag'].startswith('W/') else validators['ETag']
+        return '*' in etags or etag in etags
+
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(validators['Last-Modified']) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+def request_output(path: str, 
+                stream: bool = False, 
+                offset: int = 0, 
+                limit: int = None, 
+                range_header: str = None, 
+                cursor: str = None, 
+                details: bool = False, 
+                if_none_match: str = None, 
+                if_modified_since: str = None, 
+                raw: bool = False, 
+                columnar: bool = False, 
+                accept_encoding: str = None, 
+                line_start: int = None, 
+                line_count: int = None):
+    """An internal function that is called by the 2 get requests below depending on whether it is a file or folder
+
+    Args:
+        path (str): A file or folder path
+        stream (bool, optional): Stream the lines of a file as newline delimited JSON instead of a single JSON blob. Defaults to False.
+        offset (int, optional): The number of lines of a file to skip. Defaults to 0.
+        limit (int, optional): The maximum number of lines of a file or entries of a folder to return. Defaults to None.
+        range_header (str, optional): The HTTP Range header, only honored when streaming a file. Defaults to None.
+        cursor (str, optional): The cursor of the next page of a folder listing. Defaults to None.
+        details (bool, optional): List the name, type, size, owner, permissions and mtime of every entry of a folder. Defaults to False.
+        if_none_match (str, optional): The If-None-Match header of a conditional GET. Defaults to None.
+        if_modified_since (str, optional): The If-Modified-Since header of a conditional GET. Defaults to None.
+        raw (bool, optional): Send the bytes of a file (of any type) as they are instead of JSON. Defaults to False.
+        columnar (bool, optional): Return the folder contents as parallel arrays, 1 per field, instead of 1 item per entry. Defaults to False.
+        accept_encoding (str, optional): The Accept-Encoding header, used to send a precompressed copy of a raw file. Defaults to None.
+        line_start (int, optional): Return the lines of a text file from this line number on, through its line index. Defaults to None.
+        line_count (int, optional): The maximum number of lines to return from line_start. Defaults to None.
+
+    Returns:
+        fastapi.responses.JSONResponse: A JSON Response dictionary containing the keys:
+        
+        If folder:
+        - is_folder: True
+        - folder_contents: A list of folders and files in the folder sent into the get request (or a list of their details)
+        - next_cursor: If paginated, the cursor of the next page or None on the last page
+        If columnar, folder_contents is a dictionary of {field: [value of each entry]}
+
+        If file:
+        - is_file: True
+        - file_contents: A dictionary that contains all the metadata and file contents (that is assumed to fit comfortably within a JSON blob)
+
+        If streaming a file:
+        - One JSON encoded string per line of the file
+
+        If downloading a raw file:
+        - The bytes of the file
+
+        If the client already has the current version (from the ETag or Last-Modified headers), an empty 304 response
+    """    
+
+    # Make sure the path exists and find out whether it is a file or folder with a single (cached) stat
+    path_stats = get_path_stats(path)
+
+    # Folder details include the sizes and times of the entries, which change without changing the folder itself, so they are not validated
+    validators = {}
+    if not (details and stat.S_ISDIR(path_stats.st_mode)):
+        validators = get_validators(path_stats, (stream, offset, limit, cursor, details, raw, columnar, line_start, line_count))
+
+        # Answer a conditional GET before the file is opened or the folder is listed
+        if is_not_modified(validators, if_none_match, if_modified_since):
+            return Response(status_code = 304, headers = validators)
+
+    # If it is a folder, return the appropriate content as a JSONResponse
+    if stat.S_ISDIR(path_stats.st_mode):
+        contents = {'is_folder': True, **get_folder_content(path, limit, cursor, details)}
+        if columnar:
+            contents['folder_contents'] = to_columns(contents['folder_contents'], details)
+
+        return FastJSONResponse(content = contents, headers = validators)
+    
+    # If the get request is a file, merge the metadata and file_data dictionaries and return as a JSONResponse that can be easily parsed
+    elif stat.S_ISREG(path_stats.st_mode):
+        if raw:
+            # Send a precompressed copy of the whole file as it is, if there is one the client accepts
+            sidecar = find_sidecar(path, path_stats, accept_encoding) if range_header is None else None
+            if sidecar:
+                sidecar_path, encoding = sidecar
+                headers = {**validators, 'ETag': 'W/' + validators['ETag'], 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+                return RawFileResponse(sidecar_path, os.stat(sidecar_path), None, headers, mimetypes.guess_type(path)[0])
+
+            # Use fresh stats so that the Content-Length matches the file that is about to be sent
+            return RawFileResponse(path, os.stat(path), range_header, validators)
+
+        if stream:
+            return stream_file_content(path, offset, limit, range_header, validators)
+
+        file_metadata = get_file_metadata(path)
+        if line_start is not None:
+            file_data = get_file_lines(path, line_start, line_count)
+        else:
+            file_data = get_file_content(path, offset, limit)
+        file_contents = {'is_file': True, **vars(file_metadata), **file_data}
+    
+        return FastJSONResponse(content = file_contents, headers = validators)
+
+class DeleteJob:
+    """Tracks the progress of emptying or deleting a folder, which can run in the background and be cancelled"""    
+
+    def __init__(self, operation: str, full_folder_path: str, remove_root: bool):
+        self.id = uuid.uuid4().hex
+        self.operation = operation
+        self.path = full_folder_path
+        self.remove_root = remove_root
+        self.state = 'queued'
+        self.error = None
+        self.entries_removed = 0
+        self.bytes_removed = 0
+        self.started = time.time()
+        self.finished = None
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.saved = 0
+
+    def removed(self, nbytes: int):
+        with self.lock:
+            self.entries_removed += 1
+            self.bytes_removed += nbytes
+            # With STATE_DIR the progress is shared with the other workers about once a second
+            due = state_dir is not None and time.time() - self.saved >= 1
+            if due:
+                self.saved = time.time()
+        if due:
+            self.save()
+
+    def save(self):
+        """Writes the progress of the job to STATE_DIR, where the other workers read it, and picks up a cancellation that was asked for on another worker"""    
+
+        job_path = os.path.join(state_dir, 'jobs', self.id)
+        if os.path.exists(job_path + '.cancel'):
+            self.cancelled.set()
+
+        replace_file(job_path + '.json', json.dumps(self.progress()).encode())
+
+    def run(self):
+        """Deletes the folder and records how it ended. A background job runs this on the delete job executor"""    
+
+        self.state = 'running'
+        try:
+            delete_tree(self.path, self.remove_root, self)
+            self.state = 'cancelled' if self.cancelled.is_set() else 'completed'
+        except Exception as e:
+            self.state, self.error = 'failed', str(e)
+        finally:
+            self.finished = time.time()
+            if state_dir is not None:
+                self.save()
+            invalidate_path(self.path)
+
+    def progress(self):
+        """Gets the progress of the job
+
+        Returns:
+            dict: The job id, operation, path, state, error, entries and bytes removed so far and the rate they were removed at
+        """    
+
+        elapsed = (self.finished or time.time()) - self.started
+
+        return {'job_id': self.id, 
+                'operation': self.operation, 
+                'path': relative_path(self.path), 
+                'state': self.state, 
+                'error': self.error, 
+                'entries_removed': self.entries_removed, 
+                'bytes_removed': self.bytes_removed, 
+                'elapsed': round(elapsed, 3), 
+                'entries_per_second': round(self.entries_removed / elapsed, 1) if elapsed else 0.0, 
+                'bytes_per_second': round(self.bytes_removed / elapsed, 1) if elapsed else 0.0}
+
+
+def unlink_folder_files(folder_path: str, job: DeleteJob):
+    """Removes every file (and symlink) directly inside a folder. This runs on the delete executor
+
+    Args:
+        folder_path (str): The full path of a folder being deleted
+        job (DeleteJob): The job that is deleting it
+
+    Returns:
+        list: The paths of the sub folders, which are removed later once they are empty
+    """    
+
+    sub_folders = []
+    try:
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if job.cancelled.is_set():
+                    break
+                if entry.is_dir(follow_symlinks = False):
+                    sub_folders.append(entry.path)
+                    continue
+                try:
+                    nbytes = entry.stat(follow_symlinks = False).st_size
+                    with fs_op('unlink'):
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    continue
+                job.removed(nbytes)
+    except FileNotFoundError:
+        pass
+
+    return sub_folders
+
+
+def remove_empty_folder(folder_path: str, job: DeleteJob):
+    """Removes a folder whose contents have already been removed. This runs on the delete executor
+
+    Args:
+        folder_path (str): The full path of the folder
+        job (DeleteJob): The job that is deleting it
+    """    
+
+    if job.cancelled.is_set():
+        return
+    try:
+        with fs_op('rmdir'):
+            os.rmdir(folder_path)
+    except FileNotFoundError:
+        return
+    job.removed(0)
+
+
+def delete_tree(full_folder_path: str, remove_root: bool, job: DeleteJob):
+    """Deletes everything inside a folder (and the folder itself if remove_root) with DELETE_WORKERS threads. 
+
+    The tree is walked 1 level at a time with os.scandir: the files of every folder in a level are removed in parallel while the sub folders make up the next level. 
+    The folders are then removed bottom up, deepest level first, so nothing is ever walked after it was deleted and only folder paths are held in memory.
+
+    Args:
+        full_folder_path (str): The full path of the folder
+        remove_root (bool): Also remove the folder itself
+        job (DeleteJob): The job that tracks the progress, which stops at the next entry when it is cancelled
+    """    
+
+    levels = []
+    level = [full_folder_path]
+    while level and not job.cancelled.is_set():
+        sub_folders = []
+        for folders in delete_executor.map(partial(unlink_folder_files, job = job), level):
+            sub_folders.extend(folders)
+        levels.append(sub_folders)
+        level = sub_folders
+
+    for level in reversed(levels):
+        list(delete_executor.map(partial(remove_empty_folder, job = job), level))
+
+    if remove_root and not job.cancelled.is_set():
+        remove_empty_folder(full_folder_path, job)
+
+
+# Background jobs by id, the oldest finished jobs are forgotten once there are more than JOB_HISTORY
+delete_jobs = OrderedDict()
+delete_jobs_lock = threading.Lock()
+
+
+def start_delete_job(operation: str, full_folder_path: str, remove_root: bool):
+    """Queues emptying or deleting a folder on the delete job executor, which runs DELETE_JOBS jobs at a time
+
+    Args:
+        operation (str): The name of the endpoint that started the job
+        full_folder_path (str): The full path of the folder
+        remove_root (bool): Also remove the folder itself
+
+    Returns:
+        DeleteJob: The queued job
+    """    
+
+    job = DeleteJob(operation, full_folder_path, remove_root)
+    with delete_jobs_lock:
+        delete_jobs[job.id] = job
+        finished = [job_id for job_id, old_job in delete_jobs.items() if old_job.finished is not None]
+        for job_id in finished[:max(len(delete_jobs) - job_history, 0)]:
+            del delete_jobs[job_id]
+            if state_dir is not None:
+                for extension in ('.json', '.cancel'):
+                    try:
+                        os.unlink(os.path.join(state_dir, 'jobs', job_id + extension))
+                    except FileNotFoundError:
+                        pass
+
+    if state_dir is not None:
+        job.save()
+    delete_job_executor.submit(job.run)
+    return job
+
+
+def get_delete_job(job_id: str):
+    """Finds a background job by its id
+
+    Args:
+        job_id (str): The job_id returned when the job was started
+
+    Raises:
+        HTTPException: If there is no such job, raise a 404 error
+
+    Returns:
+        DeleteJob: The job
+    """    
+
+    job = delete_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return job
+
+
+def read_shared_job(job_id: str, cancel: bool = False):
+    """Reads the progress of a background job that another worker is running from STATE_DIR
+
+    Args:
+        job_id (str): The job_id returned when the job was started
+        cancel (bool, optional): Also ask the worker running it to cancel the job, which it does within about a second. Defaults to False.
+
+    Raises:
+        HTTPException: If no worker has such a job, raise a 404 error
+
+    Returns:
+        dict: The progress of the job when it was last saved
+    """    
+
+    # Job ids are hex, so they can never point outside of the jobs folder
+    job_path = os.path.join(state_dir, 'jobs', job_id)
+    try:
+        if not job_id.isalnum():
+            raise FileNotFoundError
+        with open(job_path + '.json') as file:
+            progress = json.load(file)
+    except (FileNotFoundError, ValueError):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if cancel and progress['state'] in ('queued', 'running'):
+        with open(job_path + '.cancel', 'w'):
+            pass
+
+    return progress
+
+
+def scan_index_folder(folder_path: str):
+    """Reads the entries of a single folder for the path index. This runs on the job executor
+
+    Args:
+        folder_path (str): The full path of a folder
+
+    Returns:
+        tuple: The index rows of the entries and the full paths of the sub folders
+    """    
+
+    rows, sub_folders = [], []
+    try:
+        with fs_op('scandir'), os.scandir(folder_path) as entries:
+            for entry in entries:
+                if is_upload_temp(entry.name):
+                    continue
+                try:
+                    entry_stats = entry.stat(follow_symlinks = False)
+                except FileNotFoundError:
+                    continue
+                is_folder = entry.is_dir(follow_symlinks = False)
+                if is_folder:
+                    sub_folders.append(entry.path)
+                rows.append(path_index.row(entry.path, is_folder, entry_stats))
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        pass
+
+    return rows, sub_folders
+
+
+class PathIndex:
+    """A persistent index of every file and folder below the root directory, stored in SQLite so that searches by name, size and time never walk the tree. 
+    Paths are stored relative to the root directory with / as the separator.
+    """    
+
+    columns = "(path TEXT PRIMARY KEY, parent TEXT NOT NULL, name TEXT NOT NULL, is_folder INTEGER NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL)"
+
+    def __init__(self, db_path: str, root: str):
+        self.db_path = db_path
+        self.root = os.path.normpath(os.path.abspath(root))
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self.building = threading.Lock()
+        self.changed_while_building = set()
+        # Changed paths wait here for the writer thread, which applies all of them in 1 transaction, so a path changed many times is only written once
+        self.pending = set()
+        self.queued = 0
+        self.applied = 0
+        self.updates = threading.Condition()
+        self.writer = None
+        # The folders found by the last build that are not watched, whose changes made outside of the app are only picked up by watch_index
+        self.unwatched_folders = None
+        # Only the worker that holds the lock of the index watches its folders, and built_at of the index it watched
+        self.watch_lock_fd = None
+        self.watched_built_at = None
+        self.watching = None
+
+    def connection(self):
+        """Gets the SQLite connection of the current thread, creating the database the first time
+
+        Returns:
+            sqlite3.Connection: A connection in WAL mode, so searches are not blocked while the index is written
+        """    
+
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Only imported once the index is used, since it is not needed to start the app
+            import sqlite3
+
+            conn = sqlite3.connect(self.db_path, timeout = 30, isolation_level = None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS entries ' + self.columns)
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.local.conn = conn
+
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Writes to the index in a single transaction, 1 writer at a time
+
+        Yields:
+            sqlite3.Connection: The connection of the current thread
+        """    
+
+        conn = self.connection()
+        with self.write_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def relative(self, full_path: str):
+        return os.path.relpath(os.path.abspath(full_path), self.root).replace(os.sep, '/')
+
+    def row(self, full_path: str, is_folder: bool, path_stats: os.stat_result):
+        relative = self.relative(full_path)
+        parent, _, name = relative.rpartition('/')
+        return (relative, parent, name, int(is_folder), path_stats.st_size, path_stats.st_mtime)
+
+    def built_at(self):
+        row = self.connection().execute("SELECT value FROM meta WHERE key = 'built_at'").fetchone()
+        return float(row[0]) if row else None
+
+    def build(self, newer_than: float = None):
+        """Scans the whole tree with JOB_WORKERS threads, 1 level at a time, into a new table that then replaces the index in 1 step, so searches never see a half built index. 
+        Only 1 build runs at a time, across every process that shares the index file, and a build that is asked for while another is running is skipped. 
+        Changes made during the build are applied again once it is done.
+
+        Args:
+            newer_than (float, optional): Skip the build if the index was already built after this unix timestamp, such as by another worker. Defaults to None.
+        """    
+
+        if not self.building.acquire(blocking = False):
+            return
+        lock_fd = os.open(self.db_path + '.lock', os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is building the same index
+                return
+            if newer_than is not None and (self.built_at() or 0) >= newer_than:
+                return
+
+            conn = self.connection()
+            with self.write_lock:
+                self.changed_while_building.clear()
+                conn.execute('DROP TABLE IF EXISTS entries_build')
+                conn.execute('CREATE TABLE entries_build ' + self.columns)
+
+            folders = []
+            level = [self.root]
+            while level:
+                folders.extend(level)
+                next_level = []
+                for rows, sub_folders in job_executor.map(scan_index_folder, level):
+                    with self.transaction():
+                        conn.executemany('INSERT OR REPLACE INTO entries_build VALUES (?, ?, ?, ?, ?, ?)', rows)
+                    next_level.extend(sub_folders)
+                level = next_level
+
+            # The names of the indexes are unique to each build, because the indexes of the old table are only dropped with it
+            build_id = uuid.uuid4().hex[:8]
+            for column in ['parent', 'name', 'size', 'mtime']:
+                conn.execute('CREATE INDEX entries_{0}_{1} ON entries_build ({0})'.format(column, build_id))
+
+            built_at = time.time()
+            with self.transaction():
+                conn.execute('DROP TABLE IF EXISTS entries')
+                conn.execute('ALTER TABLE entries_build RENAME TO entries')
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('built_at', ?)", (str(built_at),))
+                changed = list(self.changed_while_building)
+        finally:
+            # Closing the file also releases the lock
+            os.close(lock_fd)
+            self.building.release()
+
+        for full_path in changed:
+            self.update(full_path)
+
+        # Keep the index up to date with changes made outside of the app, if this is the worker that watches it
+        if self.watch_lock_fd is not None:
+            self.watch_folders(folders, built_at)
+
+    def claim_watches(self, blocking: bool = False):
+        """Makes this worker the one that watches the folders of the index. Every change that a worker watches is written to the index file they all share, 
+        so only the worker that holds the lock of the index watches its folders. The lock is released when that worker exits (such as when gunicorn recycles it), 
+        and the next worker waiting for it takes over the watches
+
+        Args:
+            blocking (bool, optional): Wait until the worker that holds the lock exits. Defaults to False.
+
+        Returns:
+            bool: Whether this worker watches the index
+        """    
+
+        if self.watch_lock_fd is not None:
+            return True
+
+        lock_fd = os.open(self.db_path + '.watch', os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            return False
+
+        self.watch_lock_fd = lock_fd
+        return True
+
+    def watch_folders(self, folders: list, built_at: float):
+        """Watches up to INDEX_MAX_WATCHES folders of the index, the ones closest to the root first
+
+        Args:
+            folders (list): The full paths of the folders, ordered by depth
+            built_at (float): When the index that the folders were found in was built
+        """    
+
+        watcher = start_path_watcher()
+        watched = 0
+        if watcher is not None:
+            for folder_path in folders[:index_max_watches]:
+                watched += watcher.watch(os.path.normpath(folder_path), pinned = True)
+        self.unwatched_folders = len(folders) - watched
+        self.watched_built_at = built_at
+
+    def indexed_folders(self):
+        """Reads the folders of the index, so a worker that takes over the watches does not have to walk the tree
+
+        Returns:
+            list: The full paths of the root directory and every folder below it, ordered by depth
+        """    
+
+        relatives = [path for path, in self.connection().execute('SELECT path FROM entries WHERE is_folder = 1 ORDER BY path')]
+        relatives.sort(key = lambda path: path.count('/'))
+
+        return [self.root] + [os.path.join(self.root, *path.split('/')) for path in relatives]
+
+    def start_watching(self):
+        """Starts the watch_index thread of this worker once the index is used"""    
+
+        with self.updates:
+            if self.watching is None:
+                self.watching = threading.Thread(target = watch_index, name = 'index-watch', daemon = True)
+                self.watching.start()
+
+    def update(self, full_path: str):
+        """Queues a path that changed for the writer thread, which brings the index up to date for it. This is a path_change_listeners listener, 
+        so it does not wait for SQLite
+
+        Args:
+            full_path (str): A normalized file or folder path, or None if anything could have changed
+        """    
+
+        if full_path is None:
+            threading.Thread(target = self.build, name = 'index-build', daemon = True).start()
+            return
+
+        relative = self.relative(full_path)
+        if relative in ('.', '..') or relative.startswith('../') or is_upload_temp(os.path.basename(full_path)):
+            return
+
+        if self.building.locked():
+            with self.write_lock:
+                self.changed_while_building.add(full_path)
+
+        with self.updates:
+            self.pending.add(full_path)
+            self.queued += 1
+            if self.writer is None:
+                self.writer = threading.Thread(target = self.write_updates, name = 'index-writer', daemon = True)
+                self.writer.start()
+            self.updates.notify()
+
+    def wait_for_updates(self, timeout: float):
+        """Waits until the changes queued so far are in the index, so that a search made after a change sees it
+
+        Args:
+            timeout (float): The most seconds to wait
+
+        Returns:
+            bool: Whether the changes were applied in time
+        """    
+
+        with self.updates:
+            queued = self.queued
+            return self.updates.wait_for(lambda: self.applied >= queued, timeout)
+
+    def write_updates(self):
+        """Applies the queued changes in batches, 1 transaction per batch. This runs on the index-writer thread"""    
+
+        while True:
+            with self.updates:
+                self.updates.wait_for(lambda: self.pending)
+                paths, self.pending = self.pending, set()
+                queued = self.queued
+
+            try:
+                if self.built_at() is not None:
+                    with self.transaction() as conn:
+                        for full_path in paths:
+                            self.apply(conn, full_path)
+            except Exception:
+                # The index is stale once a batch could not be written, so it is built again
+                threading.Thread(target = self.build, name = 'index-build', daemon = True).start()
+            finally:
+                with self.updates:
+                    self.applied = queued
+                    self.updates.notify_all()
+
+    def apply(self, conn, full_path: str):
+        """Brings the index up to date for a path that changed
+
+        Args:
+            conn (sqlite3.Connection): The connection of a transaction
+            full_path (str): A normalized file or folder path
+        """    
+
+        relative = self.relative(full_path)
+        try:
+            path_stats = os.stat(full_path, follow_symlinks = False)
+        except (FileNotFoundError, NotADirectoryError):
+            conn.execute('DELETE FROM entries WHERE path = ? OR (path >= ? AND path < ?)', (relative, relative + '/', relative + '0'))
+            return
+
+        is_folder = stat.S_ISDIR(path_stats.st_mode)
+        known = conn.execute('SELECT 1 FROM entries WHERE path = ?', (relative,)).fetchone() is not None
+        conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)', self.row(full_path, is_folder, path_stats))
+
+        # A folder that was moved in from elsewhere already has contents
+        if is_folder and not known:
+            level = [full_path]
+            while level:
+                next_level = []
+                for folder_path in level:
+                    rows, sub_folders = scan_index_folder(folder_path)
+                    conn.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)', rows)
+                    next_level.extend(sub_folders)
+                level = next_level
+
+    def note_change(self, full_path: str):
+        """Remembers a path that another worker changed while this one builds the index, so it is applied again once the build is done. This is a path_change_listeners listener
+
+        Args:
+            full_path (str): A normalized file or folder path, or None if anything could have changed
+        """    
+
+        if full_path is not None and self.building.locked():
+            with self.write_lock:
+                self.changed_while_building.add(full_path)
+
+    def search(self, 
+            name: str = None, 
+            glob: str = None, 
+            prefix: str = None, 
+            under: str = None, 
+            entry_type: str = None, 
+            min_size: int = None, 
+            max_size: int = None, 
+            modified_after: float = None, 
+            modified_before: float = None, 
+            limit: int = 1000, 
+            after: str = None):
+        """Finds the files and folders that match every filter that is given, ordered by path
+
+        Args:
+            name (str, optional): The exact name of the file or folder
+            glob (str, optional): A case sensitive glob pattern for the name, such as *.txt
+            prefix (str, optional): The start of the name
+            under (str, optional): Only search below this folder, relative to the root directory
+            entry_type (str, optional): Either file or folder
+            min_size (int, optional): The smallest size in bytes
+            max_size (int, optional): The largest size in bytes
+            modified_after (float, optional): The earliest modification time as a unix timestamp
+            modified_before (float, optional): The latest modification time as a unix timestamp
+            limit (int, optional): The maximum number of results. Defaults to 1000.
+            after (str, optional): Only return paths after this one, which is used to page through results
+
+        Returns:
+            list: A dictionary with the path, name, type, size and mtime of each result
+        """    
+
+        clauses, params = [], []
+        if name is not None:
+            clauses.append('name = ?')
+            params.append(name)
+        if glob is not None:
+            clauses.append('name GLOB ?')
+            params.append(glob)
+        if prefix is not None:
+            # Escape the glob characters so the prefix is matched as it is (a GLOB prefix can use the index on name)
+            clauses.append('name GLOB ?')
+            params.append(''.join('[{}]'.format(c) if c in '*?[' else c for c in prefix) + '*')
+        if under:
+            under = under.strip('/')
+            clauses.append('path >= ? AND path < ?')
+            params.extend([under + '/', under + '0'])
+        if entry_type is not None:
+            clauses.append('is_folder = ?')
+            params.append(int(entry_type == 'folder'))
+        if min_size is not None:
+            clauses.append('size >= ?')
+            params.append(min_size)
+        if max_size is not None:
+            clauses.append('size <= ?')
+            params.append(max_size)
+        if modified_after is not None:
+            clauses.append('mtime >= ?')
+            params.append(modified_after)
+        if modified_before is not None:
+            clauses.append('mtime <= ?')
+            params.append(modified_before)
+        if after is not None:
+            clauses.append('path > ?')
+            params.append(after)
+
+        query = 'SELECT path, name, is_folder, size, mtime FROM entries'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY path LIMIT ?'
+        params.append(limit)
+
+        return [{'path': path, 'name': name, 'type': 'folder' if is_folder else 'file', 'size': size, 'mtime': mtime} 
+                for path, name, is_folder, size, mtime in self.connection().execute(query, params)]
+
+    def stats(self):
+        """Gets the number of files and folders in the index and when it was built
+
+        Returns:
+            dict: The entries in the index, when it was last built, whether it is being built, the changes waiting to be applied 
+                and whether changes made outside of the app are only picked up by the periodic rescan for some folders (partial)
+        """    
+
+        count = self.connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {'entries': count, 
+                'built_at': self.built_at(), 
+                'building': self.building.locked(), 
+                'pending_updates': len(self.pending), 
+                'unwatched_folders': self.unwatched_folders, 
+                'partial': bool(self.unwatched_folders), 
+                'path': self.db_path}
+
+
+path_index = PathIndex(index_db_path, root_path)
+path_change_listeners.append(path_index.update)
+# The index file is shared, so a change is written to it once by the worker that made it (unless the index is being rebuilt by another worker)
+shared_change_listeners.append(path_index.update)
+path_change_listeners.append(path_index.note_change)
+
+
+def start_index_build(newer_than: float = None):
+    """Builds the path index on a background thread
+
+    Args:
+        newer_than (float, optional): Skip the build if the index was already built after this unix timestamp. Defaults to None.
+    """    
+
+    threading.Thread(target = path_index.build, args = (newer_than,), name = 'index-build', daemon = True).start()
+    path_index.start_watching()
+
+
+# How often the worker that watches the index checks whether another worker rebuilt it
+index_watch_check_interval = 5
+
+
+def watch_index():
+    """Watches the folders of the path index in 1 worker of the server at a time, and rebuilds the index every INDEX_RESCAN_INTERVAL seconds when some of its 
+    folders are not watched, which is every folder without inotify and the folders beyond INDEX_MAX_WATCHES with it. 
+    Every worker that used the index runs this, and the ones that are not watching wait for the lock of the one that is, so the next one takes over when it exits
+    """    
+
+    path_index.claim_watches(blocking = True)
+    rescanned = time.time()
+    while True:
+        built_at = path_index.built_at()
+        # The index was built by another worker (or before this one took over), so its folders are read from the index
+        if built_at is not None and built_at != path_index.watched_built_at and not path_index.building.locked():
+            path_index.watch_folders(path_index.indexed_folders(), built_at)
+
+        if path_index.unwatched_folders and index_rescan_interval > 0 and time.time() - rescanned >= index_rescan_interval:
+            path_index.build()
+            rescanned = time.time()
+
+        time.sleep(index_watch_check_interval)
+
+
+@app.on_event('startup')
+def start_index():
+    """Builds the path index in the background when the app starts if INDEX_ON_STARTUP is true"""    
+
+    # Every worker starts the build, but the index only has to be built once for the whole server
+    if index_on_startup:
+        start_index_build(state_started)
+
+
+# The number of files, their bytes and the sub folders directly inside each folder, which only need to be read again once the folder or a file in it changes
+folder_summaries = PathCache(du_cache_max_folders, 1024 * du_cache_max_folders, 24 * 60 * 60)
+
+
+def invalidate_summaries(path: str):
+    """Drops the summaries of a changed path and of its folder. This is a path_change_listeners listener
+
+    Args:
+        path (str): A normalized file or folder path, or None if anything could have changed
+    """    
+
+    if path is None:
+        folder_summaries.clear()
+    else:
+        folder_summaries.discard(('summary', path))
+        folder_summaries.discard(('summary', os.path.dirname(path)))
+
+
+path_change_listeners.append(invalidate_summaries)
+
+
+def summarize_folder(folder_path: str):
+    """Gets the number of files, their bytes and the names of the sub folders directly inside a folder. This runs on the job executor
+
+    Args:
+        folder_path (str): A normalized folder path
+
+    Returns:
+        dict: The files, bytes and folders of the folder, or None if it no longer exists
+    """    
+
+    try:
+        with fs_op('stat'):
+            folder_stats = os.stat(folder_path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+    # A file that grows does not change the mtime of its folder, so the folder is watched (before it is read, to not miss a change in between) 
+    # as long as the watcher has room without dropping other watches. Otherwise its summary expires after DU_CACHE_TTL seconds
+    watcher = start_path_watcher()
+    watched = watcher is not None and watcher.watch(folder_path, evict = False)
+
+    # A cached summary is only used if the folder has not changed since
+    key = ('summary', folder_path)
+    summary = folder_summaries.get(key)
+    if summary is not None and summary['mtime_ns'] == folder_stats.st_mtime_ns and (summary['watched'] or time.monotonic() - summary['scanned'] < du_cache_ttl):
+        return summary
+
+    files, nbytes, sub_folders = 0, 0, []
+    try:
+        with fs_op('scandir'), os.scandir(folder_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks = False):
+                    sub_folders.append(entry.name)
+                    continue
+                try:
+                    nbytes += entry.stat(follow_symlinks = False).st_size
+                except FileNotFoundError:
+                    continue
+                files += 1
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+    summary = {'mtime_ns': folder_stats.st_mtime_ns, 'watched': watched, 'scanned': time.monotonic(), 'files': files, 'bytes': nbytes, 'folders': sub_folders}
+    folder_summaries.put(key, summary, 128 + sum(len(name) + 64 for name in sub_folders), path_signature(folder_stats))
+
+    return summary
+
+
+def iter_disk_usage(folder_path: str):
+    """Adds up the files, bytes and folders below a folder with JOB_WORKERS threads, 1 level at a time, from the summaries of each folder
+
+    Args:
+        folder_path (str): A folder path that has been checked with get_path_stats
+
+    Yields:
+        dict: The running totals after each level, and finally the totals with a breakdown for each sub folder
+    """    
+
+    folder_path = os.path.normpath(folder_path)
+    totals = {'files': 0, 'bytes': 0, 'folders': 0}
+    children = {}
+    scanned = 0
+
+    # Every folder is scanned with the name of the sub folder of the top folder it is in, to break the totals down
+    level = [(folder_path, None)]
+    while level:
+        next_level = []
+        for (path, child), summary in zip(level, job_executor.map(summarize_folder, [path for path, child in level])):
+            if summary is None:
+                continue
+            scanned += 1
+            totals['files'] += summary['files']
+            totals['bytes'] += summary['bytes']
+            totals['folders'] += len(summary['folders'])
+            if child is not None:
+                children[child]['files'] += summary['files']
+                children[child]['bytes'] += summary['bytes']
+                children[child]['folders'] += len(summary['folders'])
+            for name in summary['folders']:
+                if child is None:
+                    children[name] = {'name': name, 'files': 0, 'bytes': 0, 'folders': 0}
+                next_level.append((os.path.join(path, name), child or name))
+        level = next_level
+
+        if level:
+            yield {'partial': True, 'scanned_folders': scanned, **totals}
+
+    yield {'partial': False, 
+            'path': relative_path(folder_path), 
+            'scanned_folders': scanned, 
+            **totals, 
+            'children': sorted(children.values(), key = lambda child: child['bytes'], reverse = True)}
+
+
+def scan_tree_folder(folder_path: str):
+    """Reads the details of every entry of a folder for /tree. This runs on the job executor
+
+    Args:
+        folder_path (str): The full path of a folder
+
+    Returns:
+        tuple: The details of each entry from get_entry_details and the names of the sub folders that are not symlinks
+    """    
+
+    details, sub_folders = [], []
+    try:
+        with fs_op('scandir'), os.scandir(folder_path) as entries:
+            for entry in entries:
+                if is_upload_temp(entry.name):
+                    continue
+                try:
+                    details.append(get_entry_details(entry))
+                except FileNotFoundError:
+                    continue
+                if entry.is_dir(follow_symlinks = False):
+                    sub_folders.append(entry.name)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        pass
+
+    return details, sub_folders
+
+
+def iter_tree(folder_path: str, depth: int):
+    """Lists the entries of a folder and its sub folders down to a depth with JOB_WORKERS threads, 1 level at a time. Symlinked folders are not followed
+
+    Args:
+        folder_path (str): A folder path that has been checked with get_path_stats
+        depth (int): The number of levels to list, where 1 only lists the folder itself
+
+    Yields:
+        dict: The path of each folder relative to the root directory, its depth and the details of its entries. The last item says whether the tree was truncated
+    """    
+
+    listed = 0
+    level = [os.path.normpath(folder_path)]
+    for current_depth in range(depth):
+        next_level = []
+        for path, (details, sub_folders) in zip(level, job_executor.map(scan_tree_folder, level)):
+            listed += len(details)
+            yield {'path': relative_path(path), 'depth': current_depth, 'entries': details}
+            if listed >= tree_max_entries:
+                yield {'truncated': True, 'entries_listed': listed}
+                return
+            next_level.extend(os.path.join(path, name) for name in sub_folders)
+        level = next_level
+
+    yield {'truncated': False, 'entries_listed': listed}
+
+
+def nest_tree(records, depth: int):
+    """Turns the folders yielded by iter_tree into a single nested tree
+
+    Args:
+        records (iterator): The items yielded by iter_tree
+        depth (int): The depth that was passed to iter_tree
+
+    Returns:
+        dict: The top folder, where every listed folder has its entries as children and the folders that were not listed have children set to None
+    """    
+
+    nodes = {}
+    tree = None
+    for record in records:
+        if 'path' not in record:
+            tree['truncated'] = record['truncated']
+            continue
+
+        if tree is None:
+            node = tree = {'path': record['path'], 'type': 'folder', 'children': []}
+        else:
+            node = nodes.pop(record['path'])
+
+        listed = record['depth'] + 1 < depth
+        for entry in record['entries']:
+            child = dict(vars(entry))
+            if entry.type == 'folder':
+                child['children'] = [] if listed else None
+                if listed:
+                    nodes[os.path.normpath(os.path.join(record['path'], entry.name))] = child
+            node['children'].append(child)
+
+    # Symlinked folders and folders after a truncation were never listed
+    for child in nodes.values():
+        child['children'] = None
+
+    return tree
+
+
+def ndjson_response(records):
+    """Streams items as newline delimited JSON, 1 item per line, pulling them on the read executor
+
+    Args:
+        records (iterator): A blocking iterator of JSON serializable items
+
+    Returns:
+        fastapi.responses.StreamingResponse: A chunked newline delimited JSON response
+    """    
+
+    return StreamingResponse(iterate_io(json_dumps(record) + b'\n' for record in records), media_type = 'application/x-ndjson')
+
+
+# The followers of each file, as (event loop, asyncio.Event) pairs that are set when the file may have changed, and the followed files of each folder
+follow_waiters = {}
+follow_folders = {}
+follow_lock = threading.Lock()
+
+
+def notify_followers(path: str):
+    """Wakes the followers of a file that changed. This is a path_change_listeners listener, called on the watcher thread
+
+    Args:
+        path (str): A normalized file or folder path, or None if anything could have changed
+    """    
+
+    with follow_lock:
+        if not follow_waiters:
+            return
+        if path is None:
+            files = list(follow_waiters)
+        else:
+            # A change to the folder itself (or its watch being dropped) could also be a change to the files in it
+            files = [path] + list(follow_folders.get(path, ()))
+        waiters = [waiter for file_path in files for waiter in follow_waiters.get(file_path, ())]
+
+    for loop, event in waiters:
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            pass
+
+
+path_change_listeners.append(notify_followers)
+
+
+def add_follower(file_path: str, waiter: tuple):
+    with follow_lock:
+        if sum(len(waiters) for waiters in follow_waiters.values()) >= follow_max_clients:
+            raise HTTPException(status_code=503, detail="Too many files are being followed")
+        follow_waiters.setdefault(file_path, set()).add(waiter)
+        follow_folders.setdefault(os.path.dirname(file_path), set()).add(file_path)
+
+
+def remove_follower(file_path: str, waiter: tuple):
+    with follow_lock:
+        waiters = follow_waiters.get(file_path, set())
+        waiters.discard(waiter)
+        if not waiters:
+            follow_waiters.pop(file_path, None)
+            folder_files = follow_folders.get(os.path.dirname(file_path), set())
+            folder_files.discard(file_path)
+            if not folder_files:
+                follow_folders.pop(os.path.dirname(file_path), None)
+
+
+def read_last_lines(fd: int, size: int, count: int):
+    """Reads the last complete lines of a file backwards from its end, so following a large file does not read all of it
+
+    Args:
+        fd (int): The open file
+        size (int): The size of the file
+        count (int): The number of lines
+
+    Returns:
+        tuple: The lines and the byte after the last complete line, where following continues (a last line without a newline is sent once it is complete). 
+            Only the lines within the last FOLLOW_TAIL_MAX_BYTES are returned, so a file with few newlines is never read whole
+    """    
+
+    chunks, position, end, newlines = [], size, None, 0
+    while position > max(0, size - follow_tail_max_bytes) and (end is None or newlines < count):
+        read_size = min(65536, position)
+        position -= read_size
+        chunk = os.pread(fd, read_size, position)
+        chunks.append(chunk)
+
+        if end is None:
+            last_newline = chunk.rfind(b'\n')
+            if last_newline >= 0:
+                end = position + last_newline + 1
+                newlines += chunk.count(b'\n', 0, last_newline)
+        else:
+            newlines += chunk.count(b'\n')
+
+    if end is None:
+        # A line that is longer than FOLLOW_TAIL_MAX_BYTES is skipped, and following starts at the end of the file
+        return [], 0 if position == 0 else size
+
+    data = b''.join(reversed(chunks))[:end - position]
+    fs_bytes_read.inc(amount = len(data))
+    lines = decode_lines(data)
+    # Unless the scan reached the start of the file, its first line can be cut off
+    if position > 0:
+        lines = lines[1:]
+
+    return lines[len(lines) - count:] if count else [], end
+
+
+def read_appended(fd: int, file_path: str, position: int):
+    """Reads what was appended to a followed file since the last read, and notices when it was truncated or replaced (rotated)
+
+    Args:
+        fd (int): The open followed file
+        file_path (str): The path of the followed file
+        position (int): The byte up to which the file was already read
+
+    Returns:
+        dict: The new bytes (up to 1MB at a time) and the position after them, whether there is more to read, the inode of the file, 
+        and if the file was truncated or rotated, the event and the file and position to continue from
+    """    
+
+    file_stats = os.fstat(fd)
+    update = {'fd': fd, 'inode': file_stats.st_ino, 'position': position, 'data': b'', 'more': False, 'event': None}
+
+    if file_stats.st_size < position:
+        update['event'] = 'truncated'
+        update['position'] = position = 0
+
+    if file_stats.st_size > position:
+        with fs_op('read'):
+            update['data'] = os.pread(fd, min(file_stats.st_size - position, 1024 * 1024), position)
+        fs_bytes_read.inc(amount = len(update['data']))
+        update['position'] = position + len(update['data'])
+        update['more'] = update['position'] < file_stats.st_size
+        return update
+
+    # Once the old file has been read to its end, continue with a new file at the same path
+    try:
+        path_stats = os.stat(file_path)
+    except FileNotFoundError:
+        return update
+    if (path_stats.st_dev, path_stats.st_ino) != (file_stats.st_dev, file_stats.st_ino):
+        update.update({'fd': os.open(file_path, os.O_RDONLY), 'inode': path_stats.st_ino, 'position': 0, 'more': True, 'event': 'rotated'})
+        os.close(fd)
+
+    return update
+
+
+def format_sse(lines: list, event_id: str = None, event: str = None):
+    """Formats lines as Server-Sent Events, 1 event per line
+
+    Args:
+        lines (list): The lines
+        event_id (str, optional): The id of the last event, which the client sends back as Last-Event-ID when it reconnects. Defaults to None.
+        event (str, optional): Instead of lines, send a single event of this type, such as truncated or rotated. Defaults to None.
+
+    Returns:
+        str: The events
+    """    
+
+    if event is not None:
+        return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(event))
+
+    events = ['data: {}\n\n'.format(json.dumps(line)) for line in lines]
+    if events and event_id is not None:
+        events[-1] = 'id: {}\n'.format(event_id) + events[-1]
+
+    return ''.join(events)
+
+
+async def follow_file(request: Request, file_path: str, tail: int, last_event_id: str = None):
+    """Follows a text file like tail -f as Server-Sent Events: the last lines of the file, then every line appended to it as soon as it is written
+
+    The follower sleeps on an asyncio.Event that the inotify watcher sets when the folder of the file changes, so an idle follower costs only an open file 
+    and a small coroutine. Without inotify (or if an event was missed), the file is checked every FOLLOW_POLL_INTERVAL seconds.
+
+    Args:
+        request (Request): The request, to notice when the client disconnects
+        file_path (str): The followed text file
+        tail (int): The number of lines to send before following
+        last_event_id (str, optional): The Last-Event-ID header of a reconnecting client, to continue where it stopped instead of sending the last lines again. Defaults to None.
+
+    Raises:
+        HTTPException: If not a .txt file, raise a BadRequest Error
+        HTTPException: If there are more than FOLLOW_MAX_CLIENTS followers, raise a Service Unavailable Error
+
+    Returns:
+        fastapi.responses.StreamingResponse: A text/event-stream response
+    """    
+
+    check_text_file(file_path)
+    file_path = os.path.normpath(file_path)
+    await run_io('read', get_path_stats, file_path)
+
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    waiter = (loop, changed)
+    add_follower(file_path, waiter)
+
+    # The follower is removed again if anything fails before the response takes it over
+    try:
+        watcher = await run_io('read', start_path_watcher)
+        fd = await run_io('read', os.open, file_path, os.O_RDONLY)
+    except BaseException:
+        remove_follower(file_path, waiter)
+        raise
+
+    # With inotify, checking the file now and then is only a safety net for missed events
+    check_interval = follow_heartbeat if isinstance(watcher, InotifyWatcher) else follow_poll_interval
+
+    async def events():
+        nonlocal fd
+        try:
+            file_stats = await run_io('read', os.fstat, fd)
+
+            # A reconnecting client continues from the id of the last event it got, if it is still the same file
+            inode, _, position = (last_event_id or '').partition(':')
+            if inode == str(file_stats.st_ino) and position.isdigit() and int(position) <= file_stats.st_size:
+                position = int(position)
+                yield 'retry: 3000\n\n'
+            else:
+                lines, position = await run_io('read', read_last_lines, fd, file_stats.st_size, tail)
+                yield 'retry: 3000\n\n' + format_sse(lines, '{}:{}'.format(file_stats.st_ino, position))
+
+            pending = b''
+            last_sent = loop.time()
+            while True:
+                if watcher is not None:
+                    await run_io('read', watcher.watch, os.path.dirname(file_path))
+
+                try:
+                    await asyncio.wait_for(changed.wait(), min(check_interval, follow_heartbeat))
+                except asyncio.TimeoutError:
+                    pass
+                changed.clear()
+
+                if await request.is_disconnected():
+                    return
+
+                more = True
+                while more:
+                    update = await run_io('read', read_appended, fd, file_path, position)
+                    fd, position, more = update['fd'], update['position'], update['more']
+
+                    if update['event'] is not None:
+                        pending = b''
+                        yield format_sse([], event = update['event'])
+                        last_sent = loop.time()
+
+                    # Only complete lines are sent, the rest waits for its newline
+                    data = pending + update['data']
+                    last_newline = data.rfind(b'\n')
+                    if last_newline >= 0:
+                        pending = data[last_newline + 1:]
+                        yield format_sse(decode_lines(data[:last_newline + 1]), '{}:{}'.format(update['inode'], position - len(pending)))
+                        last_sent = loop.time()
+                    else:
+                        pending = data
+
+                # A comment keeps proxies from closing an idle connection
+                if loop.time() - last_sent >= follow_heartbeat:
+                    yield ': heartbeat\n\n'
+                    last_sent = loop.time()
+        finally:
+            remove_follower(file_path, waiter)
+            os.close(fd)
+
+    return StreamingResponse(events(), media_type = 'text/event-stream', headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+class StackSampler:
+    """A sampling profiler that records the Python stack of every thread of the process at a fixed interval from a background thread
+
+    Only reading sys._current_frames is needed per sample, so the threads being profiled are not slowed down beyond sharing the GIL for a moment.
+    """    
+
+    # The innermost frames of threads that are waiting for work, which are left out unless idle stacks are asked for
+    idle_frames = {('thread.py', '_worker'), ('selectors.py', 'select'), ('threading.py', 'wait'), ('queue.py', 'get'), ('base_events.py', '_run_once')}
+
+    def __init__(self, interval: float, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target = self.run, name = 'profiler', daemon = True)
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+
+                if not self.include_idle and (stack[0][1], stack[0][0]) in self.idle_frames:
+                    continue
+                self.samples[(names.get(thread_id, str(thread_id)), tuple(reversed(stack)))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """Stops sampling
+
+        Returns:
+            Counter: The number of times each (thread name, stack) was sampled
+        """    
+
+        self.stopped.set()
+        self.thread.join()
+        return self.samples
+
+
+def collapsed_stacks(samples: Counter):
+    """Formats the samples as collapsed stacks, 1 line per stack with its frames separated by ; and the number of samples, as read by flamegraph.pl
+
+    Args:
+        samples (Counter): The samples returned by StackSampler.stop
+
+    Returns:
+        str: The collapsed stacks, the most sampled first
+    """    
+
+    lines = []
+    for (thread_name, stack), count in samples.most_common():
+        frames = ['{} ({}:{})'.format(name, filename, line) for name, filename, line in stack]
+        lines.append('{} {}'.format(';'.join([thread_name] + frames), count))
+
+    return '\n'.join(lines) + '\n'
+
+
+def speedscope_profile(samples: Counter, interval: float, seconds: float):
+    """Formats the samples as a speedscope profile (https://www.speedscope.app), with 1 sampled profile per thread
+
+    Args:
+        samples (Counter): The samples returned by StackSampler.stop
+        interval (float): The sampling interval in seconds, which is the weight of each sample
+        seconds (float): How long the profile was sampled for
+
+    Returns:
+        dict: The profile in the speedscope file format
+    """    
+
+    frames, frame_ids, profiles = [], {}, {}
+    for (thread_name, stack), count in samples.items():
+        stack_ids = []
+        for frame in stack:
+            if frame not in frame_ids:
+                frame_ids[frame] = len(frames)
+                frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+            stack_ids.append(frame_ids[frame])
+
+        profile = profiles.setdefault(thread_name, {'type': 'sampled', 'name': thread_name, 'unit': 'seconds', 
+                                                    'startValue': 0, 'endValue': seconds, 'samples': [], 'weights': []})
+        profile['samples'].append(stack_ids)
+        profile['weights'].append(count * interval)
+
+    return {'$schema': 'https://www.speedscope.app/file-format-schema.json', 
+            'name': 'filesystem_restapi', 
+            'exporter': 'filesystem_restapi', 
+            'shared': {'frames': frames}, 
+            'profiles': [profiles[name] for name in sorted(profiles)]}
+
+
+profile_lock = threading.Lock()
+
+
+def check_debug_token(authorization: str):
+    """Checks the bearer token of a request to a debug endpoint
+
+    Args:
+        authorization (str): The Authorization request header
+
+    Raises:
+        HTTPException: If DEBUG_PROFILE_TOKEN is not set, raise a NotFound Error as the endpoint is turned off
+        HTTPException: If the token is missing or wrong, raise an Unauthorized Error
+    """    
+
+    if not debug_profile_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), debug_profile_token.encode()):
+        raise HTTPException(status_code=401, detail="A valid debug token is required", headers = {'WWW-Authenticate': 'Bearer'})
+
+
+# Note that every GET route has to be declared before the sub_folder route below, which matches any path
+@app.get('/cachestats')
+async def cache_stats():
+    """Show the hit and miss counters of the cache shared by the GET requests
+
+    Returns:
+        fastapi.response.JSONResponse: The cache counters, its size and the watcher used to keep it up to date
+    """    
+
+    watcher = path_watcher.name if path_watcher is not None else None
+    return {**path_cache.stats(), 'watcher': watcher}
+
+
+@app.get('/metrics')
+async def metrics():
+    """Show the request, latency, file system and cache metrics in the Prometheus text format
+
+    Returns:
+        fastapi.responses.PlainTextResponse: The metrics, to be scraped by Prometheus
+    """    
+
+    # The cache counters are kept by the caches themselves and copied in when scraped
+    for cache_name, cache in [('path', path_cache), ('summaries', folder_summaries)]:
+        for counter, value in cache.stats().items():
+            cache_counters.set((cache_name, counter), value)
+    rate_limit_clients.set((), rate_limiter.stats())
+
+    lines = [line for metric in metrics_registry for line in metric.render()]
+    return PlainTextResponse('\n'.join(lines) + '\n', media_type = 'text/plain; version=0.0.4')
+
+
+@app.get('/debug/profile')
+async def debug_profile(seconds: float = Query(10, gt = 0, le = debug_profile_max_seconds), 
+            format: str = Query('collapsed', regex = '^(collapsed|speedscope)$'), 
+            idle: bool = False, 
+            authorization: str = Header(None)):
+    """Profile every thread of this worker for a number of seconds with a sampling profiler. Only enabled when DEBUG_PROFILE_TOKEN is set, which has to be sent as a bearer token
+
+    Args:
+        seconds (float, optional): How long to profile for, up to DEBUG_PROFILE_MAX_SECONDS. Defaults to 10.
+        format (str, optional): collapsed (for flamegraph.pl) or speedscope. Defaults to 'collapsed'.
+        idle (bool, optional): Include the stacks of threads that are waiting for work. Defaults to False.
+        authorization (str, optional): The Authorization header with the debug token. Defaults to None.
+
+    Raises:
+        HTTPException: If profiling is turned off or the token is wrong, raise a NotFound or Unauthorized Error
+        HTTPException: If another profile is running, raise a Conflict Error
+
+    Returns:
+        fastapi.responses.Response: The collapsed stacks as text, or the speedscope profile as JSON
+    """    
+
+    check_debug_token(authorization)
+
+    if not profile_lock.acquire(blocking = False):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    try:
+        # The sampler runs on its own thread, so the profile does not hold a read or write thread
+        sampler = StackSampler(debug_profile_interval, idle)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            # Joining the sampler waits for the sample it is taking, which is slow with many threads, so it is not done on the event loop
+            samples = await run_io('read', sampler.stop)
+    finally:
+        profile_lock.release()
+
+    if format == 'speedscope':
+        return FastJSONResponse(speedscope_profile(samples, debug_profile_interval, seconds))
+
+    return PlainTextResponse(collapsed_stacks(samples))
+
+
+@app.get('/jobs/{job_id}')
+async def job_progress(job_id: str):
+    """Show the progress of a background job started by /emptyfolder or /deletetree
+
+    Args:
+        job_id (str): The job_id returned when the job was started
+
+    Returns:
+        fastapi.response.JSONResponse: The state of the job and the entries and bytes removed so far with their rate
+    """    
+
+    if job_id not in delete_jobs and state_dir is not None:
+        return await run_io('read', read_shared_job, job_id)
+
+    return get_delete_job(job_id).progress()
+
+
+@app.delete('/jobs/{job_id}')
+async def cancel_job(job_id: str):
+    """Cancel a background job, which stops at the next entry. Anything already removed stays removed
+
+    Args:
+        job_id (str): The job_id returned when the job was started
+
+    Returns:
+        fastapi.response.JSONResponse: The progress of the job when it was cancelled
+    """    
+
+    if job_id not in delete_jobs and state_dir is not None:
+        return await run_io('write', read_shared_job, job_id, True)
+
+    job = get_delete_job(job_id)
+    job.cancelled.set()
+
+    return job.progress()
+
+
+@app.get('/search')
+async def search(name: str = None, 
+                glob: str = None, 
+                prefix: str = None, 
+                under: str = None, 
+                type: str = Query(None, regex = '^(file|folder)$'), 
+                min_size: int = Query(None, ge = 0), 
+                max_size: int = Query(None, ge = 0), 
+                modified_after: float = None, 
+                modified_before: float = None, 
+                limit: int = Query(1000, ge = 1, le = 10000), 
+                cursor: str = None):
+    """Search every file and folder below the root directory from the path index, instead of walking the tree 1 folder at a time. All the filters that are given must match
+
+    Args:
+        name (str, optional): The exact name of the file or folder. Defaults to None.
+        glob (str, optional): A case sensitive glob pattern for the name, such as *.txt. Defaults to None.
+        prefix (str, optional): The start of the name. Defaults to None.
+        under (str, optional): Only search below this folder, relative to the root directory. Defaults to None.
+        type (str, optional): Either file or folder. Defaults to None.
+        min_size (int, optional): The smallest size in bytes. Defaults to None.
+        max_size (int, optional): The largest size in bytes. Defaults to None.
+        modified_after (float, optional): The earliest modification time as a unix timestamp. Defaults to None.
+        modified_before (float, optional): The latest modification time as a unix timestamp. Defaults to None.
+        limit (int, optional): The maximum number of results in a page. Defaults to 1000.
+        cursor (str, optional): The next_cursor returned by the previous page. Defaults to None.
+
+    Raises:
+        HTTPException: If the index has not been built yet, a 503 is returned and the index is built in the background
+
+    Returns:
+        fastapi.response.JSONResponse: The path, name, type, size and mtime of each result and the cursor of the next page (None on the last page)
+    """    
+
+    if await run_io('read', path_index.built_at) is None:
+        start_index_build()
+        raise HTTPException(status_code=503, detail="The index is being built, try again later", headers={'Retry-After': '5'})
+    # The index could have been built by another worker, which could exit and leave its watches to this one
+    path_index.start_watching()
+
+    # The changes made before the search are applied first, as long as that does not take more than a second
+    await run_io('read', path_index.wait_for_updates, 1)
+    after = decode_cursor(cursor) if cursor else None
+    results = await run_io('read', path_index.search, name, glob, prefix, under, type, min_size, max_size, modified_after, modified_before, limit + 1, after)
+    next_cursor = encode_cursor(results[limit - 1]['path']) if len(results) > limit else None
+
+    return FastJSONResponse({'results': results[:limit], 'next_cursor': next_cursor})
+
+
+@app.get('/du/{sub_path:path}')
+async def disk_usage(sub_path: str, stream: bool = False):
+    """Show the total bytes, files and folders below a folder, with a breakdown for each of its sub folders. The summary of every folder is cached 
+    until the folder changes, so repeating the request for a folder that has not changed only needs 1 stat per folder
+
+    Args:
+        sub_path (str): The path of the folder starting at the home directory
+        stream (bool, optional): Stream the running totals after each level of the tree as newline delimited JSON, followed by the final totals. Defaults to False.
+
+    Returns:
+        fastapi.response.JSONResponse: The bytes, files and folders below the folder and the same totals for each sub folder
+    """    
+
+    full_sub_path = os.path.join(root_path, sub_path)
+    path_stats = await run_io('read', get_path_stats, full_sub_path)
+
+    # The disk usage of a file is just its size
+    if not stat.S_ISDIR(path_stats.st_mode):
+        return {'partial': False, 'path': relative_path(full_sub_path), 'scanned_folders': 0, 'files': 1, 'bytes': path_stats.st_size, 'folders': 0, 'children': []}
+
+    if stream:
+        return ndjson_response(iter_disk_usage(full_sub_path))
+
+    return FastJSONResponse(await run_io('read', lambda: list(iter_disk_usage(full_sub_path))[-1]))
+
+
+@app.get('/tree/{sub_path:path}')
+async def tree(sub_path: str, depth: int = Query(2, ge = 1, le = 64), stream: bool = False):
+    """Show the entries of a folder and its sub folders down to a depth in 1 request, with the same details as a folder listing with details=true
+
+    Args:
+        sub_path (str): The path of the folder starting at the home directory
+        depth (int, optional): The number of levels to list, where 1 only lists the folder itself. Defaults to 2.
+        stream (bool, optional): Stream each folder as newline delimited JSON as soon as it is listed instead of a nested tree. Defaults to False.
+
+    Raises:
+        HTTPException: If this is not a folder, raise a BadRequest Error
+
+    Returns:
+        fastapi.response.JSONResponse: The nested tree, where each folder below the depth has children set to None. Listings stop after TREE_MAX_ENTRIES entries and truncated is then True
+    """    
+
+    full_sub_path = os.path.join(root_path, sub_path)
+    path_stats = await run_io('read', get_path_stats, full_sub_path)
+
+    if not stat.S_ISDIR(path_stats.st_mode):
+        raise HTTPException(status_code=422, detail="Only a folder can be listed as a tree")
+
+    if stream:
+        return ndjson_response(iter_tree(full_sub_path, depth))
+
+    return FastJSONResponse(await run_io('read', nest_tree, iter_tree(full_sub_path, depth), depth))
+
+
+@app.get('/indexstats')
+async def index_stats():
+    """Show the number of entries in the path index and when it was built
+
+    Returns:
+        fastapi.response.JSONResponse: The entries in the index, when it was last built and whether it is being built
+    """    
+
+    return await run_io('read', path_index.stats)
+
+
+@app.post('/index/rebuild')
+async def rebuild_index():
+    """Rebuild the path index in the background, for example after large changes that were made while the app was not running
+
+    Returns:
+        fastapi.response.JSONResponse: A simple dict showing that the rebuild started
     """    
 
-    # Make sure the path exists
-    does_exist(path)
+    start_index_build()
 
-    # If it is a folder, return the appropriate content as a JSONResponse
-    if os.path.isdir(path):
-        contents = {'is_folder': True, 'folder_contents' : os.listdir(path)}
+    return JSONResponse(status_code = 202, content = {'detail' : 'Index Rebuild Started'})
 
-        return JSONResponse(content = contents)
-    
-    # If the get request is a file, merge the metadata and file_data dictionaries and return as a JSONResponse that can be easily parsed
-    elif os.path.isfile(path):
-        file_metadata = get_file_metadata(path)
-        file_data = get_file_content(path)
-        file_contents = {'is_file': True, **file_metadata, **file_data}
-    
-        return JSONResponse(content = file_contents)
 
 # The home folder that is specified in the shell script or the command line
 @app.get('/')
-def root_folder():
+async def root_folder(limit: int = Query(None, ge = 1), 
+            cursor: str = None, 
+            details: bool = False, 
+            columnar: bool = False, 
+            if_none_match: str = Header(None), 
+            if_modified_since: str = Header(None)):
     """Show the contents of the root folder as inputted by the user in the shell script
 
+    Args:
+        limit (int, optional): The maximum number of entries in a page of the listing. Defaults to None.
+        cursor (str, optional): The next_cursor returned by the previous page. Defaults to None.
+        details (bool, optional): List the details of every entry instead of only its name. Defaults to False.
+        columnar (bool, optional): Return the contents as parallel arrays, 1 per field, which is smaller for large listings. Defaults to False.
+        if_none_match (str, optional): The If-None-Match header, a 304 is returned if the ETag of the listing has not changed. Defaults to None.
+        if_modified_since (str, optional): The If-Modified-Since header, a 304 is returned if the folder has not changed since. Defaults to None.
+
     Returns:
         fastapi.response.JSONResponse: A JSON result showing the folders and files in the root directory
     """    
 
-    return request_output(root_path)
+    return await run_io('read', request_output, root_path, False, 0, limit, None, cursor, details, if_none_match, if_modified_since, False, columnar)
 
 
 @app.get('/{sub_path:path}')
-def sub_folder(sub_path: str):
+async def sub_folder(sub_path: str, 
+            request: Request, 
+            stream: bool = False, 
+            offset: int = Query(0, ge = 0), 
+            limit: int = Query(None, ge = 1), 
+            range_header: str = Header(None, alias = 'Range'), 
+            cursor: str = None, 
+            details: bool = False, 
+            if_none_match: str = Header(None), 
+            if_modified_since: str = Header(None), 
+            raw: bool = False, 
+            columnar: bool = False, 
+            accept_encoding: str = Header(None), 
+            line_start: int = Query(None, ge = 0), 
+            line_count: int = Query(None, ge = 1), 
+            follow: bool = False, 
+            tail: int = Query(10, ge = 0, le = 10000), 
+            last_event_id: str = Header(None)):
     """Calls the same request_output function above to return the contents of either a file or folder
 
     Args:
         sub_path (str): The path starting at the home directory
+        stream (bool, optional): For a file, stream each line as newline delimited JSON so that large files are never loaded into memory. Defaults to False.
+        offset (int, optional): For a file, the number of lines to skip. Defaults to 0.
+        limit (int, optional): For a file, the maximum number of lines to return. For a folder, the maximum number of entries in a page. Defaults to None.
+        range_header (str, optional): The HTTP Range header, which limits a streamed file to the requested bytes. Defaults to None.
+        cursor (str, optional): For a folder, the next_cursor returned by the previous page. Defaults to None.
+        details (bool, optional): For a folder, list the name, type, size, owner, permissions and mtime of every entry in 1 request. Defaults to False.
+        if_none_match (str, optional): The If-None-Match header, a 304 is returned if the ETag of the file or folder has not changed. Defaults to None.
+        if_modified_since (str, optional): The If-Modified-Since header, a 304 is returned if the file or folder has not changed since. Defaults to None.
+        raw (bool, optional): For a file of any type, download its bytes as they are. Honors the Range header. Defaults to False.
+        columnar (bool, optional): For a folder, return the contents as parallel arrays, 1 per field, which is smaller for large listings. Defaults to False.
+        accept_encoding (str, optional): The Accept-Encoding header. A raw file with a precompressed copy next to it (such as file.txt.gz) is sent compressed as it is. Defaults to None.
+        line_start (int, optional): For a text file, return the lines from this line number on (starting at 0) together with the total number of lines, without reading the lines before it. Defaults to None.
+        line_count (int, optional): The maximum number of lines to return from line_start. Defaults to None, which returns up to 1000 lines.
+        follow (bool, optional): For a text file, send its last lines and then every new line as Server-Sent Events, like tail -f. Defaults to False.
+        tail (int, optional): The number of lines to send before following. Defaults to 10.
+        last_event_id (str, optional): The Last-Event-ID header, sent by a client that reconnects to a followed file to continue where it stopped. Defaults to None.
 
     Returns:
         fastapi.response.JSONResponse: A JSON result showing the folders and files in the root directory or file contents
@@ -146,7 +4195,10 @@ def sub_folder(sub_path: str):
 
     # Join this sub-path from the root_path which is the home directory
     full_sub_path = os.path.join(root_path, sub_path)
-    return request_output(full_sub_path)
+    if follow:
+        return await follow_file(request, full_sub_path, tail, last_event_id)
+
+    return await run_io('read', request_output, full_sub_path, stream, offset, limit, range_header, cursor, details, if_none_match, if_modified_since, raw, columnar, accept_encoding, line_start, line_count)
 
 
 class CreateFolder(BaseModel):
@@ -160,8 +4212,26 @@ class CreateFolder(BaseModel):
             }
     }
 
+def make_folder(full_folder_path: str):
+    """Creates a folder on the local file system. This runs on the write executor
+
+    Args:
+        full_folder_path (str): The full path of the folder to create
+
+    Raises:
+        HTTPException: If the folder already exists, no action is taken
+    """    
+
+    # If a file path exists, then no action is taken. This can be changed to return a success status message that the request was received but no action was taken.
+    if os.path.exists(full_folder_path):
+        raise HTTPException(status_code=422, detail="Folder already exists, no action taken")
+
+    with fs_op('mkdir'):
+        os.mkdir(full_folder_path)
+    invalidate_path(full_folder_path)
+
 @app.post('/createfolder')
-def create_folder(create: CreateFolder):
+async def create_folder(create: CreateFolder):
     """Send a POST request to create a folder as a JSON formatted request where (key, value) = (create_name, 'folder_name'). Note that to create a folder, it must be in relation to the root directory set up when launching the app. 
 
     Args:
@@ -173,12 +4243,7 @@ def create_folder(create: CreateFolder):
 
     # Create the full path and make sure it exists
     full_folder_path = os.path.join(root_path, create.create_name)
-
-    # If a file path exists, then no action is taken. This can be changed to return a success status message that the request was received but no action was taken.
-    if os.path.exists(full_folder_path):
-        raise HTTPException(status_code=422, detail="Folder already exists, no action taken")
-
-    os.mkdir(full_folder_path)
+    await run_io('write', make_folder, full_folder_path)
 
     return {'detail' : 'Folder Created Successfully'}
     
@@ -197,8 +4262,31 @@ class CreateFile(BaseModel):
             }
     }
 
+def make_file(full_file_path: str, content: str):
+    """Creates a text file on the local file system. This runs on the write executor
+
+    Args:
+        full_file_path (str): The full path of the file to create
+        content (str): The contents of the file
+
+    Raises:
+        HTTPException: If the file type desired is not a text file or the file already exists, no action is taken
+    """    
+
+    # Can only create text files
+    if full_file_path.split('.')[-1] != 'txt':
+        raise HTTPException(status_code=422, detail='Files of type other than .txt cannot be created')
+
+    # If a file path exists, then no action is taken. This can be changed to return an error if needed
+    if os.path.exists(full_file_path):
+        raise HTTPException(status_code=422, detail="File already exists, no action taken")
+
+    with fs_op('write'), open(full_file_path, 'w') as file:
+        fs_bytes_written.inc(amount = file.write(content))
+    invalidate_path(full_file_path)
+
 @app.post('/createfile')
-def create_file(create: CreateFile):
+async def create_file(create: CreateFile):
     """Send a POST request to create a file as a JSON formatted request where (key1: value1, key2: value2) = (create_name: 'file_name', 'create_content': 'Content'). Note that to create a file, it must be in relation to the root directory set up when launching the app. 
 
     Args:
@@ -211,37 +4299,213 @@ def create_file(create: CreateFile):
         fastapi.response.JSONResponse: A simple dict showing a success message. 
     """    
 
-    # Can only create text files
-    if create.create_name.split('.')[-1] != 'txt':
-        raise HTTPException(status_code=422, detail='Files of type other than .txt cannot be created')
-
     # Create the full path and make sure it exists
     full_file_path = os.path.join(root_path, create.create_name)
+    await run_io('write', make_file, full_file_path, create.create_content)
 
-    # If a file path exists, then no action is taken. This can be changed to return an error if needed
-    if os.path.exists(full_file_path):
+    return {'detail' : 'File Created Successfully'}
+
+
+def open_upload(full_file_path: str, overwrite: bool):
+    """Opens a hidden temporary file next to the file being uploaded, so that the upload can be moved into place in a single rename once it is complete.
+    This runs on the write executor
+
+    Args:
+        full_file_path (str): The full path of the file being uploaded
+        overwrite (bool): Whether an existing file can be replaced
+
+    Raises:
+        HTTPException: If the folder does not exist or the file already exists and cannot be overwritten, no action is taken
+
+    Returns:
+        tuple: The open temporary file and its path
+    """    
+
+    does_exist(os.path.dirname(full_file_path) or root_path)
+
+    if not overwrite and os.path.exists(full_file_path):
         raise HTTPException(status_code=422, detail="File already exists, no action taken")
 
-    with open(full_file_path, 'w') as file:
-        file.write(create.create_content)
+    # Created like tempfile.mkstemp does (only readable by the owner and never an existing file), with a name that is_upload_temp recognizes
+    temp_path = os.path.join(os.path.dirname(full_file_path) or root_path, upload_temp_prefix + uuid.uuid4().hex + upload_temp_suffix)
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC, 0o600)
+    return os.fdopen(fd, 'wb'), temp_path
+
+
+def write_upload_chunk(file, chunk: bytes, digest):
+    """Writes a chunk of an upload to its temporary file and adds it to the checksum. This runs on the write executor
+
+    Args:
+        file (io.BufferedWriter): The temporary file returned by open_upload
+        chunk (bytes): The next chunk of the request body
+        digest (hashlib.sha256): The checksum of the upload so far
+    """    
+
+    with fs_op('write'):
+        file.write(chunk)
+    fs_bytes_written.inc(amount = len(chunk))
+    digest.update(chunk)
 
-    return {'detail' : 'File Created Successfully'}
+
+def commit_upload(file, temp_path: str, full_file_path: str, overwrite: bool):
+    """Flushes a complete upload to disk and moves it into place, so readers only ever see the old file or the complete new one. 
+    This runs on the write executor
+
+    Args:
+        file (io.BufferedWriter): The temporary file returned by open_upload
+        temp_path (str): The path of the temporary file
+        full_file_path (str): The full path of the file being uploaded
+        overwrite (bool): Whether an existing file can be replaced
+
+    Raises:
+        HTTPException: If the file was created by someone else during the upload and cannot be overwritten, no action is taken
+    """    
+
+    file.flush()
+    os.fsync(file.fileno())
+    os.fchmod(file.fileno(), 0o666 & ~process_umask)
+    file.close()
+
+    if overwrite:
+        os.replace(temp_path, full_file_path)
+    else:
+        # A hard link fails if the file exists, which makes the check and the rename a single step
+        try:
+            os.link(temp_path, full_file_path)
+        except FileExistsError:
+            raise HTTPException(status_code=422, detail="File already exists, no action taken")
+        except OSError:
+            if os.path.exists(full_file_path):
+                raise HTTPException(status_code=422, detail="File already exists, no action taken")
+            os.rename(temp_path, full_file_path)
+        else:
+            os.unlink(temp_path)
+
+    invalidate_path(full_file_path)
+
+
+def discard_upload(file, temp_path: str):
+    """Closes and removes the temporary file of an upload that failed. This runs on the write executor
+
+    Args:
+        file (io.BufferedWriter): The temporary file returned by open_upload
+        temp_path (str): The path of the temporary file
+    """    
+
+    file.close()
+    if os.path.exists(temp_path):
+        os.unlink(temp_path)
+
+
+@app.post('/uploadfile/{upload_name:path}')
+async def upload_file(upload_name: str, 
+                    request: Request, 
+                    sha256: str = None, 
+                    overwrite: bool = False, 
+                    content_length: int = Header(None)):
+    """Send a POST request with the raw contents of a file as the body to upload it in chunks, instead of as a single JSON string with /createfile. 
+    Memory use does not grow with the size of the file and readers never see a partially written file. Note that the file must be in relation to the root directory set up when launching the app. 
+
+    Args:
+        upload_name (str): The path of the file starting at the home directory
+        request (Request): The request, whose body is read as a stream
+        sha256 (str, optional): The hex sha256 checksum of the file, which is verified before the file is moved into place. Defaults to None.
+        overwrite (bool, optional): Replace the file if it already exists. Defaults to False.
+        content_length (int, optional): The Content-Length header, used to reject uploads that are too large before reading them. Defaults to None.
+
+    Raises:
+        HTTPException: If the file is not a text file, already exists, is larger than the upload limit or does not match its checksum, no action is taken
+
+    Returns:
+        fastapi.response.JSONResponse: A simple dict showing a success message and the size and checksum of the file. 
+    """    
+
+    # Can only create text files
+    if upload_name.split('.')[-1] != 'txt':
+        raise HTTPException(status_code=422, detail='Files of type other than .txt cannot be created')
+
+    if content_length is not None and content_length > upload_max_bytes:
+        raise HTTPException(status_code=413, detail="File is larger than the upload limit")
+
+    full_file_path = os.path.join(root_path, upload_name)
+    file, temp_path = await run_io('write', open_upload, full_file_path, overwrite)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > upload_max_bytes:
+                raise HTTPException(status_code=413, detail="File is larger than the upload limit")
+            if chunk:
+                await run_io('write', write_upload_chunk, file, chunk, digest)
+
+        if sha256 is not None and digest.hexdigest() != sha256.lower():
+            raise HTTPException(status_code=422, detail="Checksum does not match, no action taken")
+
+        await run_io('write', commit_upload, file, temp_path, full_file_path, overwrite)
+    except BaseException:
+        await run_io('write', discard_upload, file, temp_path)
+        raise
+
+    return {'detail' : 'File Uploaded Successfully', 'size': size, 'sha256': digest.hexdigest()}
 
 
 class EmptyFolder(BaseModel):
 
     delete_name: str
+    background: bool = False
 
     class Config:
         schema_extra = {
             "example": {
                 'delete_name': 'test1',
+                'background': False,
             }
     }
 
+def check_clear_folder(full_folder_path: str):
+    """Makes sure a folder can be emptied. This runs on the write executor
+
+    Args:
+        full_folder_path (str): The full path of the folder to empty
+
+    Raises:
+        HTTPException: If this is a file or the folder does not exist, no action is taken
+    """    
+
+    # Make sure the client is not trying to empty a file, only a folder
+    if full_folder_path.endswith('.txt'):
+        raise HTTPException(status_code=422, detail="Note that empty_folder is only to empty a folder, not to empty the contents of files")
+
+    does_exist(full_folder_path)
+
+    if not os.path.isdir(full_folder_path):
+        raise HTTPException(status_code=422, detail="Note that empty_folder is only to empty a folder, not to empty the contents of files")
+
+
+def clear_folder(full_folder_path: str):
+    """Removes all the files and sub folders within a folder, but not the folder itself. This runs on the write executor
+
+    Args:
+        full_folder_path (str): The full path of the folder to empty
+
+    Raises:
+        HTTPException: If this is a file or the folder does not exist, no action is taken
+    """    
+
+    check_clear_folder(full_folder_path)
+
+    # Remove the contents bottom up with the same parallel walker as a background job
+    job = DeleteJob('emptyfolder', full_folder_path, remove_root = False)
+    job.run()
+    if job.error is not None:
+        raise HTTPException(status_code=500, detail="Folder could not be emptied: " + job.error)
+
 @app.delete('/emptyfolder')
-def empty_folder(empty: EmptyFolder):
+async def empty_folder(empty: EmptyFolder):
     """If a folder is not empty, empty all the data within the folder, including files and subfolders. Note that this folder must be specified relative to the root directory specified at startup. 
+    With background set to True, a job id is returned right away and the progress of the job can be followed with GET /jobs/{job_id}. 
 
     Args:
         empty (EmptyFolder): Inherits from the EmptyFolder class. If the request is incorrect, it is verified by Pydantic's data validation object. delete_name has to be a str
@@ -250,27 +4514,95 @@ def empty_folder(empty: EmptyFolder):
         HTTPException: If this is a .txt file, raise an 400 error, this API cannot empty the contents of a text file. Can add this functionality if neede
 
     Returns:
-        fastapi.response.JSONResponse: A simple dict showing a success message. 
+        fastapi.response.JSONResponse: A simple dict showing a success message, or the job id of a background job. 
     """    
 
-    # Make sure the client is not trying to empty a file, only a folder
-    if empty.delete_name.endswith('.txt'):
-        raise HTTPException(status_code=422, detail="Note that empty_folder is only to empty a folder, not to empty the contents of files")
-
     # Create the full path and make sure it exists
     full_folder_path = os.path.join(root_path, empty.delete_name)
-    does_exist(full_folder_path)
 
-    # Walk through all the files and sub directories within this 1 and remove contents
-    for root, dirs, files in os.walk(full_folder_path):
-        for f in files:
-            os.unlink(os.path.join(root, f))
-        for d in dirs:
-            shutil.rmtree(os.path.join(root, d))
+    if empty.background:
+        await run_io('write', check_clear_folder, full_folder_path)
+        job = start_delete_job('emptyfolder', full_folder_path, remove_root = False)
+        return JSONResponse(status_code = 202, content = {'detail' : 'Folder Emptying Started', 'job_id' : job.id})
+
+    await run_io('write', clear_folder, full_folder_path)
     
     return {'detail' : 'Folder Emptied Successfully'}
 
 
+class DeleteTree(BaseModel):
+
+    delete_name: str
+    background: bool = False
+
+    class Config:
+        schema_extra = {
+            "example": {
+                'delete_name': 'test1',
+                'background': True,
+            }
+    }
+
+def check_delete_tree(full_folder_path: str):
+    """Makes sure a folder can be deleted with everything inside it. This runs on the write executor
+
+    Args:
+        full_folder_path (str): The full path of the folder to delete
+
+    Raises:
+        HTTPException: If this is the root directory, not a folder or does not exist, no action is taken
+    """    
+
+    does_exist(full_folder_path)
+
+    if os.path.normpath(full_folder_path) == os.path.normpath(root_path):
+        raise HTTPException(status_code=422, detail="The root directory cannot be deleted")
+
+    if not os.path.isdir(full_folder_path) or os.path.islink(full_folder_path):
+        raise HTTPException(status_code=422, detail="Note that delete_tree is only to delete a folder, use the delete file method for files")
+
+
+def remove_tree(full_folder_path: str):
+    """Deletes a folder with all the files and sub folders inside it. This runs on the write executor
+
+    Args:
+        full_folder_path (str): The full path of the folder to delete
+    """    
+
+    check_delete_tree(full_folder_path)
+
+    job = DeleteJob('deletetree', full_folder_path, remove_root = True)
+    job.run()
+    if job.error is not None:
+        raise HTTPException(status_code=500, detail="Folder could not be deleted: " + job.error)
+
+@app.delete('/deletetree')
+async def delete_tree_folder(delete: DeleteTree):
+    """Deletes a folder together with everything inside it in 1 request, instead of emptying it first. Note that this folder must be specified relative to the root directory specified at startup. 
+    With background set to True, a job id is returned right away and the progress of the job can be followed with GET /jobs/{job_id}. 
+
+    Args:
+        delete (DeleteTree): Inherits from the DeleteTree class. If the request is incorrect, it is verified by Pydantic's data validation object. delete_name has to be a str
+
+    Raises:
+        HTTPException: The root directory and files cannot be deleted with this method
+
+    Returns:
+        fastapi.response.JSONResponse: A simple dict showing a success message, or the job id of a background job. 
+    """    
+
+    full_folder_path = os.path.join(root_path, delete.delete_name)
+
+    if delete.background:
+        await run_io('write', check_delete_tree, full_folder_path)
+        job = start_delete_job('deletetree', full_folder_path, remove_root = True)
+        return JSONResponse(status_code = 202, content = {'detail' : 'Folder Deletion Started', 'job_id' : job.id})
+
+    await run_io('write', remove_tree, full_folder_path)
+
+    return {'detail' : 'Folder Deleted Successfully'}
+
+
 class DeleteFolder(BaseModel):
 
     delete_name: str
@@ -282,8 +4614,27 @@ class DeleteFolder(BaseModel):
             }
     }
 
+def remove_folder(full_folder_path: str):
+    """Deletes an empty folder from the local file system. This runs on the write executor
+
+    Args:
+        full_folder_path (str): The full path of the folder to delete
+
+    Raises:
+        HTTPException: If the folder does not exist or is not empty, no action is taken
+    """    
+
+    does_exist(full_folder_path)
+
+    if len(os.listdir(full_folder_path)) > 0:
+        raise HTTPException(status_code=422, detail="A folder must be empty before deletion. Use the empty folder method")
+
+    with fs_op('rmdir'):
+        os.rmdir(full_folder_path)
+    invalidate_path(full_folder_path)
+
 @app.delete('/deletefolder')
-def delete_folder(delete: DeleteFolder):
+async def delete_folder(delete: DeleteFolder):
     """If a folder is empty, this function deletes the folder. Note that this folder must be specified relative to the root directory specified at startup. 
 
     Args:
@@ -298,12 +4649,7 @@ def delete_folder(delete: DeleteFolder):
 
     # Create the full path and make sure it exists
     full_folder_path = os.path.join(root_path, delete.delete_name)
-    does_exist(full_folder_path)
-
-    if len(os.listdir(full_folder_path)) > 0:
-        raise HTTPException(status_code=422, detail="A folder must be empty before deletion. Use the empty folder method")
-
-    os.rmdir(full_folder_path)
+    await run_io('write', remove_folder, full_folder_path)
 
     return {'detail' : 'Folder Deleted Successfully'}
 
@@ -319,8 +4665,24 @@ class DeleteFile(BaseModel):
             }
     }
 
+def remove_file(full_file_path: str):
+    """Deletes a file from the local file system. This runs on the write executor
+
+    Args:
+        full_file_path (str): The full path of the file to delete
+
+    Raises:
+        HTTPException: If the file does not exist, no action is taken
+    """    
+
+    does_exist(full_file_path)
+
+    with fs_op('unlink'):
+        os.remove(full_file_path)
+    invalidate_path(full_file_path)
+
 @app.delete('/deletefile')
-def delete_file(delete: DeleteFile):
+async def delete_file(delete: DeleteFile):
     """Deletes a file from the local file system. Note that this file must be specified relative to the root directory specified at startup. 
 
     Args:
@@ -332,8 +4694,174 @@ def delete_file(delete: DeleteFile):
 
     # Create the full path and make sure it exists
     full_file_path = os.path.join(root_path, delete.delete_name)
-    does_exist(full_file_path)
+    await run_io('write', remove_file, full_file_path)
+
+    return {'detail' : 'File Deleted Successfully'}
+
+
+class BatchOperation(BaseModel):
+
+    op: str
+    name: str
+    content: str = None
+
+
+class Batch(BaseModel):
+
+    operations: List[BatchOperation]
+    ordered: bool = True
+    stop_on_error: bool = False
+
+    class Config:
+        schema_extra = {
+            "example": {
+                'operations': [
+                    {'op': 'createfolder', 'name': 'test1'}, 
+                    {'op': 'createfile', 'name': 'test1/test1.txt', 'content': 'This is a sample text file that is generated with a batch request'}, 
+                    {'op': 'stat', 'name': 'test1/test1.txt'}, 
+                ], 
+                'ordered': True, 
+                'stop_on_error': False
+            }
+    }
+
+def stat_path(full_path: str):
+    """Gets the metadata of a file or folder for a batch stat operation. This runs on the read executor
+
+    Args:
+        full_path (str): The full path of a file or folder
+
+    Returns:
+        dict: Whether the path is a folder and its metadata from get_file_metadata
+    """    
+
+    path_stats = get_path_stats(full_path)
+    return {'is_folder': stat.S_ISDIR(path_stats.st_mode), **vars(get_file_metadata(full_path))}
+
+
+def read_path(full_path: str):
+    """Gets the contents of a folder or text file for a batch read operation. This runs on the read executor
+
+    Args:
+        full_path (str): The full path of a file or folder
+
+    Raises:
+        HTTPException: If the file is larger than BATCH_READ_MAX_BYTES, raise a 413 error for this operation
+
+    Returns:
+        dict: The folder contents (the first BATCH_READ_MAX_ENTRIES entries, with the cursor of the rest) or file contents
+    """    
+
+    path_stats = get_path_stats(full_path)
+    if stat.S_ISDIR(path_stats.st_mode):
+        return get_folder_content(full_path, batch_read_max_entries)
+
+    if path_stats.st_size > batch_read_max_bytes:
+        raise HTTPException(status_code=413, detail="The file is larger than {} bytes, read it with GET instead of a batch".format(batch_read_max_bytes))
+
+    return get_file_content(full_path)
+
+
+# Each batch operation is the executor it runs on and a function of its full path and content
+batch_operations = {'createfolder': ('write', lambda path, content: make_folder(path)), 
+                    'createfile': ('write', lambda path, content: make_file(path, content or '')), 
+                    'deletefile': ('write', lambda path, content: remove_file(path)), 
+                    'deletefolder': ('write', lambda path, content: remove_folder(path)), 
+                    'emptyfolder': ('write', lambda path, content: clear_folder(path)), 
+                    'deletetree': ('write', lambda path, content: remove_tree(path)), 
+                    'stat': ('read', lambda path, content: stat_path(path)), 
+                    'read': ('read', lambda path, content: read_path(path))}
+
+# The rate limit that each operation is counted against, the same as for the endpoint that does it on its own
+batch_rate_limit_kinds = {'deletefile': 'destructive', 'deletefolder': 'destructive', 'emptyfolder': 'destructive', 'deletetree': 'destructive', 'stat': 'read', 'read': 'read'}
+
+
+async def run_batch_operation(index: int, operation: BatchOperation):
+    """Runs a single operation of a batch and turns any error into a per item result, so that 1 failure does not fail the whole batch
+
+    Args:
+        index (int): The position of the operation in the batch
+        operation (BatchOperation): The operation to run
+
+    Returns:
+        dict: The index, op and name of the operation with its status code and either a detail message or its result
+    """    
+
+    result = {'index': index, 'op': operation.op, 'name': operation.name}
+
+    if operation.op not in batch_operations:
+        return {**result, 'status_code': 422, 'detail': "Unknown operation, use one of: " + ', '.join(batch_operations)}
+
+    kind, func = batch_operations[operation.op]
+    try:
+        output = await run_io(kind, func, os.path.join(root_path, operation.name), operation.content)
+    except HTTPException as e:
+        return {**result, 'status_code': e.status_code, 'detail': e.detail}
+    except FileNotFoundError:
+        return {**result, 'status_code': 404, 'detail': "File or folder not found"}
+    except PermissionError:
+        return {**result, 'status_code': 403, 'detail': "Permission denied"}
+    except OSError as e:
+        return {**result, 'status_code': 500, 'detail': e.strerror or str(e)}
+
+    return {**result, 'status_code': 200, 'result': output}
+
+
+@app.post('/batch')
+async def batch(batch: Batch, request: Request):
+    """Send a POST request with a list of create, delete, empty, stat and read operations to run them all in 1 request. Each operation has an op 
+    (createfolder, createfile, deletefile, deletefolder, emptyfolder, deletetree, stat or read), a name relative to the root directory and, for createfile, the content. 
+
+    Args:
+        batch (Batch): Inherits from the Batch class. ordered runs the operations 1 at a time in order, otherwise up to BATCH_CONCURRENCY of them run at the same time. 
+        stop_on_error skips the operations that have not started after the first error
+        request (Request): The request, whose client is charged for every operation like for separate requests
+
+    Raises:
+        HTTPException: If there are more than BATCH_MAX_OPERATIONS operations, or the operations are over the rate limits of the client, no action is taken
+
+    Returns:
+        fastapi.response.JSONResponse: The number of operations that succeeded, failed and were skipped and the result of each operation in the order they were sent. 
+    """    
+
+    if len(batch.operations) > batch_max_operations:
+        raise HTTPException(status_code=422, detail="Too many operations in 1 batch, the limit is {}".format(batch_max_operations))
+
+    if rate_limiter.limits:
+        costs = Counter(batch_rate_limit_kinds.get(operation.op, 'write') for operation in batch.operations)
+        name, wait = rate_limiter.acquire(rate_limit_client(request.scope), costs)
+        if name is not None:
+            raise too_many_requests(name, wait)
+
+    results = [None] * len(batch.operations)
+    failed = False
+
+    async def run(index: int, operation: BatchOperation):
+        nonlocal failed
+        if failed and batch.stop_on_error:
+            results[index] = {'index': index, 'op': operation.op, 'name': operation.name, 'status_code': None, 'detail': 'Skipped after an earlier error'}
+            return
+        results[index] = await run_batch_operation(index, operation)
+        failed = failed or results[index]['status_code'] != 200
+
+    if batch.ordered:
+        for index, operation in enumerate(batch.operations):
+            await run(index, operation)
+    else:
+        limiter = asyncio.Semaphore(batch_concurrency)
+
+        async def run_limited(index: int, operation: BatchOperation):
+            async with limiter:
+                await run(index, operation)
+
+        await asyncio.gather(*(run_limited(index, operation) for index, operation in enumerate(batch.operations)))
 
-    os.remove(full_file_path)
+    succeeded = sum(1 for result in results if result['status_code'] == 200)
+    # Skipped operations have no status code, so they are not counted as failed
+    skipped = sum(1 for result in results if result['status_code'] is None)
 
-    return {'detail' : 'File Deleted Successfully'}
\ No newline at end of file
+    return FastJSONResponse({'detail' : 'Batch Completed', 
+            'succeeded': succeeded, 
+            'failed': len(results) - succeeded - skipped, 
+            'skipped': skipped, 
+            'results': results})
@@ -1,10 +1,19 @@
 # When running pytest, please make sure to set the environment variable to be inside a test_folder
 import os
+import sys
+import json
+import gzip
+import time
+import stat
+import hashlib
+import uuid
 import shutil
+import subprocess
 import pytest
 from fastapi import FastAPI, Header, HTTPException
 from fastapi.testclient import TestClient
-from app import app
+import app as app_module
+from app import app, io_timeouts, negotiate_encoding, read_appended
 
 client = TestClient(app)
 
@@ -25,6 +34,20 @@ def create_test_folder():
     with open("test_folder/filecontents.txt", "w") as file:
         file.write("This text file is tested in file contents")
 
+    # Create a file with several lines for testing line windows and streaming
+    with open("test_folder/multiline.txt", "w") as file:
+        file.write("\n".join("line {}".format(i) for i in range(10)))
+
+    # Create a file that is large enough to be compressed, and a file with a precompressed copy next to it
+    with open("test_folder/compressible.txt", "w") as file:
+        file.write("\n".join("compressible line {}".format(i) for i in range(200)))
+
+    with open("test_folder/precompressed.txt", "w") as file:
+        file.write("Served without compression")
+
+    with gzip.open("test_folder/precompressed.txt.gz", "wt") as file:
+        file.write("Served from the sidecar")
+
     # Create a test folder for testing folder contents
     os.mkdir('test_folder/foldercontents')
 
@@ -36,6 +59,9 @@ def create_test_folder():
 
     os.mkdir('test_folder/blankfolder')
 
+    # Create a folder for testing that cached listings are invalidated
+    os.mkdir('test_folder/cachefolder')
+
 
     # Create a folder and a file to test that creating these files again will lead to an error
     os.mkdir('test_folder/existingfolder')
@@ -53,6 +79,13 @@ def create_test_folder():
     with open("test_folder/emptyfoldercontents/test2.txt", "w") as file:
         file.write("Testing folder contents file 2")
 
+    # Create nested folders for deleting whole trees
+    for tree in ['deletetree', 'backgroundtree', 'sizetree']:
+        os.makedirs('test_folder/{}/level1/level2'.format(tree))
+        for folder in ['', '/level1', '/level1/level2']:
+            with open('test_folder/{}{}/file.txt'.format(tree, folder), "w") as file:
+                file.write("Testing tree deletion")
+
     # Because these folders and files will be checked for deletion, they will be deleted if the test works, so they should be created everytime
     # Create a folder for deletion
     os.mkdir('test_folder/delete_folder')
@@ -124,6 +157,311 @@ def test_open_file_nottxt(create_test_folder):
     rjson = response.json()
     assert rjson['detail'] == "Only a file with extension .txt can be opened"
 
+# Make sure only the requested window of lines is returned
+def test_sub_file_offset_limit(create_test_folder):
+    response = client.get("/test_folder/multiline.txt?offset=2&limit=3")
+    assert response.status_code == 200
+    rjson = response.json()
+    assert rjson['file_contents'] == ['line 2', 'line 3', 'line 4']
+
+
+# TEST READING LINES BY LINE NUMBER
+# --------------------------------------------------------
+# A page of lines is sliced out of the file through its line index
+def test_sub_file_line_window(create_test_folder):
+    response = client.get("/test_folder/multiline.txt?line_start=3&line_count=2")
+    assert response.status_code == 200
+    rjson = response.json()
+    assert rjson['file_contents'] == ['line 3', 'line 4']
+    assert rjson['total_lines'] == 10
+
+    response = client.get("/test_folder/multiline.txt?line_start=20")
+    assert response.json()['file_contents'] == []
+
+# Lines appended to a file are found by extending its line index
+def test_sub_file_line_window_growing(create_test_folder):
+    with open("test_folder/growing.txt", "w") as file:
+        file.write("first\nsecond\n")
+    assert client.get("/test_folder/growing.txt?line_start=1").json()['file_contents'] == ['second']
+
+    with open("test_folder/growing.txt", "a") as file:
+        file.write("third\nfourth")
+    rjson = client.get("/test_folder/growing.txt?line_start=1").json()
+    assert rjson['file_contents'] == ['second', 'third', 'fourth']
+    assert rjson['total_lines'] == 4
+
+# A file truncated while a window of it is read (such as a log rotated with copytruncate) is indexed again from its new size
+def test_sub_file_line_window_truncated(create_test_folder, monkeypatch):
+    with open("test_folder/rotated.txt", "w") as file:
+        file.write(''.join('line {}\n'.format(index) for index in range(1000)))
+    assert client.get("/test_folder/rotated.txt?line_start=900&line_count=1").json()['file_contents'] == ['line 900']
+
+    # Truncate the file right after the next read stat'ed it, so the read still expects the old size
+    real_fstat = os.fstat
+    truncated = []
+    def fstat_then_truncate(fd):
+        file_stats = real_fstat(fd)
+        if not truncated:
+            truncated.append(True)
+            os.truncate("test_folder/rotated.txt", len(''.join('line {}\n'.format(index) for index in range(100))))
+        return file_stats
+    monkeypatch.setattr(app_module.os, 'fstat', fstat_then_truncate)
+    assert app_module.read_line_window("test_folder/rotated.txt", 50, 2) == (['line 50', 'line 51'], 100)
+    monkeypatch.setattr(app_module.os, 'fstat', real_fstat)
+
+    rjson = client.get("/test_folder/rotated.txt?line_start=900").json()
+    assert rjson['file_contents'] == [] and rjson['total_lines'] == 100
+
+    # A file that keeps being truncated is read line by line instead
+    monkeypatch.setattr(app_module, 'line_index_attempts', 0)
+    assert app_module.read_line_window("test_folder/rotated.txt", 98, 5) == (['line 98', 'line 99'], 100)
+
+
+# TEST STREAMING FILE OUTPUTS
+# --------------------------------------------------------
+# Stream a file as newline delimited JSON, 1 line of the file per line of the response
+def test_stream_file(create_test_folder):
+    response = client.get("/test_folder/multiline.txt?stream=true&offset=8")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == ['line 8', 'line 9']
+
+# A byte range only streams the lines within those bytes, which are not a byte range of the file, so the response is not a 206
+def test_stream_file_range(create_test_folder):
+    response = client.get("/test_folder/multiline.txt?stream=true", headers = {'Range': 'bytes=7-20'})
+    assert response.status_code == 200
+    assert response.headers['x-file-range'] == 'bytes 7-20/69' and 'content-range' not in response.headers
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == ['line 1', 'line 2']
+
+def test_stream_file_range_not_satisfiable(create_test_folder):
+    response = client.get("/test_folder/multiline.txt?stream=true", headers = {'Range': 'bytes=500-'})
+    assert response.status_code == 416
+
+
+# TEST FOLLOWING GROWING FILES
+# --------------------------------------------------------
+# Following a file sends its last lines, then the lines appended to it as Server-Sent Events
+def test_follow_file(create_test_folder, monkeypatch):
+    with open("test_folder/follow.txt", "w") as file:
+        file.write("one\ntwo\nthree\npartial")
+
+    # The client appends to the file the first time the server checks for a disconnect, and disconnects the second time
+    checks = []
+    async def is_disconnected(request):
+        checks.append(True)
+        if len(checks) == 1:
+            with open("test_folder/follow.txt", "a") as file:
+                file.write(" line\nfour\n")
+        return len(checks) > 1
+
+    monkeypatch.setattr(app_module.Request, 'is_disconnected', is_disconnected)
+    monkeypatch.setattr(app_module, 'follow_heartbeat', 0.05)
+
+    response = client.get("/test_folder/follow.txt?follow=true&tail=2")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    lines = [json.loads(line[len('data: '):]) for line in response.text.splitlines() if line.startswith('data: ')]
+    assert lines == ['two', 'three', 'partial line', 'four']
+    assert 'id: ' in response.text
+
+# The last lines are only searched for near the end of the file, and a follower that could not start is not left registered
+def test_follow_tail_limit(create_test_folder, monkeypatch):
+    with open("test_folder/longlines.txt", "w") as file:
+        file.write("first\n" + "x" * 200000 + "\nsecond\nthird\n")
+    monkeypatch.setattr(app_module, 'follow_tail_max_bytes', 65536)
+    fd = os.open("test_folder/longlines.txt", os.O_RDONLY)
+    size = os.fstat(fd).st_size
+    assert app_module.read_last_lines(fd, size, 10) == (['second', 'third'], size)
+    os.close(fd)
+
+    def fail():
+        raise OSError('no watcher')
+    monkeypatch.setattr(app_module, 'start_path_watcher', fail)
+    with pytest.raises(OSError):
+        client.get("/test_folder/longlines.txt?follow=true")
+    assert not [path for path in app_module.follow_waiters if path.endswith('longlines.txt')]
+
+# A truncated or replaced file is noticed and read again from its start
+def test_follow_truncate_rotate(create_test_folder):
+    with open("test_folder/rotate.txt", "w") as file:
+        file.write("old contents\n")
+    fd = os.open("test_folder/rotate.txt", os.O_RDONLY)
+
+    os.truncate("test_folder/rotate.txt", 0)
+    with open("test_folder/rotate.txt", "a") as file:
+        file.write("new\n")
+    update = read_appended(fd, "test_folder/rotate.txt", 13)
+    assert update['event'] == 'truncated' and update['data'] == b"new\n"
+
+    os.rename("test_folder/rotate.txt", "test_folder/rotate.txt.1")
+    with open("test_folder/rotate.txt", "w") as file:
+        file.write("rotated\n")
+    update = read_appended(fd, "test_folder/rotate.txt", 4)
+    assert update['event'] == 'rotated' and update['position'] == 0
+    update = read_appended(update['fd'], "test_folder/rotate.txt", 0)
+    assert update['data'] == b"rotated\n"
+    os.close(update['fd'])
+
+
+# TEST RAW FILE DOWNLOADS
+# --------------------------------------------------------
+# Any type of file can be downloaded as raw bytes
+def test_raw_file(create_test_folder):
+    response = client.get("/test_folder/nontxtfile.py?raw=true")
+    assert response.status_code == 200
+    assert response.content == b"Sample non txt file"
+    assert response.headers['content-length'] == str(len(b"Sample non txt file"))
+
+def test_raw_file_range(create_test_folder):
+    response = client.get("/test_folder/multiline.txt?raw=true", headers = {'Range': 'bytes=-6'})
+    assert response.status_code == 206
+    assert response.content == b"line 9"
+    assert response.headers['content-range'] == 'bytes 63-68/69'
+
+# A file truncated while it is being sent fails the response instead of ending it early, so the client never takes a short body as complete
+def test_raw_file_truncated(tmp_path, monkeypatch):
+    file_path = str(tmp_path / 'shrinking.bin')
+    with open(file_path, 'wb') as file:
+        file.write(b'x' * 100)
+    monkeypatch.setattr(app_module.RawFileResponse, 'chunk_size', 40)
+    response = app_module.RawFileResponse(file_path, os.stat(file_path))
+
+    messages = []
+    async def send(message):
+        messages.append(message)
+        # Truncate the file once the first chunk was sent
+        if message.get('body'):
+            os.truncate(file_path, 40)
+
+    with pytest.raises(RuntimeError):
+        app_module.asyncio.run(response({'type': 'http', 'extensions': {}}, None, send))
+    assert [message.get('more_body') for message in messages[1:]] == [True]
+
+
+# TEST COMPRESSED RESPONSES
+# --------------------------------------------------------
+# A large response is gzip compressed when the client accepts it, and keeps a (weak) ETag
+def test_compressed_file(create_test_folder):
+    response = client.get("/test_folder/compressible.txt", headers = {'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['content-encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['vary']
+    assert response.headers['etag'].startswith('W/')
+    assert response.json()['file_contents'][199] == 'compressible line 199'
+
+    response = client.get("/test_folder/compressible.txt", headers = {'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['etag']})
+    assert response.status_code == 304
+
+# Small responses and clients that do not accept any compression get the response as it is
+def test_uncompressed_responses(create_test_folder):
+    response = client.get("/test_folder/filecontents.txt", headers = {'Accept-Encoding': 'gzip'})
+    assert 'content-encoding' not in response.headers
+
+    response = client.get("/test_folder/compressible.txt", headers = {'Accept-Encoding': 'identity'})
+    assert 'content-encoding' not in response.headers
+    assert response.json()['file_contents'][0] == 'compressible line 0'
+
+# Streamed responses are compressed chunk by chunk
+def test_compressed_stream(create_test_folder):
+    response = client.get("/test_folder/compressible.txt?stream=true", headers = {'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert len(response.text.splitlines()) == 200
+
+# A raw file with a precompressed copy next to it is sent from the copy
+def test_precompressed_sidecar(create_test_folder):
+    response = client.get("/test_folder/precompressed.txt?raw=true", headers = {'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['content-type'].startswith('text/plain')
+    assert response.content == b"Served from the sidecar"
+
+    response = client.get("/test_folder/precompressed.txt?raw=true", headers = {'Accept-Encoding': 'identity'})
+    assert response.content == b"Served without compression"
+
+def test_negotiate_encoding():
+    assert negotiate_encoding("gzip, br", ['zstd', 'br', 'gzip']) == 'br'
+    assert negotiate_encoding("gzip;q=1.0, br;q=0.5", ['zstd', 'br', 'gzip']) == 'gzip'
+    assert negotiate_encoding("*;q=0.1, gzip;q=0", ['gzip']) is None
+    assert negotiate_encoding("identity", ['gzip']) is None
+
+
+# TEST CONDITIONAL GET REQUESTS
+# --------------------------------------------------------
+# Sending back the ETag of a file returns a 304 without the file contents
+def test_sub_file_etag(create_test_folder):
+    response = client.get("/test_folder/filecontents.txt")
+    assert 'etag' in response.headers and 'last-modified' in response.headers
+
+    response = client.get("/test_folder/filecontents.txt", headers = {'If-None-Match': response.headers['etag']})
+    assert response.status_code == 304
+    assert response.content == b''
+
+# A different view of the same file has a different ETag
+def test_sub_file_etag_variant(create_test_folder):
+    etag = client.get("/test_folder/multiline.txt").headers['etag']
+    response = client.get("/test_folder/multiline.txt?limit=2", headers = {'If-None-Match': etag})
+    assert response.status_code == 200
+
+def test_sub_folder_last_modified(create_test_folder):
+    response = client.get("/test_folder/foldercontents")
+    response = client.get("/test_folder/foldercontents", headers = {'If-Modified-Since': response.headers['last-modified']})
+    assert response.status_code == 304
+
+    response = client.get("/test_folder/foldercontents", headers = {'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+    assert response.status_code == 200
+
+
+# Make sure a read that takes longer than its timeout returns a 504 instead of waiting forever
+def test_sub_file_timeout(create_test_folder, monkeypatch):
+    monkeypatch.setitem(io_timeouts, 'read', 0)
+    response = client.get("/test_folder/filecontents.txt")
+    assert response.status_code == 504
+    assert response.json()['detail'] == 'The file system did not respond in time'
+
+# A write that already started is waited for instead of timing out, and a call that timed out before it started never runs
+def test_run_io_write_timeout(monkeypatch):
+    monkeypatch.setitem(io_timeouts, 'write', 0.05)
+    calls = []
+    def slow_write():
+        time.sleep(0.2)
+        calls.append('written')
+        return 'done'
+
+    async def run_writes():
+        # The first write fills the write thread for long enough that the second one never starts in time
+        monkeypatch.setitem(app_module.io_executors, 'write', app_module.ThreadPoolExecutor(1))
+        first = app_module.asyncio.ensure_future(app_module.run_io('write', slow_write))
+        await app_module.asyncio.sleep(0.01)
+        with pytest.raises(HTTPException):
+            await app_module.run_io('write', calls.append, 'never')
+        return await first
+
+    assert app_module.asyncio.run(run_writes()) == 'done'
+    time.sleep(0.1)
+    assert calls == ['written']
+
+# A stream that is closed while it is still pulling an item is only closed once that item is read
+def test_iterate_io_close_pending():
+    def slow_lines():
+        yield 'first'
+        time.sleep(0.2)
+        yield 'second'
+
+    lines = slow_lines()
+    async def read_first():
+        stream = app_module.iterate_io(lines)
+        assert await stream.__anext__() == 'first'
+        pull = app_module.asyncio.ensure_future(stream.__anext__())
+        await app_module.asyncio.sleep(0.05)
+        pull.cancel()
+        with pytest.raises(app_module.asyncio.CancelledError):
+            await pull
+
+    app_module.asyncio.run(read_first())
+    time.sleep(0.3)
+    assert lines.gi_frame is None
+
 
 # TEST SUB FOLDER OUTPUTS
 # --------------------------------------------------------
@@ -147,6 +485,491 @@ def test_sub_folder_blank(create_test_folder):
     assert rjson['is_folder'] == True
     assert len(rjson['folder_contents']) == 0
 
+# Page through a folder with a cursor and make sure every entry is returned exactly once
+def test_sub_folder_pagination(create_test_folder):
+    response = client.get("/test_folder/foldercontents?limit=1")
+    assert response.status_code == 200
+    rjson = response.json()
+    assert rjson['folder_contents'] == ['test1.txt']
+    assert rjson['next_cursor'] is not None
+
+    response = client.get("/test_folder/foldercontents", params = {'limit': 1, 'cursor': rjson['next_cursor']})
+    rjson = response.json()
+    assert rjson['folder_contents'] == ['test2.txt']
+    assert rjson['next_cursor'] is None
+
+# List the details of every entry in 1 request instead of 1 request per entry
+def test_sub_folder_details(create_test_folder):
+    response = client.get("/test_folder?details=true")
+    assert response.status_code == 200
+    entries = {entry['name']: entry for entry in response.json()['folder_contents']}
+
+    expected_outputs = ['name', 'type', 'size', 'owner', 'permissions', 'mtime']
+    assert set(expected_outputs) == set(entries['filecontents.txt'].keys())
+    assert entries['filecontents.txt']['type'] == 'file'
+    assert entries['filecontents.txt']['size'] == len("This text file is tested in file contents")
+    assert entries['foldercontents']['type'] == 'folder'
+
+# A columnar listing returns 1 array per field instead of 1 object per entry
+def test_sub_folder_columnar(create_test_folder):
+    response = client.get("/test_folder/foldercontents?columnar=true")
+    assert response.status_code == 200
+    assert sorted(response.json()['folder_contents']['name']) == ['test1.txt', 'test2.txt']
+
+    response = client.get("/test_folder?columnar=true&details=true")
+    assert response.status_code == 200
+    columns = response.json()['folder_contents']
+    expected_outputs = ['name', 'type', 'size', 'owner', 'permissions', 'mtime']
+    assert set(expected_outputs) == set(columns.keys())
+    assert all(len(columns[field]) == len(columns['name']) for field in expected_outputs)
+    assert columns['type'][columns['name'].index('foldercontents')] == 'folder'
+
+def test_sub_folder_invalid_cursor(create_test_folder):
+    response = client.get("/test_folder/foldercontents?cursor=***")
+    assert response.status_code == 422
+    assert response.json()['detail'] == 'Invalid cursor'
+
+
+# TEST THE CACHE SHARED BY THE GET METHODS
+# --------------------------------------------------------
+# A repeated request is served from the cache
+def test_cache_hit(create_test_folder):
+    client.get("/test_folder/filecontents.txt")
+    hits = client.get("/cachestats").json()['hits']
+    response = client.get("/test_folder/filecontents.txt")
+    assert response.json()['file_contents'] == ['This text file is tested in file contents']
+    assert client.get("/cachestats").json()['hits'] > hits
+
+# Creating a file through the API shows up in a cached listing right away
+def test_cache_invalidated_by_create(create_test_folder):
+    assert client.get("/test_folder/cachefolder").json()['folder_contents'] == []
+    client.post("/createfile", json = {'create_name': 'test_folder/cachefolder/created.txt', 'create_content': 'Created'})
+    assert client.get("/test_folder/cachefolder").json()['folder_contents'] == ['created.txt']
+
+# A change made outside of the API is picked up by the watcher
+def test_cache_invalidated_by_watcher(create_test_folder):
+    client.get("/test_folder/cachefolder")
+    with open("test_folder/cachefolder/external.txt", "w") as file:
+        file.write("Created outside of the API")
+
+    for _ in range(50):
+        if 'external.txt' in client.get("/test_folder/cachefolder").json()['folder_contents']:
+            break
+        time.sleep(0.1)
+    assert 'external.txt' in client.get("/test_folder/cachefolder").json()['folder_contents']
+
+# A value read before its path changed is never cached, even when the change was made before the path was watched
+def test_cache_put_changed(tmp_path):
+    file_path = str(tmp_path / 'racy.txt')
+    with open(file_path, 'w') as file:
+        file.write('old')
+    read_stats = os.stat(file_path)
+    with open(file_path, 'w') as file:
+        file.write('newer')
+
+    app_module.cache_put(('content', file_path), ['old'], 64, read_stats)
+    assert app_module.path_cache.get(('content', file_path)) is None
+    app_module.cache_put(('content', file_path), ['newer'], 64, os.stat(file_path))
+    assert app_module.path_cache.get(('content', file_path)) == ['newer']
+
+# An entry created while a folder is scanned is not hidden by caching the listing read before it
+def test_cache_listing_changed_during_scan(create_test_folder, monkeypatch):
+    os.mkdir("test_folder/scanned")
+    # Without a watcher, nothing invalidates the listing after it was cached
+    monkeypatch.setattr(app_module, 'start_path_watcher', lambda: None)
+    scan_folder_content = app_module.scan_folder_content
+    def scan_then_create(*args):
+        folder_contents = scan_folder_content(*args)
+        with open("test_folder/scanned/new.txt", "w") as file:
+            file.write('new')
+        app_module.apply_path_change(os.path.abspath("test_folder/scanned/new.txt"))
+        return folder_contents
+    monkeypatch.setattr(app_module, 'scan_folder_content', scan_then_create)
+    assert client.get("/test_folder/scanned").json()['folder_contents'] == []
+
+    monkeypatch.setattr(app_module, 'scan_folder_content', scan_folder_content)
+    assert client.get("/test_folder/scanned").json()['folder_contents'] == ['new.txt']
+
+
+# TEST THE PROMETHEUS METRICS
+# --------------------------------------------------------
+# Requests are counted by endpoint and file system calls are timed by operation
+def test_metrics(create_test_folder):
+    client.get("/test_folder/filecontents.txt")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+
+    lines = response.text.splitlines()
+    assert any(line.startswith('fsapi_http_requests_total{endpoint="sub_folder",method="GET",status="200"}') for line in lines)
+    assert any(line.startswith('fsapi_http_request_duration_seconds_bucket{endpoint="sub_folder",le="+Inf"}') for line in lines)
+    assert any(line.startswith('fsapi_fs_operation_duration_seconds_count{operation="stat"}') for line in lines)
+    assert any(line.startswith('fsapi_cache{cache="path",counter="hits"}') for line in lines)
+    assert 'fsapi_http_requests_in_flight 1' in lines
+
+# A timed call inside of another one only counts as itself, and a call handed to an executor is timed without the wait for a thread
+def test_metrics_fs_op_nested(create_test_folder):
+    with app_module.fs_op('test_outer'):
+        time.sleep(0.05)
+        with app_module.fs_op('test_inner'):
+            time.sleep(0.1)
+    assert app_module.fs_operation_seconds.values[('test_outer',)][-1] < 0.09
+    assert app_module.fs_operation_seconds.values[('test_inner',)][-1] >= 0.1
+
+    assert app_module.fs_call('test_call', lambda: 'called') == 'called'
+    assert sum(app_module.fs_operation_seconds.values[('test_call',)][:-1]) == 1
+
+
+# TEST THE RATE LIMITS
+# --------------------------------------------------------
+# A client over its limit gets a 429 with the seconds to wait, while the metrics can still be scraped
+def test_rate_limit_requests(create_test_folder, monkeypatch):
+    monkeypatch.setattr(app_module, 'rate_limiter', app_module.RateLimiter({'read': 0.5, 'destructive': 0.5}, 2, 100))
+    assert client.get("/test_folder/filecontents.txt").status_code == 200
+
+    response = client.get("/test_folder/filecontents.txt")
+    assert response.status_code == 429
+    assert response.headers['retry-after'] == '2'
+
+    # Each class of requests has its own limit
+    assert client.delete("/deletefile", json = {'delete_name': 'test_folder/file_no_exist.txt'}).status_code == 404
+    assert client.delete("/deletefile", json = {'delete_name': 'test_folder/file_no_exist.txt'}).status_code == 429
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'fsapi_rate_limited_requests_total{limit="read"} 1' in response.text.splitlines()
+    assert 'fsapi_rate_limit_clients 1' in response.text.splitlines()
+
+# Every operation of a batch counts, and a batch over the limit is not run at all
+def test_rate_limit_batch(create_test_folder, monkeypatch):
+    monkeypatch.setattr(app_module, 'rate_limiter', app_module.RateLimiter({'write': 100, 'destructive': 0.5}, 2, 100))
+    operations = [{'op': 'createfolder', 'name': 'test_folder/limitedfolder'}, 
+                {'op': 'deletefolder', 'name': 'test_folder/limitedfolder'}]
+    assert client.post("/batch", json = {'operations': operations}).json()['succeeded'] == 2
+    assert client.post("/batch", json = {'operations': operations}).status_code == 429
+    assert 'limitedfolder' not in os.listdir(test_path)
+
+    # The request itself is not charged on top of its operations, so a batch can use the whole burst
+    monkeypatch.setattr(app_module, 'rate_limiter', app_module.RateLimiter({'write': 1}, 2, 100))
+    operations = [{'op': 'createfolder', 'name': 'test_folder/limitedfolder'}, 
+                {'op': 'createfile', 'name': 'test_folder/limitedfolder/limited.txt', 'content': 'Limited'}]
+    assert client.post("/batch", json = {'operations': operations}).json()['succeeded'] == 2
+    assert client.post("/createfolder", json = {'create_name': 'test_folder/limitedfolder2'}).status_code == 429
+    shutil.rmtree(os.path.join(test_path, 'limitedfolder'))
+
+# A client that reads more than its burst of bytes is slowed down, and its other requests have to wait until it is back within its limit
+def test_rate_limit_bytes(create_test_folder, monkeypatch):
+    monkeypatch.setattr(app_module, 'rate_limiter', app_module.RateLimiter({'read_bytes': 1000}, 0.01, 100))
+    start = time.time()
+    response = client.get("/test_folder/multiline.txt?stream=true")
+    assert response.status_code == 200 and len(response.content) == 90
+    assert time.time() - start >= 0.03
+
+    app_module.rate_limiter.charge('testclient', 'read_bytes', 1500)
+    response = client.get("/test_folder/multiline.txt")
+    assert response.status_code == 429
+    assert response.headers['retry-after'] == '2'
+
+# Behind a proxy the client is the entry the proxy added, so entries forged by the client do not get it a new bucket
+def test_rate_limit_forwarded_client(create_test_folder, monkeypatch):
+    monkeypatch.setattr(app_module, 'rate_limiter', app_module.RateLimiter({'read': 0.5}, 2, 100))
+    monkeypatch.setattr(app_module, 'rate_limit_client_header', 'X-Forwarded-For')
+    assert client.get("/test_folder/filecontents.txt", headers = {'X-Forwarded-For': '10.0.0.1, 192.168.1.5'}).status_code == 200
+    assert client.get("/test_folder/filecontents.txt", headers = {'X-Forwarded-For': '10.0.0.2, 192.168.1.5'}).status_code == 429
+    assert client.get("/test_folder/filecontents.txt", headers = {'X-Forwarded-For': '192.168.1.6'}).status_code == 200
+
+    # With two proxies the client is the second entry from the right
+    monkeypatch.setattr(app_module, 'rate_limit_trusted_hops', 2)
+    assert client.get("/test_folder/filecontents.txt", headers = {'X-Forwarded-For': '10.0.0.3, 192.168.1.7, 172.16.0.1'}).status_code == 200
+    assert client.get("/test_folder/filecontents.txt", headers = {'X-Forwarded-For': '10.0.0.4, 192.168.1.7, 172.16.0.1'}).status_code == 429
+
+
+# TEST THE PROFILER AND SERVER TIMING
+# --------------------------------------------------------
+# The profiler is turned off unless a token is set, and then needs that token
+def test_debug_profile(create_test_folder, monkeypatch):
+    assert client.get("/debug/profile?seconds=0.1").status_code == 404
+
+    monkeypatch.setattr(app_module, 'debug_profile_token', 'secret')
+    assert client.get("/debug/profile?seconds=0.1", headers = {'Authorization': 'Bearer wrong'}).status_code == 401
+
+    response = client.get("/debug/profile?seconds=0.2&idle=true", headers = {'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    # Every line is a stack of frames separated by ; and its number of samples
+    stack, count = response.text.splitlines()[0].rsplit(' ', 1)
+    assert ';' in stack and int(count) > 0
+
+    response = client.get("/debug/profile?seconds=0.2&idle=true&format=speedscope", headers = {'Authorization': 'Bearer secret'})
+    profile = response.json()
+    assert profile['profiles'][0]['type'] == 'sampled'
+    assert len(profile['profiles'][0]['samples']) == len(profile['profiles'][0]['weights'])
+
+# A request sent with X-Server-Timing gets the time of each step back
+def test_server_timing(create_test_folder):
+    response = client.get("/test_folder/multiline.txt?offset=1", headers = {'X-Server-Timing': '1'})
+    steps = [step.split(';')[0] for step in response.headers['server-timing'].split(', ')]
+    assert 'queue' in steps and 'serialize' in steps and steps[-1] == 'total'
+
+    response = client.get("/test_folder/multiline.txt?offset=1")
+    assert 'server-timing' not in response.headers
+
+
+# TEST THE PATH INDEX AND SEARCH
+# --------------------------------------------------------
+@pytest.fixture(scope = "session")
+def built_index(create_test_folder):
+    started = time.time()
+    response = client.post("/index/rebuild")
+    assert response.status_code == 202
+
+    for _ in range(100):
+        stats = client.get("/indexstats").json()
+        if stats['built_at'] and stats['built_at'] >= started and not stats['building']:
+            break
+        time.sleep(0.1)
+
+    return stats
+
+def test_search_glob(built_index):
+    response = client.get("/search", params = {'glob': '*.txt', 'under': 'test_folder/foldercontents'})
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert [result['path'] for result in results] == ['test_folder/foldercontents/test1.txt', 'test_folder/foldercontents/test2.txt']
+    assert results[0]['type'] == 'file'
+
+def test_search_size_and_type(built_index):
+    response = client.get("/search", params = {'prefix': 'multi', 'min_size': 60, 'type': 'file'})
+    assert [result['name'] for result in response.json()['results']] == ['multiline.txt']
+
+    response = client.get("/search", params = {'prefix': 'multi', 'min_size': 1000})
+    assert response.json()['results'] == []
+
+# Files created through the API are searchable right away
+def test_search_updated_by_create(built_index):
+    client.post("/createfile", json = {'create_name': 'test_folder/indexedfile.txt', 'create_content': 'Indexed'})
+    response = client.get("/search", params = {'name': 'indexedfile.txt'})
+    assert [result['path'] for result in response.json()['results']] == ['test_folder/indexedfile.txt']
+
+# Changes are written to the index by a background writer, which applies a path changed many times once, and folders beyond INDEX_MAX_WATCHES make the index partial
+def test_index_updates_queued(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'index_max_watches', 1)
+    root = tmp_path / 'root'
+    (root / 'a').mkdir(parents = True)
+    (root / 'b').mkdir()
+    index = app_module.PathIndex(str(tmp_path / 'index.sqlite3'), str(root))
+    assert index.claim_watches()
+    index.build()
+    stats = index.stats()
+    assert stats['entries'] == 2 and stats['partial'] == True and stats['unwatched_folders'] >= 2
+
+    file_path = str(root / 'a' / 'changed.txt')
+    for size in range(1, 51):
+        with open(file_path, 'w') as file:
+            file.write('x' * size)
+        index.update(file_path)
+    assert index.wait_for_updates(5)
+    assert [(result['path'], result['size']) for result in index.search(name = 'changed.txt')] == [('a/changed.txt', 50)]
+    assert index.stats()['pending_updates'] == 0
+    os.close(index.watch_lock_fd)
+
+# Only 1 worker watches the folders of a shared index, and the next one takes over from the folders in the index once it exits
+def test_index_watches_handed_over(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'index_max_watches', 2)
+    root = tmp_path / 'root'
+    (root / 'a' / 'deep').mkdir(parents = True)
+    (root / 'b').mkdir()
+    first = app_module.PathIndex(str(tmp_path / 'index.sqlite3'), str(root))
+    second = app_module.PathIndex(str(tmp_path / 'index.sqlite3'), str(root))
+    # The folders are scanned into the rows of the index of the app
+    monkeypatch.setattr(app_module, 'path_index', second)
+    assert first.claim_watches()
+    assert not second.claim_watches()
+
+    # The worker that builds the index without watching it leaves the watches to the other one
+    second.build()
+    assert second.unwatched_folders is None
+    assert second.indexed_folders() == [str(root), str(root / 'a'), str(root / 'b'), str(root / 'a' / 'deep')]
+
+    os.close(first.watch_lock_fd)
+    assert second.claim_watches()
+    second.watch_folders(second.indexed_folders(), second.built_at())
+    assert second.stats()['unwatched_folders'] >= 2 and second.watched_built_at == second.built_at()
+    os.close(second.watch_lock_fd)
+
+
+# TEST THE STATE SHARED BY WORKERS
+# --------------------------------------------------------
+# A change published by 1 worker is applied by the others, also after the log was replaced because it grew too large
+def test_shared_change_log(tmp_path):
+    received = {'a': [], 'b': []}
+    log_path = str(tmp_path / 'changes.log')
+    worker_a = app_module.SharedChangeLog(log_path, lambda path, replayed: received['a'].append(path), 'a', 0.1, 200)
+    worker_b = app_module.SharedChangeLog(log_path, lambda path, replayed: received['b'].append(path), 'b', 0.1, 200)
+
+    # The check before each request is only a stat
+    assert not worker_b.changed()
+    worker_a.publish('/root/first.txt')
+    assert worker_b.changed()
+    worker_b.sync()
+    assert not worker_b.changed() and received['b'] == ['/root/first.txt']
+    received['b'].clear()
+
+    paths = ['/root/folder {}/file\n{}.txt'.format(index, index) for index in range(20)] + [None]
+    for path in paths:
+        worker_a.publish(path)
+        worker_b.sync()
+
+    assert received['b'] == paths
+    assert received['a'] == []
+    assert os.path.exists(log_path + '.1')
+
+    # A worker that missed a whole log drops everything
+    received['b'].clear()
+    for path in paths[:15]:
+        worker_a.publish(path)
+    worker_b.sync()
+    assert None in received['b']
+
+# The first worker of a new server records when it started and removes the jobs of the previous run, and the workers that start while it runs keep them
+def test_state_started(tmp_path):
+    os.mkdir(str(tmp_path / 'jobs'))
+    (tmp_path / 'started').write_text('1.0')
+    (tmp_path / 'jobs' / 'old.json').write_text('{}')
+
+    started, first_fd = app_module.read_state_started(str(tmp_path))
+    assert started > 1.0 and os.listdir(str(tmp_path / 'jobs')) == []
+
+    (tmp_path / 'jobs' / 'new.json').write_text('{}')
+    second_started, second_fd = app_module.read_state_started(str(tmp_path))
+    assert second_started == started
+    assert os.listdir(str(tmp_path / 'jobs')) == ['new.json']
+
+    # Once every worker of that server stopped, the next one starts a new server
+    os.close(first_fd)
+    os.close(second_fd)
+    started, fd = app_module.read_state_started(str(tmp_path))
+    assert started >= second_started and os.listdir(str(tmp_path / 'jobs')) == []
+    os.close(fd)
+
+# A line index built by 1 worker is loaded by the others instead of scanning the file again
+def test_line_index_shared(tmp_path):
+    file_path = tmp_path / 'lines.txt'
+    file_path.write_bytes(b''.join(b'line %d\n' % index for index in range(1000)))
+
+    with open(str(file_path), 'rb') as file:
+        fd = file.fileno()
+        file_stats = os.fstat(fd)
+        index = app_module.LineIndex(16)
+        assert index.update(fd, file_stats) == file_stats.st_size
+        index.save(str(tmp_path / 'index'))
+
+        loaded = app_module.LineIndex(16)
+        assert loaded.load(str(tmp_path / 'index'))
+        assert loaded.update(fd, file_stats) == 0
+        assert loaded.total_lines() == 1000
+        start = loaded.locate(fd, 500)
+        assert os.pread(fd, loaded.locate(fd, 501) - start, start) == b'line 500\n'
+        assert not app_module.LineIndex(32).load(str(tmp_path / 'index'))
+        assert sorted(os.listdir(str(tmp_path))) == ['index', 'lines.txt']
+
+    # A truncated or corrupt index is a cache miss
+    index_data = (tmp_path / 'index').read_bytes()
+    for corrupt in (index_data[:20], index_data[:-3], b''):
+        (tmp_path / 'index').write_bytes(corrupt)
+        assert not app_module.LineIndex(16).load(str(tmp_path / 'index'))
+
+# A background job running on another worker is read from, and cancelled through, its file in STATE_DIR
+def test_shared_job(create_test_folder, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'state_dir', str(tmp_path))
+    os.mkdir(str(tmp_path / 'jobs'))
+    progress = {'job_id': 'abc123', 'operation': 'emptyfolder', 'path': 'folder', 'state': 'running', 'entries_removed': 10}
+    (tmp_path / 'jobs' / 'abc123.json').write_text(json.dumps(progress))
+
+    assert client.get("/jobs/abc123").json() == progress
+    assert client.delete("/jobs/abc123").status_code == 200
+    assert (tmp_path / 'jobs' / 'abc123.cancel').exists()
+    assert client.get("/jobs/abc.json").status_code == 404
+    assert client.get("/jobs/abc124").status_code == 404
+
+
+# TEST THE TREE AND DISK USAGE METHODS
+# --------------------------------------------------------
+def test_disk_usage(create_test_folder):
+    response = client.get("/du/test_folder/sizetree")
+    assert response.status_code == 200
+    rjson = response.json()
+    assert (rjson['files'], rjson['folders'], rjson['bytes']) == (3, 2, 3 * len("Testing tree deletion"))
+    assert rjson['children'] == [{'name': 'level1', 'files': 2, 'bytes': 2 * len("Testing tree deletion"), 'folders': 1}]
+
+    # A repeated request on an unchanged tree gives the same totals from the cached folder summaries
+    assert client.get("/du/test_folder/sizetree").json() == rjson
+
+# A file that grows outside of the app does not change the mtime of its folder, but its new size is still picked up
+def test_disk_usage_append_outside(create_test_folder, monkeypatch):
+    before = client.get("/du/test_folder/sizetree").json()['bytes']
+    with open(os.path.join(test_path, 'sizetree', 'level1', 'file.txt'), 'a') as file:
+        file.write('appended')
+
+    # Through the watcher of the folder when there is inotify, and otherwise once the summary expires
+    if not isinstance(app_module.start_path_watcher(), app_module.InotifyWatcher):
+        monkeypatch.setattr(app_module, 'du_cache_ttl', 0.2)
+    deadline = time.time() + 3
+    while client.get("/du/test_folder/sizetree").json()['bytes'] != before + len('appended') and time.time() < deadline:
+        time.sleep(0.05)
+    assert client.get("/du/test_folder/sizetree").json()['bytes'] == before + len('appended')
+
+    # Without a watch the summaries expire
+    monkeypatch.setattr(app_module, 'du_cache_ttl', 0.2)
+    monkeypatch.setattr(app_module, 'path_watcher', None)
+    monkeypatch.setattr(app_module, 'cache_watcher', 'off')
+    with open(os.path.join(test_path, 'sizetree', 'level1', 'file.txt'), 'a') as file:
+        file.write('more')
+    time.sleep(0.25)
+    assert client.get("/du/test_folder/sizetree").json()['bytes'] == before + len('appendedmore')
+
+# The path of a file is relative to the root directory like the path of a folder, however the request spelled it
+def test_disk_usage_file(create_test_folder):
+    rjson = client.get("/du/test_folder//sizetree/level1/file.txt").json()
+    assert rjson['path'] == os.path.join('test_folder', 'sizetree', 'level1', 'file.txt') and rjson['files'] == 1
+    assert client.get("/du/test_folder//sizetree").json()['path'] == os.path.join('test_folder', 'sizetree')
+
+def test_disk_usage_stream(create_test_folder):
+    response = client.get("/du/test_folder/sizetree?stream=true")
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert all(record['partial'] for record in records[:-1])
+    assert records[-1]['partial'] == False
+    assert records[-1]['files'] == 3
+
+def test_tree(create_test_folder):
+    response = client.get("/tree/test_folder/sizetree?depth=2")
+    assert response.status_code == 200
+    rjson = response.json()
+    assert rjson['truncated'] == False
+    level1 = [child for child in rjson['children'] if child['name'] == 'level1'][0]
+    assert set(child['name'] for child in level1['children']) == {'level2', 'file.txt'}
+
+    # level2 is below the depth, so it was not listed
+    level2 = [child for child in level1['children'] if child['name'] == 'level2'][0]
+    assert level2['children'] is None
+
+def test_tree_file(create_test_folder):
+    response = client.get("/tree/test_folder/filecontents.txt")
+    assert response.status_code == 422
+
+
+# TEST THE FAST STARTUP MODE
+# --------------------------------------------------------
+# The docs and the path index are turned off, and the optional libraries are not imported until they are used
+def test_fast_startup(create_test_folder):
+    code = 'import sys, app; print(app.app.openapi_url, app.index_on_startup, "sqlite3" in sys.modules, "zstandard" in sys.modules)'
+    output = subprocess.check_output([sys.executable, '-c', code], env = {**os.environ, 'FAST_STARTUP': 'true', 'ROOT_DIR': test_path})
+    assert output.decode().split() == ['None', 'False', 'False', 'False']
+
+def test_startup_root_noexist(create_test_folder):
+    result = subprocess.run([sys.executable, '-c', 'import app'], env = {**os.environ, 'ROOT_DIR': os.path.join(test_path, 'folder_no_exist')}, stderr = subprocess.PIPE)
+    assert result.returncode != 0
+    assert b'is not a folder' in result.stderr
+
 
 # TEST THE CREATE FOLDER AND CREATE FILE POST METHODS
 # --------------------------------------------------------
@@ -179,6 +1002,52 @@ def test_create_file_nontxt(create_test_folder):
     assert rjson['detail'] == 'Files of type other than .txt cannot be created'
 
 
+# TEST THE STREAMING UPLOAD METHOD
+# --------------------------------------------------------
+def test_upload_file(create_test_folder):
+    content = b"Uploaded line 1\nUploaded line 2"
+    response = client.post("/uploadfile/test_folder/uploaded.txt", params = {'sha256': hashlib.sha256(content).hexdigest()}, data = content)
+    assert response.status_code == 200
+    assert response.json()['size'] == len(content)
+    with open("test_folder/uploaded.txt", "rb") as file:
+        assert file.read() == content
+
+    # Make sure no temporary files are left behind
+    assert not [name for name in os.listdir(test_path) if app_module.is_upload_temp(name)]
+
+# An upload that is still being written is not listed, and a finished one gets the permissions of the umask, which is read without changing it
+def test_upload_in_progress_hidden(create_test_folder):
+    temp_name = app_module.upload_temp_prefix + uuid.uuid4().hex + app_module.upload_temp_suffix
+    with open(os.path.join(test_path, 'blankfolder', temp_name), 'wb') as file:
+        file.write(b"Half uploaded")
+    assert client.get("/test_folder/blankfolder").json()['folder_contents'] == []
+    assert client.get("/test_folder/blankfolder?limit=10").json()['folder_contents'] == []
+    assert client.get("/tree/test_folder/blankfolder").json()['children'] == []
+    os.remove(os.path.join(test_path, 'blankfolder', temp_name))
+
+    # A file of a user that only starts like one is listed
+    with open(os.path.join(test_path, 'blankfolder', '.upload-notes.txt'), 'wb') as file:
+        file.write(b"Notes")
+    assert client.get("/test_folder/blankfolder").json()['folder_contents'] == ['.upload-notes.txt']
+    os.remove(os.path.join(test_path, 'blankfolder', '.upload-notes.txt'))
+
+    umask = os.umask(0)
+    os.umask(umask)
+    assert app_module.read_umask() == umask
+    assert stat.S_IMODE(os.stat("test_folder/uploaded.txt").st_mode) == 0o666 & ~umask
+
+def test_upload_file_exists(create_test_folder):
+    response = client.post("/uploadfile/test_folder/existingfolder/existingfile.txt", data = b"Replaced")
+    assert response.status_code == 422
+    assert response.json()['detail'] == 'File already exists, no action taken'
+
+def test_upload_file_bad_checksum(create_test_folder):
+    response = client.post("/uploadfile/test_folder/badchecksum.txt", params = {'sha256': '0' * 64}, data = b"Some content")
+    assert response.status_code == 422
+    assert response.json()['detail'] == 'Checksum does not match, no action taken'
+    assert not [name for name in os.listdir(test_path) if app_module.is_upload_temp(name) or name == 'badchecksum.txt']
+
+
 # TEST THE EMPTY FOLDER DELETE METHODS
 # --------------------------------------------------------
 def test_empty_folder(create_test_folder):
@@ -194,11 +1063,58 @@ def test_empty_file(create_test_folder):
     rjson = response.json()
     assert rjson['detail'] == 'Note that empty_folder is only to empty a folder, not to empty the contents of files'
 
+# Any file, not only a text file, is refused before anything is removed
+def test_empty_not_folder(create_test_folder):
+    with open(os.path.join(test_path, 'notafolder.bin'), 'wb') as file:
+        file.write(b'data')
+    response = client.delete("/emptyfolder", json = {'delete_name': 'test_folder/notafolder.bin', 'background': True})
+    assert response.status_code == 422
+    response = client.delete("/emptyfolder", json = {'delete_name': 'test_folder/notafolder.bin'})
+    assert response.status_code == 422
+    os.remove(os.path.join(test_path, 'notafolder.bin'))
+
 def test_empty_folder_noexist(create_test_folder):
     response = client.delete("/emptyfolder", json = {'delete_name': 'test_folder/test_no_exist'})
     assert response.status_code == 404
 
 
+# TEST DELETING WHOLE TREES AND BACKGROUND JOBS
+# --------------------------------------------------------
+def test_delete_tree(create_test_folder):
+    response = client.delete("/deletetree", json = {'delete_name': 'test_folder/deletetree'})
+    assert response.status_code == 200
+    assert response.json()['detail'] == 'Folder Deleted Successfully'
+    assert 'deletetree' not in os.listdir(test_path)
+
+def test_delete_tree_background(create_test_folder):
+    response = client.delete("/deletetree", json = {'delete_name': 'test_folder/backgroundtree', 'background': True})
+    assert response.status_code == 202
+    job_id = response.json()['job_id']
+
+    for _ in range(50):
+        progress = client.get("/jobs/{}".format(job_id)).json()
+        if progress['state'] not in ('queued', 'running'):
+            break
+        time.sleep(0.1)
+
+    # 3 files and 3 folders were removed
+    assert progress['state'] == 'completed'
+    assert progress['entries_removed'] == 6
+    assert progress['bytes_removed'] == 3 * len("Testing tree deletion")
+    assert 'backgroundtree' not in os.listdir(test_path)
+
+def test_delete_tree_root(create_test_folder):
+    response = client.delete("/deletetree", json = {'delete_name': ''})
+    assert response.status_code == 422
+    assert response.json()['detail'] == 'The root directory cannot be deleted'
+
+def test_job_noexist(create_test_folder):
+    response = client.get("/jobs/job_no_exist")
+    assert response.status_code == 404
+    response = client.delete("/jobs/job_no_exist")
+    assert response.status_code == 404
+
+
 # TEST THE DELETE FOLDER METHODS
 # --------------------------------------------------------
 def test_delete_folder(create_test_folder):
@@ -229,4 +1145,49 @@ def test_delete_file(create_test_folder):
 
 def test_delete_file_noexist(create_test_folder):
     response = client.delete("/deletefile", json = {'delete_name': 'test_folder/file_no_exist.txt'})
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+# TEST THE BATCH METHOD
+# --------------------------------------------------------
+def test_batch(create_test_folder):
+    operations = [{'op': 'createfolder', 'name': 'test_folder/batchfolder'}, 
+                {'op': 'createfile', 'name': 'test_folder/batchfolder/batch.txt', 'content': 'Created in a batch'}, 
+                {'op': 'read', 'name': 'test_folder/batchfolder/batch.txt'}, 
+                {'op': 'stat', 'name': 'test_folder/batchfolder'}]
+    response = client.post("/batch", json = {'operations': operations})
+    assert response.status_code == 200
+    rjson = response.json()
+    assert rjson['succeeded'] == 4
+    assert rjson['results'][2]['result']['file_contents'] == ['Created in a batch']
+    assert rjson['results'][3]['result']['is_folder'] == True
+
+# Each failed operation has its own result and later operations are skipped with stop_on_error
+def test_batch_stop_on_error(create_test_folder):
+    operations = [{'op': 'deletefile', 'name': 'test_folder/file_no_exist.txt'}, 
+                {'op': 'createfolder', 'name': 'test_folder/skippedfolder'}]
+    response = client.post("/batch", json = {'operations': operations, 'stop_on_error': True})
+    rjson = response.json()
+    assert rjson['failed'] == 1 and rjson['skipped'] == 1
+    assert rjson['results'][0]['status_code'] == 404
+    assert rjson['results'][1]['detail'] == 'Skipped after an earlier error'
+    assert 'skippedfolder' not in os.listdir(test_path)
+
+# A read operation is capped, so 1 batch cannot load a huge file or folder into memory
+def test_batch_read_limits(create_test_folder, monkeypatch):
+    monkeypatch.setattr(app_module, 'batch_read_max_bytes', 10)
+    monkeypatch.setattr(app_module, 'batch_read_max_entries', 1)
+    operations = [{'op': 'read', 'name': 'test_folder/multiline.txt'}, 
+                {'op': 'read', 'name': 'test_folder/foldercontents'}]
+    rjson = client.post("/batch", json = {'operations': operations}).json()
+    assert rjson['results'][0]['status_code'] == 413
+    assert rjson['results'][1]['status_code'] == 200
+    assert len(rjson['results'][1]['result']['folder_contents']) == 1
+    assert rjson['results'][1]['result']['next_cursor'] is not None
+
+def test_batch_parallel(create_test_folder):
+    operations = [{'op': 'stat', 'name': 'test_folder/foldercontents/test1.txt'}, 
+                {'op': 'unknown', 'name': 'test_folder'}]
+    response = client.post("/batch", json = {'operations': operations, 'ordered': False})
+    rjson = response.json()
+    assert rjson['succeeded'] == 1
+    assert rjson['results'][1]['status_code'] == 422
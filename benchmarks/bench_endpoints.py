@@ -0,0 +1,266 @@
+# Load tests every endpoint of the app against synthetic trees and saves the results as JSON, so they can be compared between versions
+#
+# Usage (from the root of the repository, with the requirements and uvicorn installed):
+#   python benchmarks/bench_endpoints.py --concurrency 1,8,32 --output results.json
+#   python benchmarks/bench_endpoints.py --baseline results.json --output new.json
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+from common import git_commit, start_server, stop_server, run_load, percentile, peak_rss_mb, reset_peak_rss
+from trees import make_wide_folder, make_deep_folder, make_text_file, make_numbered
+
+
+def build_tree(root_dir: str, args: argparse.Namespace):
+    """Builds the tree that the GET benchmarks read from
+
+    Args:
+        root_dir (str): The home directory of the app
+        args (argparse.Namespace): The command line arguments with the sizes of the tree
+
+    Returns:
+        dict: The path of the deepest folder and the size of the large file, which the requests need
+    """    
+
+    with open(os.path.join(root_dir, 'small.txt'), 'w') as file:
+        file.write('A small text file\n' * 10)
+
+    make_text_file(os.path.join(root_dir, 'medium.txt'), args.medium_file_kb * 1024)
+    make_text_file(os.path.join(root_dir, 'large.txt'), args.large_file_mb * 1024 * 1024)
+    make_wide_folder(os.path.join(root_dir, 'wide'), args.wide_files)
+    deep_path = make_deep_folder(os.path.join(root_dir, 'deep'), args.deep_levels)
+
+    return {'deep_path': 'deep/' + deep_path, 'large_bytes': os.path.getsize(os.path.join(root_dir, 'large.txt'))}
+
+
+def large_range(tree: dict):
+    """The Range header of 1MB in the middle of the large file"""
+
+    start = tree['large_bytes'] // 2
+    return {'Range': 'bytes={}-{}'.format(start, min(start + 1024 * 1024, tree['large_bytes']) - 1)}
+
+
+# Each GET benchmark is a single request that is repeated
+read_scenarios = {
+    'get_small_file': lambda tree: ('GET', '/small.txt', None, None),
+    'get_large_file_window': lambda tree: ('GET', '/large.txt?offset=1000&limit=100', None, None),
+    'get_large_file_range': lambda tree: ('GET', '/large.txt?raw=true', None, large_range(tree)),
+    'get_medium_file_stream': lambda tree: ('GET', '/medium.txt?stream=true', None, None),
+    'get_medium_file_raw': lambda tree: ('GET', '/medium.txt?raw=true', None, None),
+    'get_wide_folder': lambda tree: ('GET', '/wide', None, None),
+    'get_wide_folder_details': lambda tree: ('GET', '/wide?details=true', None, None),
+    'get_wide_folder_page': lambda tree: ('GET', '/wide?limit=100', None, None),
+    'get_deep_folder': lambda tree: ('GET', '/' + tree['deep_path'], None, None),
+}
+
+
+def mutation_requests(scenario: str, root_dir: str, run_folder: str, count: int, args: argparse.Namespace):
+    """Prepares what a mutation benchmark needs (such as the files to delete) and builds its requests
+
+    Args:
+        scenario (str): The name of the benchmark
+        root_dir (str): The home directory of the app
+        run_folder (str): A new folder for this run, relative to the home directory
+        count (int): The number of requests
+        args (argparse.Namespace): The command line arguments
+
+    Returns:
+        list: The requests, as (method, path, JSON body, headers) tuples
+    """    
+
+    full_run_folder = os.path.join(root_dir, run_folder)
+    os.makedirs(full_run_folder)
+
+    if scenario == 'createfolder':
+        return [('POST', '/createfolder', {'create_name': '{}/folder_{}'.format(run_folder, index)}, None) for index in range(count)]
+
+    if scenario == 'createfile':
+        return [('POST', '/createfile', {'create_name': '{}/file_{}.txt'.format(run_folder, index), 'create_content': 'Benchmark file\n'}, None) for index in range(count)]
+
+    if scenario == 'deletefile':
+        names = make_numbered(full_run_folder, count, 'file')
+        return [('DELETE', '/deletefile', {'delete_name': '{}/{}'.format(run_folder, name)}, None) for name in names]
+
+    if scenario == 'deletefolder':
+        names = make_numbered(full_run_folder, count, 'folder')
+        return [('DELETE', '/deletefolder', {'delete_name': '{}/{}'.format(run_folder, name)}, None) for name in names]
+
+    names = make_numbered(full_run_folder, count, 'folder', args.empty_folder_files)
+    return [('DELETE', '/emptyfolder', {'delete_name': '{}/{}'.format(run_folder, name)}, None) for name in names]
+
+
+mutation_scenarios = ['createfolder', 'createfile', 'deletefile', 'deletefolder', 'emptyfolder']
+
+
+def summarize(scenario: str, concurrency: int, load: dict, rss_mb: float):
+    """Turns the latencies of a run into its result
+
+    Args:
+        scenario (str): The name of the benchmark
+        concurrency (int): The number of concurrent clients
+        load (dict): The result of run_load
+        rss_mb (float): The peak resident memory of the server during the run
+
+    Returns:
+        dict: The requests per second, the latency percentiles in milliseconds and the peak memory
+    """    
+
+    latencies = sorted(load['latencies'])
+    milliseconds = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+
+    return {'scenario': scenario,
+            'concurrency': concurrency,
+            'requests': len(latencies),
+            'errors': load['errors'],
+            'seconds': round(load['seconds'], 3),
+            'rps': round(len(latencies) / load['seconds'], 1) if load['seconds'] else None,
+            'mean_ms': milliseconds(sum(latencies) / len(latencies) if latencies else None),
+            'p50_ms': milliseconds(percentile(latencies, 0.50)),
+            'p95_ms': milliseconds(percentile(latencies, 0.95)),
+            'p99_ms': milliseconds(percentile(latencies, 0.99)),
+            'max_ms': milliseconds(latencies[-1] if latencies else None),
+            'peak_rss_mb': None if rss_mb is None else round(rss_mb, 1)}
+
+
+def compare(results: list, baseline: list, threshold: float):
+    """Compares results with the results of a previous version
+
+    Args:
+        results (list): The results of this run
+        baseline (list): The results of the previous version
+        threshold (float): The fraction by which requests per second can drop, or p99 latency can grow, before it is a regression
+
+    Returns:
+        list: A description of every regression
+    """    
+
+    previous = {(result['scenario'], result['concurrency']): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['concurrency']))
+        if before is None:
+            continue
+
+        name = '{} at concurrency {}'.format(result['scenario'], result['concurrency'])
+        if before['rps'] and result['rps'] < before['rps'] * (1 - threshold):
+            regressions.append('{}: {} req/s, was {}'.format(name, result['rps'], before['rps']))
+        if before['p99_ms'] and result['p99_ms'] > before['p99_ms'] * (1 + threshold):
+            regressions.append('{}: p99 {}ms, was {}ms'.format(name, result['p99_ms'], before['p99_ms']))
+
+    return regressions
+
+
+def parse_args(argv: list = None):
+    """Parses the command line arguments
+
+    Args:
+        argv (list, optional): The arguments. Defaults to None, which uses sys.argv.
+
+    Returns:
+        argparse.Namespace: The parsed arguments
+    """    
+
+    parser = argparse.ArgumentParser(description = 'Load test every endpoint of the app against synthetic trees')
+    parser.add_argument('--concurrency', default = '1,8,32', help = 'Comma separated numbers of concurrent clients, each benchmark runs at every one of them')
+    parser.add_argument('--requests', type = int, default = 2000, help = 'Requests per GET benchmark')
+    parser.add_argument('--mutation-requests', type = int, default = 500, help = 'Requests per create or delete benchmark')
+    parser.add_argument('--warmup', type = int, default = 50, help = 'Requests sent before each GET benchmark that are not measured')
+    parser.add_argument('--scenarios', default = None, help = 'Comma separated names of the benchmarks to run, all of them by default')
+    parser.add_argument('--wide-files', type = int, default = 10000, help = 'Files in the wide folder')
+    parser.add_argument('--deep-levels', type = int, default = 32, help = 'Nested folders in the deep folder')
+    parser.add_argument('--medium-file-kb', type = int, default = 1024, help = 'Size of the file that is streamed and downloaded')
+    parser.add_argument('--large-file-mb', type = int, default = 64, help = 'Size of the large file that is read in windows and ranges')
+    parser.add_argument('--empty-folder-files', type = int, default = 10, help = 'Files in each folder emptied by the emptyfolder benchmark')
+    parser.add_argument('--workers', type = int, default = None, help = 'Run the server with gunicorn and this many worker processes instead of a single uvicorn process')
+    parser.add_argument('--env', action = 'append', default = [], metavar = 'NAME=VALUE', help = 'Environment variable of the server, such as CACHE_MAX_ENTRIES=0 (can be repeated)')
+    parser.add_argument('--workdir', default = None, help = 'Where to build the tree, a temporary folder by default')
+    parser.add_argument('--keep', action = 'store_true', help = 'Keep the tree after the benchmarks')
+    parser.add_argument('--output', default = None, help = 'Save the results to this JSON file')
+    parser.add_argument('--baseline', default = None, help = 'Compare with the results of a previous run and exit with 1 on a regression')
+    parser.add_argument('--threshold', type = float, default = 0.1, help = 'Fraction of change that counts as a regression')
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    """Builds the tree, starts the server, runs every benchmark at every concurrency and saves and compares the results
+
+    Args:
+        argv (list, optional): The command line arguments. Defaults to None, which uses sys.argv.
+
+    Returns:
+        int: The exit code, 1 if a regression was found compared to the baseline
+    """    
+
+    args = parse_args(argv)
+    concurrencies = [int(value) for value in args.concurrency.split(',')]
+    scenarios = list(read_scenarios) + mutation_scenarios
+    if args.scenarios:
+        scenarios = [scenario for scenario in scenarios if scenario in args.scenarios.split(',')]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix = 'fsapi-bench-')
+    root_dir = os.path.join(workdir, 'root')
+    os.makedirs(root_dir, exist_ok = True)
+
+    print('Building the tree in {}'.format(root_dir))
+    tree = build_tree(root_dir, args)
+
+    # The path index is not built by default, so that building it does not run during the benchmarks
+    env = {'INDEX_ON_STARTUP': 'false', **dict(value.split('=', 1) for value in args.env)}
+    process, port, startup_seconds = start_server(root_dir, env, workers = args.workers)
+    print('Server started in {:.2f}s on port {}'.format(startup_seconds, port))
+
+    results = []
+    try:
+        for scenario in scenarios:
+            for concurrency in concurrencies:
+                if scenario in read_scenarios:
+                    request = read_scenarios[scenario](tree)
+                    run_load(port, [request] * min(args.warmup, args.requests), concurrency)
+                    requests = [request] * args.requests
+                else:
+                    run_folder = 'runs/{}_c{}'.format(scenario, concurrency)
+                    requests = mutation_requests(scenario, root_dir, run_folder, args.mutation_requests, args)
+
+                reset_peak_rss(process.pid)
+                load = run_load(port, requests, concurrency)
+                result = summarize(scenario, concurrency, load, peak_rss_mb(process.pid))
+                results.append(result)
+                print('{scenario:<26} c={concurrency:<4} {rps:>9} req/s  p50 {p50_ms:>9}ms  p95 {p95_ms:>9}ms  p99 {p99_ms:>9}ms  '
+                      'errors {errors:<5} peak rss {peak_rss_mb}MB'.format(**result))
+    finally:
+        stop_server(process)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors = True)
+
+    report = {'meta': {'commit': git_commit(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                        'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'cpus': os.cpu_count(),
+                        'startup_seconds': round(startup_seconds, 3),
+                        'args': vars(args)},
+              'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent = 2)
+        print('Saved the results to {}'.format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file)['results'], args.threshold)
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+# Measures how long the app takes from starting its process to its first response, and how long importing it takes, with and without FAST_STARTUP
+#
+# Usage (from the root of the repository, with the requirements and uvicorn installed):
+#   python benchmarks/bench_startup.py --trials 10 --output startup.json
+#   python benchmarks/bench_startup.py --baseline startup.json
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from common import repo_path, git_commit, start_server, stop_server, percentile
+from trees import make_wide_folder, make_text_file
+
+# Each mode is a set of environment variables of the server. The path index is left to its default, since building it at startup is part of what is measured
+modes = {'default': {},
+        'fast': {'FAST_STARTUP': 'true'}}
+
+
+def import_seconds(root_dir: str, env: dict):
+    """Times importing the app in a new interpreter, which is most of the startup time
+
+    Args:
+        root_dir (str): The home directory of the app
+        env (dict): The environment variables of the mode
+
+    Returns:
+        float: The seconds it took to import app.app
+    """    
+
+    code = 'import time; start = time.perf_counter(); import app.app; print(time.perf_counter() - start)'
+    output = subprocess.check_output([sys.executable, '-c', code], cwd = repo_path, env = {**os.environ, 'ROOT_DIR': root_dir, **env})
+    return float(output.decode().split()[-1])
+
+
+def summarize(mode: str, startups: list, imports: list):
+    """Turns the times of the trials of a mode into its result
+
+    Args:
+        mode (str): The name of the mode
+        startups (list): The seconds from starting the server until its first response, of each trial
+        imports (list): The seconds to import the app, of each trial
+
+    Returns:
+        dict: The median, p95 and fastest times in milliseconds
+    """    
+
+    startups, imports = sorted(startups), sorted(imports)
+    milliseconds = lambda seconds: round(seconds * 1000, 1)
+
+    return {'mode': mode,
+            'trials': len(startups),
+            'first_response_p50_ms': milliseconds(percentile(startups, 0.50)),
+            'first_response_p95_ms': milliseconds(percentile(startups, 0.95)),
+            'first_response_min_ms': milliseconds(startups[0]),
+            'import_p50_ms': milliseconds(percentile(imports, 0.50)),
+            'import_min_ms': milliseconds(imports[0])}
+
+
+def compare(results: list, baseline: list, threshold: float):
+    """Compares results with the results of a previous version
+
+    Args:
+        results (list): The results of this run
+        baseline (list): The results of the previous version
+        threshold (float): The fraction by which the median time to the first response can grow before it is a regression
+
+    Returns:
+        list: A description of every regression
+    """    
+
+    previous = {result['mode']: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result['mode'])
+        if before is not None and result['first_response_p50_ms'] > before['first_response_p50_ms'] * (1 + threshold):
+            regressions.append('{}: first response after {}ms, was {}ms'.format(result['mode'], result['first_response_p50_ms'], before['first_response_p50_ms']))
+
+    return regressions
+
+
+def parse_args(argv: list = None):
+    """Parses the command line arguments
+
+    Args:
+        argv (list, optional): The arguments. Defaults to None, which uses sys.argv.
+
+    Returns:
+        argparse.Namespace: The parsed arguments
+    """    
+
+    parser = argparse.ArgumentParser(description = 'Measure the time from starting the app to its first response')
+    parser.add_argument('--trials', type = int, default = 10, help = 'Server starts per mode')
+    parser.add_argument('--modes', default = ','.join(modes), help = 'Comma separated modes to measure: ' + ', '.join(modes))
+    parser.add_argument('--path', default = '/', help = 'The request whose first response is timed')
+    parser.add_argument('--tree-files', type = int, default = 10000, help = 'Files in the tree that the app serves')
+    parser.add_argument('--cold', action = 'store_true', help = 'Remove the compiled bytecode of the app before every start, like a container image that was built without compiling it')
+    parser.add_argument('--env', action = 'append', default = [], metavar = 'NAME=VALUE', help = 'Environment variable of the server in every mode (can be repeated)')
+    parser.add_argument('--output', default = None, help = 'Save the results to this JSON file')
+    parser.add_argument('--baseline', default = None, help = 'Compare with the results of a previous run and exit with 1 on a regression')
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'Fraction of change that counts as a regression')
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    """Builds a tree, then starts and stops the server --trials times in every mode and saves and compares the results
+
+    Args:
+        argv (list, optional): The command line arguments. Defaults to None, which uses sys.argv.
+
+    Returns:
+        int: The exit code, 1 if a regression was found compared to the baseline
+    """    
+
+    args = parse_args(argv)
+    extra_env = dict(value.split('=', 1) for value in args.env)
+    if args.cold:
+        extra_env['PYTHONDONTWRITEBYTECODE'] = '1'
+
+    workdir = tempfile.mkdtemp(prefix = 'fsapi-startup-')
+    root_dir = os.path.join(workdir, 'root')
+    make_wide_folder(root_dir, args.tree_files)
+    make_text_file(os.path.join(root_dir, 'file.txt'), 64 * 1024)
+
+    results = []
+    try:
+        for mode in args.modes.split(','):
+            env = {**modes[mode], **extra_env}
+            startups, imports = [], []
+            for _ in range(args.trials):
+                # A new index file every time, so that the default mode always has to build it
+                trial_env = {'INDEX_PATH': os.path.join(workdir, 'index-{}.sqlite3'.format(len(startups))), **env}
+                if args.cold:
+                    shutil.rmtree(os.path.join(repo_path, 'app', '__pycache__'), ignore_errors = True)
+                imports.append(import_seconds(root_dir, trial_env))
+                process, port, seconds = start_server(root_dir, trial_env, ready_path = args.path)
+                stop_server(process)
+                startups.append(seconds)
+
+            result = summarize(mode, startups, imports)
+            results.append(result)
+            print('{mode:<10} first response p50 {first_response_p50_ms:>7}ms  p95 {first_response_p95_ms:>7}ms  min {first_response_min_ms:>7}ms  '
+                  'import p50 {import_p50_ms:>7}ms'.format(**result))
+    finally:
+        shutil.rmtree(workdir, ignore_errors = True)
+
+    report = {'meta': {'commit': git_commit(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                        'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'cpus': os.cpu_count(),
+                        'args': vars(args)},
+              'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent = 2)
+        print('Saved the results to {}'.format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file)['results'], args.threshold)
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+# Helpers shared by the benchmarks: running the app with uvicorn in a subprocess, sending requests and measuring the server
+import os
+import sys
+import math
+import time
+import json
+import socket
+import threading
+import subprocess
+import http.client
+
+# The root of the repository, where `uvicorn app.app:app` is run from like in the Dockerfile
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_commit():
+    """The commit being benchmarked, or None outside of a git checkout"""
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = repo_path, stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def free_port():
+    """Finds a free local TCP port for the server
+
+    Returns:
+        int: A port that nothing is listening on
+    """    
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(root_dir: str, env: dict = None, port: int = None, ready_path: str = '/cachestats', timeout: float = 60, workers: int = None):
+    """Starts the app with uvicorn (or with gunicorn and several workers) in a subprocess and waits until it answers requests
+
+    Args:
+        root_dir (str): The home directory of the app (ROOT_DIR)
+        env (dict, optional): Extra environment variables of the server, such as CACHE_MAX_ENTRIES. Defaults to None.
+        port (int, optional): The port to listen on. Defaults to None, which picks a free port.
+        ready_path (str, optional): The path requested to check whether the server is up. Defaults to '/cachestats'.
+        timeout (float, optional): How long to wait for the server in seconds. Defaults to 60.
+        workers (int, optional): Run this many worker processes with gunicorn_conf.py. Defaults to None, which runs a single uvicorn process.
+
+    Raises:
+        RuntimeError: If the server exits or does not answer within the timeout
+
+    Returns:
+        tuple: The server process, its port and the seconds it took until the first successful request
+    """    
+
+    port = port or free_port()
+    server_env = {**os.environ, 'ROOT_DIR': root_dir, **(env or {})}
+    command = [sys.executable, '-m', 'uvicorn', 'app.app:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    if workers:
+        server_env.update({'WORKERS': str(workers), 'BIND': '127.0.0.1:{}'.format(port), 'LOG_LEVEL': 'warning'})
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_conf.py', 'app.app:app']
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd = repo_path, env = server_env)
+
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError('The server exited with code {}'.format(process.returncode))
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout = 1)
+            connection.request('GET', ready_path)
+            if connection.getresponse().status == 200:
+                return process, port, time.perf_counter() - start
+        except OSError:
+            time.sleep(0.005)
+        finally:
+            connection.close()
+
+    stop_server(process)
+    raise RuntimeError('The server did not start within {} seconds'.format(timeout))
+
+
+def stop_server(process: subprocess.Popen):
+    """Stops a server started by start_server
+
+    Args:
+        process (subprocess.Popen): The server process
+    """    
+
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def process_tree(pid: int):
+    """Finds a process and its child processes, such as the workers of gunicorn, from /proc (Linux only)
+
+    Args:
+        pid (int): The process id
+
+    Returns:
+        list: The process id and the ids of its children
+    """    
+
+    try:
+        with open('/proc/{0}/task/{0}/children'.format(pid)) as children:
+            return [pid] + [int(child) for child in children.read().split()]
+    except OSError:
+        return [pid]
+
+
+def peak_rss_mb(pid: int):
+    """Reads the peak resident memory of a process and its children from /proc (Linux only)
+
+    Args:
+        pid (int): The process id
+
+    Returns:
+        float: The sum of the peak resident set sizes (VmHWM) in MB, or None if it cannot be read
+    """    
+
+    total = None
+    for process_id in process_tree(pid):
+        try:
+            with open('/proc/{}/status'.format(process_id)) as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        total = (total or 0) + int(line.split()[1]) / 1024
+        except OSError:
+            pass
+
+    return total
+
+
+def reset_peak_rss(pid: int):
+    """Resets the peak resident memory of a process and its children to their current size, so the peak of each benchmark can be measured separately (Linux only)
+
+    Args:
+        pid (int): The process id
+    """    
+
+    for process_id in process_tree(pid):
+        try:
+            with open('/proc/{}/clear_refs'.format(process_id), 'w') as clear_refs:
+                clear_refs.write('5')
+        except OSError:
+            pass
+
+
+def percentile(sorted_values: list, fraction: float):
+    """Gets a percentile of sorted values with the nearest rank method
+
+    Args:
+        sorted_values (list): The values, sorted in ascending order
+        fraction (float): The percentile as a fraction, such as 0.99
+
+    Returns:
+        float: The value at that percentile, or None if there are no values
+    """    
+
+    if not sorted_values:
+        return None
+
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_load(port: int, requests: list, concurrency: int, timeout: float = 120):
+    """Sends requests to the server from several threads, each with its own keep alive connection, and times every request
+
+    Args:
+        port (int): The port of the server
+        requests (list): The requests to send, as (method, path, JSON body or None, headers or None) tuples, which are split between the threads in turns
+        concurrency (int): The number of threads sending requests at the same time
+        timeout (float, optional): The timeout of each request in seconds. Defaults to 120.
+
+    Returns:
+        dict: The latencies of the requests in seconds, the number of requests that failed (status 400 or above, or a connection error) and the wall clock seconds of the whole run
+    """    
+
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(items):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout = timeout)
+        local_latencies, local_errors = [], 0
+        barrier.wait()
+
+        for method, path, body, headers in items:
+            headers = dict(headers or {})
+            payload = None
+            if body is not None:
+                payload = json.dumps(body).encode()
+                headers['Content-Type'] = 'application/json'
+
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body = payload, headers = headers)
+                response = connection.getresponse()
+                response.read()
+                failed = response.status >= 400
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout = timeout)
+                failed = True
+            local_latencies.append(time.perf_counter() - start)
+            local_errors += failed
+
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target = worker, args = (requests[index::concurrency],)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    # Start the clock once every thread has started and is ready to send
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+
+    return {'latencies': latencies, 'errors': errors[0], 'seconds': time.perf_counter() - start}
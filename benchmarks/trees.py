@@ -0,0 +1,90 @@
+# Builds the synthetic trees the benchmarks run against: wide folders, deep folders and large files
+import os
+
+
+def make_wide_folder(folder_path: str, files: int, file_bytes: int = 64):
+    """Creates a folder with many small files, to measure listing large folders
+
+    Args:
+        folder_path (str): The folder to create
+        files (int): The number of files in the folder
+        file_bytes (int, optional): The size of each file. Defaults to 64.
+    """    
+
+    os.makedirs(folder_path, exist_ok = True)
+    content = b'x' * file_bytes
+    for index in range(files):
+        with open(os.path.join(folder_path, 'file_{:07d}.txt'.format(index)), 'wb') as file:
+            file.write(content)
+
+
+def make_deep_folder(folder_path: str, levels: int):
+    """Creates a chain of nested folders with a small file at every level, to measure long paths and deep trees
+
+    Args:
+        folder_path (str): The top folder of the chain
+        levels (int): The number of nested folders
+
+    Returns:
+        str: The path of the deepest folder, relative to folder_path
+    """    
+
+    relative_path = '/'.join('level{}'.format(level) for level in range(levels))
+    os.makedirs(os.path.join(folder_path, relative_path), exist_ok = True)
+
+    for level in range(levels + 1):
+        level_path = os.path.join(folder_path, *['level{}'.format(index) for index in range(level)])
+        with open(os.path.join(level_path, 'file.txt'), 'w') as file:
+            file.write('A file at level {}\n'.format(level))
+
+    return relative_path
+
+
+def make_text_file(file_path: str, size_bytes: int, line_bytes: int = 64):
+    """Creates a text file of a given size made of lines of the same length
+
+    Args:
+        file_path (str): The file to create
+        size_bytes (int): The approximate size of the file
+        line_bytes (int, optional): The length of each line, including the line ending. Defaults to 64.
+
+    Returns:
+        int: The number of lines in the file
+    """    
+
+    lines = max(1, size_bytes // line_bytes)
+    block_lines = 16384
+    with open(file_path, 'w') as file:
+        for start in range(0, lines, block_lines):
+            block = range(start, min(start + block_lines, lines))
+            file.write(''.join('line {:09d} '.format(index).ljust(line_bytes - 1, '.') + '\n' for index in block))
+
+    return lines
+
+
+def make_numbered(folder_path: str, count: int, kind: str, files_inside: int = 0):
+    """Creates numbered files or folders to be deleted or emptied by the mutation benchmarks
+
+    Args:
+        folder_path (str): The folder to create them in
+        count (int): How many to create
+        kind (str): Either 'file' or 'folder'
+        files_inside (int, optional): For folders, the number of small files inside each of them. Defaults to 0.
+
+    Returns:
+        list: The names of what was created, relative to folder_path
+    """    
+
+    os.makedirs(folder_path, exist_ok = True)
+    names = []
+    for index in range(count):
+        if kind == 'file':
+            name = 'file_{:07d}.txt'.format(index)
+            with open(os.path.join(folder_path, name), 'w') as file:
+                file.write('Benchmark file\n')
+        else:
+            name = 'folder_{:07d}'.format(index)
+            make_wide_folder(os.path.join(folder_path, name), files_inside, 16)
+        names.append(name)
+
+    return names
@@ -0,0 +1,52 @@
+# Runs the app with several worker processes, each with its own event loop, behind gunicorn:
+#   gunicorn -c gunicorn_conf.py app.app:app
+#
+# The workers share their changes, the path index, the line indexes and background jobs through STATE_DIR, which is emptied when the server starts
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+from uvicorn.workers import UvicornWorker
+
+# Get the environment variables from the .sh script or the Dockerfile
+workers = int(os.environ.get("WORKERS", multiprocessing.cpu_count()))
+bind = os.environ.get("BIND", "{}:{}".format(os.environ.get("HOST", "0.0.0.0"), os.environ.get("PORT", 8000)))
+# How long an idle keep alive connection is kept open, and how many connections can wait to be accepted
+keepalive = int(os.environ.get("KEEPALIVE", 5))
+backlog = int(os.environ.get("BACKLOG", 2048))
+# A worker that does not respond for TIMEOUT seconds is restarted, and workers get GRACEFUL_TIMEOUT seconds to finish their requests when they are stopped
+timeout = int(os.environ.get("TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+loglevel = os.environ.get("LOG_LEVEL", "info")
+
+# Each worker imports the app after it is forked, because the thread pools and watchers of the app do not survive a fork
+preload_app = False
+
+state_dir = os.environ.setdefault("STATE_DIR", os.path.join(tempfile.gettempdir(), 'filesystem_restapi-state-{}'.format(bind.replace(':', '-').replace('/', '-'))))
+
+
+class FileSystemWorker(UvicornWorker):
+    """A uvicorn worker with the event loop (UVICORN_LOOP) and HTTP parser (UVICORN_HTTP) set from the environment, uvloop and httptools by default"""
+
+    CONFIG_KWARGS = {'loop': os.environ.get("UVICORN_LOOP", "uvloop"),
+                    'http': os.environ.get("UVICORN_HTTP", "httptools")}
+
+
+worker_class = 'gunicorn_conf.FileSystemWorker'
+
+
+def on_starting(server):
+    """Removes the shared state of the previous run before any worker starts, and records when this run started"""
+
+    os.makedirs(state_dir, exist_ok = True)
+    for name in ('jobs', 'lines'):
+        shutil.rmtree(os.path.join(state_dir, name), ignore_errors = True)
+    for name in ('changes.log', 'changes.log.1', 'changes.log.lock'):
+        try:
+            os.unlink(os.path.join(state_dir, name))
+        except FileNotFoundError:
+            pass
+    with open(os.path.join(state_dir, 'started'), 'w') as started:
+        started.write(str(time.time()))